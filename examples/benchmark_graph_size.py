@@ -0,0 +1,34 @@
+# Compare the size and pickling cost of 10k tile tasks embedding the full url and token
+# with tasks that share a single TileFetcher. No network access is needed.
+import time
+import pickle
+
+from gbdxtools.rda.fetch import TileFetcher, easyfetch
+from gbdxtools.rda.graph import VIRTUAL_RDA_URL
+
+NTILES = 10000
+token = "x" * 1024  # access tokens are around 1kb
+name = "image-5d2ed8c1-4a39-5b1a-a1b6-1f1b0f4e6a72"
+template = "{}/tile/idaho-virtual/{}/{}/{{x}}/{{y}}.tif".format(VIRTUAL_RDA_URL, "a" * 64, name[6:])
+chunks = (8, 256, 256)
+side = int(NTILES ** 0.5)
+
+def url_tasks():
+    return {(name, 0, y, x): (easyfetch, template.format(x=x, y=y), token, chunks)
+            for y in range(side) for x in range(side)}
+
+def fetcher_tasks():
+    fetcher = TileFetcher(template, token, chunks)
+    return {(name, 0, y, x): (fetcher, x, y) for y in range(side) for x in range(side)}
+
+for label, build in (("url + token per task", url_tasks), ("shared fetcher", fetcher_tasks)):
+    dsk = build()
+    start = time.time()
+    # distributed serializes tasks one at a time
+    nbytes = sum(len(pickle.dumps(task, protocol=pickle.HIGHEST_PROTOCOL)) for task in dsk.values())
+    elapsed = time.time() - start
+    print("{:>22}: {:8.2f} MB pickled per task, {:6.3f} s".format(label, nbytes / 1e6, elapsed))
+    start = time.time()
+    nbytes = len(pickle.dumps(dsk, protocol=pickle.HIGHEST_PROTOCOL))
+    elapsed = time.time() - start
+    print("{:>22}: {:8.2f} MB pickled as a graph, {:6.3f} s".format(label, nbytes / 1e6, elapsed))
@@ -0,0 +1,31 @@
+# Time building RDA op graphs of increasing depth and serializing them for registration.
+# Building a chain should grow linearly with its depth. No network access is needed.
+import time
+import json
+
+from gbdxtools.rda.interface import Op
+
+def chain(depth):
+    op = Op("DigitalGlobeStrip")(catId="1030010045539700", CRS="EPSG:4326", bands="MS")
+    for i in range(depth):
+        op = Op("Format")(op, dataType=str(i % 6))
+    return op
+
+def fan(width):
+    # every op reuses the source, as band math over one image does
+    src = Op("DigitalGlobeStrip")(catId="1030010045539700", CRS="EPSG:4326", bands="MS")
+    op = src
+    for i in range(width):
+        op = Op("BandMath")(op, Op("BandSelect")(src, bandIndices=[i % 8]), expression="$0 + $1")
+    return op
+
+for label, build in (("chain", chain), ("fan", fan)):
+    for n in (25, 50, 100):
+        start = time.time()
+        op = build(n)
+        built = time.time() - start
+        start = time.time()
+        payload = json.dumps(op.graph(conn=None), sort_keys=True)
+        serialized = time.time() - start
+        print("{:>5} {:4d} ops: {:5d} nodes, build {:7.4f} s, serialize {:7.4f} s, {:8d} bytes".format(
+            label, n, len(op._nodes), built, serialized, len(payload)))
@@ -14,6 +14,9 @@ from gbdxtools.images.sentinel import Sentinel2, Sentinel1
 from gbdxtools.images.s3_image import S3Image
 from gbdxtools.images.template_image import RDATemplateImage
 from gbdxtools.images.catalog_image import CatalogImage
+from gbdxtools.images.mosaic import mosaic
+from gbdxtools.images.stack import stack
+from gbdxtools.rda.io import open_zarr
 from gbdxtools.answerfactory import Recipe, Project
 from gbdxtools.workflow import Workflow as Workflows
 from gbdxtools.ordering import Ordering
@@ -1,4 +1,6 @@
 import os
+import time
+import threading
 from requests_futures.sessions import FuturesSession
 from requests.adapters import HTTPAdapter
 from gbdx_auth import gbdx_auth
@@ -8,6 +10,10 @@ from gbdxtools.rda.graph import VIRTUAL_RDA_URL
 
 auth = None
 
+# refresh tokens this many seconds before they expire
+TOKEN_REFRESH_MARGIN = int(os.environ.get('GBDX_TOKEN_REFRESH_MARGIN', 300))
+_refresh_lock = threading.Lock()
+
 
 def Auth(**kwargs):
     global auth
@@ -41,6 +47,8 @@ class _Auth(object):
             # This will throw an exception if your .ini file is not set properly
             self.gbdx_connection = gbdx_auth.get_session(kwargs.get('config_file'))
 
+        self._config_file = kwargs.get('config_file')
+
         def expire_token(r, *args, **kw):
             """
             Requests a new token if 401, retries request, mainly for auth v2 migration
@@ -53,11 +61,8 @@ class _Auth(object):
                 try:
                     # remove hooks so it doesn't get into infinite loop
                     r.request.hooks = None
-                    # expire the token
-                    gbdx_auth.expire_token(token_to_expire=self.gbdx_connection.token,
-                                           config_file=kwargs.get('config_file'))
-                    # re-init the session
-                    self.gbdx_connection = gbdx_auth.get_session(kwargs.get('config_file'))
+                    # expire the token and re-init the session
+                    self.refresh_token()
                     # make original request, triggers new token request first
                     return self.gbdx_connection.request(method=r.request.method, url=r.request.url)
 
@@ -78,3 +83,52 @@ class _Auth(object):
             header = {'User-Agent': os.environ['GBDX_USER']}
             self.gbdx_futures_session.headers.update(header)
             self.gbdx_connection.headers.update(header)
+
+    def refresh_token(self):
+        """
+        Expires the current token and replaces the session with one holding a new token
+        """
+        gbdx_auth.expire_token(token_to_expire=self.gbdx_connection.token,
+                               config_file=self._config_file)
+        self.gbdx_connection = gbdx_auth.get_session(self._config_file)
+        self.gbdx_connection.mount(VIRTUAL_RDA_URL, HTTPAdapter(max_retries=5))
+        if 'GBDX_USER' in os.environ:
+            self.gbdx_connection.headers.update({'User-Agent': os.environ['GBDX_USER']})
+        if hasattr(self, 'gbdx_futures_session'):
+            self.gbdx_futures_session.session = self.gbdx_connection
+
+
+class TokenProvider(object):
+    """
+    Refreshable access token for requests made outside of the requests session, like tile fetches.
+
+    The token is looked up from the current session each time it is used, refreshed before it expires
+    and after a 401 response. Providers hold no credentials themselves so they can be shared by every
+    task of a dask graph and pickled to other processes.
+
+    Args:
+        margin (int): seconds before expiry at which the token is refreshed
+    """
+    def __init__(self, margin=TOKEN_REFRESH_MARGIN):
+        self.margin = margin
+
+    @property
+    def token(self):
+        conn = Auth().gbdx_connection
+        token = getattr(conn, 'token', None)
+        expires_at = token.get('expires_at') if isinstance(token, dict) else None
+        if expires_at is not None and float(expires_at) - time.time() < self.margin:
+            return self.refresh(expired=conn.access_token)
+        return conn.access_token
+
+    def refresh(self, expired=None):
+        """
+        Refreshes the token unless another request already replaced the `expired` token
+        :param expired: the access token that was rejected
+        :return: the current access token
+        """
+        with _refresh_lock:
+            _auth = Auth()
+            if expired is None or expired == _auth.gbdx_connection.access_token:
+                _auth.refresh_token()
+            return _auth.gbdx_connection.access_token
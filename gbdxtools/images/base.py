@@ -1,17 +1,138 @@
 from __future__ import print_function
+import threading
+import warnings
+
+import numpy as np
+from shapely.geometry import box
 
 from gbdxtools.images.rda_image import RDAImage
+from gbdxtools.images.meta import GeoDaskImage
+from gbdxtools.images.bulk import bulk_images
+from gbdxtools.images.util.pansharpen import pansharpen, transfer_savings
+from gbdxtools.rda.util import AffineTransform
 
+# drivers configure the image class, serialize that step when images are built from several threads
+_drive_lock = threading.Lock()
 
 class RDABaseImage(RDAImage):
     __rda_id__ = None
+    _instance_attrs = RDAImage._instance_attrs + ("pansharpen_savings",)
     def __new__(cls, rda_id=None, **kwargs):
-        cls = cls.__Driver__(rda_id=rda_id, **kwargs).drive(cls)
-        self = super(RDABaseImage, cls).__new__(cls, cls.__driver__.payload, **kwargs)
+        driver = cls.__Driver__(rda_id=rda_id, **kwargs)
+        with _drive_lock:
+            cls = driver.drive(cls)
+        self = super(RDABaseImage, cls).__new__(cls, driver.payload, **kwargs)
+        self.__driver__ = driver
+        self.__rda_id__ = driver.rda_id
         return self.__post_new_hook__(**kwargs)
 
+    @classmethod
+    def bulk(cls, rda_ids, max_workers=None, **kwargs):
+        """ Creates many images concurrently
+
+        Args:
+            rda_ids (list): image ids, or dicts of keyword arguments for each image
+            max_workers (int): max number of images being built at the same time
+            kwargs: image options shared by every image
+
+        Returns:
+            list: images in the order of `rda_ids`, with the raised exception in place of each image that failed
+        """
+        return bulk_images(cls, rda_ids, max_workers=max_workers, **kwargs)
+
     def __post_new_hook__(self, **kwargs):
-        return self.aoi(**kwargs)
+        img = self.aoi(**kwargs)
+        if self.options.get("pansharpen") == "local":
+            img = img._pansharpen_locally(**kwargs)
+        return img
+
+    def _pansharpen_locally(self, **kwargs):
+        """ Sharpens this multispectral image with the pan band of the same image and area
+
+        The MS bands are fetched at their native resolution and the pan band once, instead of
+        every band at pan resolution. The bytes saved are recorded in `pansharpen_savings`.
+        """
+        pan = self.__class__(self.__rda_id__, **dict(kwargs, band_type="pan", pansharpen=False))
+        # the MS bounds are snapped to MS pixels, the pan bounds to pan pixels
+        tolerance = (self.bounds[2] - self.bounds[0]) / float(self.shape[-1])
+        if not np.allclose(self.bounds, pan.bounds, rtol=0, atol=tolerance):
+            raise ValueError("The MS and pan images cover different areas: {} and {}".format(self.bounds, pan.bounds))
+        darr = pansharpen(self, pan, weights=getattr(self, "_pansharpen_weights", None))
+        img = super(GeoDaskImage, self.__class__).__new__(self.__class__, darr,
+                                                          __geo_interface__=pan.__geo_interface__,
+                                                          __geo_transform__=pan.__geo_transform__)
+        # the pixels are on the pan grid with the MS bands, as those of the RDA pansharpened graph,
+        # which is only registered when its metadata is asked for
+        img.__geo__ = pan.__geo__
+        img._rda_op = self._pansharpened_graph()
+        img.__driver__ = self.__driver__
+        img.__rda_id__ = self.__rda_id__
+        img.pansharpen_savings = transfer_savings(self, pan)
+        return img
+
+    def _pansharpened_graph(self):
+        """ The RDA graph of this image pansharpened by RDA, built with the driver's pansharpen option """
+        return self._build_graph(self.__rda_id__, **dict(self.options, pansharpen=True))
+
+    def _metadata_histogram(self, bands=None):
+        # RDA histograms of the pansharpened graph are not those of the local pansharpening
+        if self.options.get("pansharpen") == "local":
+            return None
+        return super(RDABaseImage, self)._metadata_histogram(bands)
+
+    def pushdown(self, bands=None, dtype=None):
+        if self.options.get("pansharpen") == "local":
+            raise ValueError("Locally pansharpened images are not read from their RDA graph")
+        return super(RDABaseImage, self).pushdown(bands=bands, dtype=dtype)
+
+    def _coarsened(self, factor, gsd=None):
+        """ Rebuilds the image graph at a coarser GSD and selects the same area
+
+        Areas covered by the overview pyramid are read from it instead. Otherwise RDA resamples
+        the tiles, so the bytes fetched shrink with the square of the factor.
+        Images whose bands no longer match their graph, or whose driver has no `gsd` option,
+        are decimated locally.
+        """
+        img = self._from_overviews(factor)
+        if img is not None:
+            return img
+        if ("gsd" not in (self.__supported_options__ or []) or self.ndim != 3
+                or not isinstance(self.__geo_transform__, AffineTransform)
+                or self.shape[0] != self.rda.metadata["image"]["numBands"]):
+            return GeoDaskImage._coarsened(self, factor, gsd=gsd)
+        gsd = gsd if gsd is not None else abs(self.affine.a) * factor
+        try:
+            coarse = self.__class__(self.__rda_id__, **dict(self.options, gsd=gsd))[box(*self.bounds)]
+        except Exception as e:
+            warnings.warn("Decimating locally, could not rebuild the image at gsd {}: {}".format(gsd, e))
+            return GeoDaskImage._coarsened(self, factor, gsd=gsd)
+        return self._with_fetch_plugins(coarse)
+
+    def _regridded(self, proj, gsd):
+        """ Rebuilds the image graph in `proj` at `gsd` and selects the same area
+
+        RDA reprojects the tiles, images whose driver has no `proj` and `gsd` options are warped
+        locally.
+        """
+        if self._on_grid(proj, gsd):
+            return self
+        if (not {"proj", "gsd"} <= set(self.__supported_options__ or []) or self.ndim != 3
+                or self.shape[0] != self.rda.metadata["image"]["numBands"]):
+            return GeoDaskImage._regridded(self, proj, gsd)
+        try:
+            area = self._reproject(box(*self.bounds), from_proj=self.proj, to_proj=proj)
+            img = self.__class__(self.__rda_id__, **dict(self.options, proj=proj, gsd=gsd))[area]
+        except Exception as e:
+            warnings.warn("Warping locally, could not rebuild the image in {} at gsd {}: {}".format(proj, gsd, e))
+            return GeoDaskImage._regridded(self, proj, gsd)
+        return self._with_fetch_plugins(img)
+
+    def _with_fetch_plugins(self, img):
+        # fetch plugins installed on the instance, see CatalogImage
+        for attr in ("__dask_optimize__", "__fetch__"):
+            if attr in self.__dict__:
+                setattr(img, attr, self.__dict__[attr])
+        return img
 
     @property
     def options(self):
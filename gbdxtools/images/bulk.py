@@ -0,0 +1,36 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# the requests session keeps 10 connections per host, more workers only queue on the pool
+BULK_WORKERS = int(os.environ.get('GBDX_BULK_WORKERS', 10))
+
+def _build(constructor, arg, kwargs):
+    try:
+        if isinstance(arg, dict):
+            return constructor(**dict(kwargs, **arg))
+        return constructor(arg, **kwargs)
+    except Exception as e:
+        return e
+
+def bulk_images(constructor, args, max_workers=None, **kwargs):
+    """ Creates many images concurrently
+
+    Catalog lookups, graph registrations and metadata fetches of different images are
+    overlapped, at most `max_workers` images are being built at any time.
+
+    Args:
+        constructor: image class or factory, e.g. CatalogImage, IdahoImage or RDATemplateImage
+        args (list): one entry per image, either the image id or a dict of keyword arguments
+        max_workers (int): max number of images being built at the same time
+        kwargs: keyword arguments shared by every image
+
+    Returns:
+        list: images in the order of `args`, with the raised exception in place of each image that failed
+    """
+    args = list(args)
+    if not args:
+        return []
+    max_workers = min(max_workers or BULK_WORKERS, len(args))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_build, constructor, arg, kwargs) for arg in args]
+        return [f.result() for f in futures]
@@ -7,11 +7,35 @@ from gbdxtools import WV01, WV02, WV03_SWIR, WV03_VNIR, WV04, LandsatImage, Ikon
 from gbdxtools.images.rda_image import RDAImage, GraphMeta
 from gbdxtools.rda.error import UnsupportedImageType
 from gbdxtools.images.util.image import vector_services_query, can_acomp, is_ordered
+from gbdxtools.images.bulk import bulk_images
+from gbdxtools.images.worldview import WorldViewImage
+from gbdxtools.images.drivers import WorldViewDriver
+from gbdxtools.rda.cache import rda_cache
 
 from shapely import wkt
 from shapely.geometry import box
+import os
+import re
 import json
+import threading
 import types as pytypes
+from concurrent.futures import ThreadPoolExecutor
+
+# WV02 and WV03 VNIR catalog ids, both are built from the same graph as WorldViewImage
+SPECULATIVE_CAT_ID = re.compile(r"^10[34]0")
+# catalog record types built from that graph
+SPECULATIVE_TYPES = ("WV02", "WV03_VNIR")
+SPECULATE = os.environ.get("GBDX_SPECULATE", "1").lower() not in ("0", "false", "no")
+
+_speculation = None
+_speculation_lock = threading.Lock()
+
+def _speculation_executor():
+    global _speculation
+    with _speculation_lock:
+        if _speculation is None:
+            _speculation = ThreadPoolExecutor(max_workers=4)
+        return _speculation
 
 
 class CatalogImage(object):
@@ -25,10 +49,12 @@ class CatalogImage(object):
         dtype (str): The dtype for the returned image (only valid for Worldview). One of: "int8", "int16", "uint16", "int32", "float32", "float64"
         band_type (str): The product spec / band type for the image returned (band_type='MS'|'Pan')
         bands (list of int): bands to include in the image. Bands are zero-indexed.
-        pansharpen (bool): Whether or not to return a pansharpened image (defaults to False)
+        pansharpen (bool or str): Whether or not to return a pansharpened image (defaults to False), "local" fetches MS and pan and sharpens them on the client
         acomp (bool): Perform atmospheric compensation on the image (defaults to False, i.e. Top of Atmosphere value)
         gsd (float): The Ground Sample Distance (GSD) of the image. Must be defined in the same projected units as the image projection.
         dra (bool): Perform Dynamic Range Adjustment (DRA) on the image. DRA will override the dtype and return int8 data.  
+        local_correction (bool or str): Fetch DN and apply the correction (correctionType, or "DN", "RADIANCE", "TOAREFLECTANCE") on the client (only valid for Worldview)
+        calibration (dict): IDAHO image metadata used for local_correction when the image metadata does not include it
 
     Attributes:
         affine (list): The image affine transformation
@@ -50,6 +76,20 @@ class CatalogImage(object):
                     setattr(inst, attrname, getattr(fplg, attrname))
         return inst
 
+    @classmethod
+    def bulk(cls, cat_ids, max_workers=None, **kwargs):
+      """
+        Creates images for many Catalog IDs concurrently.
+
+        Args:
+          cat_ids (list): Catalog IDs, or dicts of keyword arguments for each image (e.g. {"cat_id": ..., "bbox": ...})
+          max_workers (int): max number of images being built at the same time
+          kwargs: image options shared by every image, see CatalogImage
+        Returns:
+          images (list): images in the order of `cat_ids`, with the raised exception in place of each image that failed
+      """
+      return bulk_images(cls, cat_ids, max_workers=max_workers, **kwargs)
+
     @classmethod
     def is_ordered(cls, cat_id):
       """
@@ -83,11 +123,41 @@ class CatalogImage(object):
                 raise ValueError("Catalog Images must be initiated by a Catalog Id or an RDA Graph Id")
         query = "item_type:GBDXCatalogRecord AND (attributes.catalogID.keyword:{} OR id:{})".format(cat_id, cat_id)
         query += " AND NOT item_type:DigitalGlobeAcquisition"
+        speculative = cls._register_speculatively(cat_id, **kwargs)
         result = vector_services_query(query, count=1)
         if len(result) == 0:
+            if speculative is not None:
+                speculative.cancel()
             raise Exception('Could not find a catalog entry for the given id: {}'.format(cat_id))
-        else:
-            return cls._image_class(result[0], **kwargs)
+        if speculative is not None:
+            if any(t in SPECULATIVE_TYPES for t in result[0]['properties']['item_type']):
+                # wait for the registration to land in the cache rather than registering twice
+                speculative.exception()
+            else:
+                # the catalog id prefix guessed wrong, the image is built from another graph
+                speculative.cancel()
+        return cls._image_class(result[0], **kwargs)
+
+    @classmethod
+    def _register_speculatively(cls, cat_id, **kwargs):
+        """
+          Registers the WorldView graph and fetches its metadata while the catalog query is in flight.
+
+          The registration and metadata are handed over to the image through the RDA cache, so this
+          only runs when the cache is enabled and the id looks like a WV02 or WV03 VNIR catalog id.
+          The image type is only known once the catalog query returns, so the guess is checked
+          against the catalog record before the image waits on the registration.
+          Set GBDX_SPECULATE=0 to never register speculatively.
+          Returns a future, or None when nothing was started.
+        """
+        if not SPECULATE or not rda_cache.enabled or not SPECULATIVE_CAT_ID.match(str(cat_id)):
+            return None
+        try:
+            driver = WorldViewDriver(rda_id=cat_id, **kwargs)
+            op = WorldViewImage._build_graph(cat_id, **driver.options)
+        except Exception:
+            return None
+        return _speculation_executor().submit(lambda: op.metadata)
 
     @classmethod
     def _image_class(cls, rec, **kwargs):
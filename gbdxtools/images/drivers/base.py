@@ -1,5 +1,6 @@
 from gbdxtools.rda.interface import RDA
 from gbdxtools.images.exceptions import *
+from gbdxtools.rda.error import IncompatibleOptions
 
 import collections
 import abc
@@ -38,7 +39,9 @@ WV_MODERN_OPTIONS = {
     "acomp": False,
     "pansharpen": False,
     "correctionType": "TOAREFLECTANCE",
-    "dtype": "float32"
+    "dtype": "float32",
+    "local_correction": False,
+    "calibration": None
     }
 
 
@@ -188,6 +191,19 @@ class WorldViewDriver(RDADaskImageDriver):
     def configure_options(cls, options):
         if options["acomp"]:
             options["correctionType"] = "ACOMP"
-        if options["pansharpen"]:
+        if options["pansharpen"] == "local":
+            # MS is fetched here, the pan band is fetched and sharpened by the image
+            options["band_type"] = "MS"
+        elif options["pansharpen"]:
             options["band_type"] = "PANSHARP"
+        if options["local_correction"]:
+            if options["acomp"] or options["dra"]:
+                raise IncompatibleOptions("Atmospheric compensation and DRA cannot be applied on the client")
+            if options["pansharpen"] == "local":
+                raise IncompatibleOptions("Client side corrections cannot be combined with local pansharpening")
+            # fetch DN once and apply the requested correction to each chunk
+            if options["local_correction"] is True:
+                options["local_correction"] = options["correctionType"]
+            options["correctionType"] = "DN"
+            options["dtype"] = "uint16"
         return options
@@ -6,13 +6,19 @@ from collections import Container, namedtuple
 import warnings
 import math
 
-from gbdxtools.rda.io import to_geotiff
+from gbdxtools.rda.io import to_geotiff, to_cog, to_zarr
+from gbdxtools.rda.local import compile_expressions
 from gbdxtools.rda.util import RatPolyTransform, AffineTransform, pad_safe_positive, pad_safe_negative, RDA_TO_DTYPE, preview, get_proj
 from gbdxtools.images.mixins import PlotMixin, BandMethodsTemplate, Deprecations
+from gbdxtools.images.mixins.geo import INDEX_PRESETS
+from gbdxtools.images.util.histogram import stretch as stretch_bands
+from gbdxtools.images.util.inference import predict_block, min_chunks
+from gbdxtools.images.util.polygonize import polygonize_block, map_bounded, SeamStitcher
 
 from shapely import ops, wkt
 from shapely.geometry import box, shape, mapping, asShape
 from shapely.geometry.base import BaseGeometry
+from shapely.affinity import affine_transform
 
 import skimage.transform as tf
 
@@ -74,11 +80,15 @@ class DaskImage(da.Array):
     def __daskmeta__(self):
         return DaskMeta(self)
 
-    def read(self, bands=None, **kwargs):
+    def read(self, bands=None, out=None, **kwargs):
         """Reads data from a dask array and returns the computed ndarray matching the given bands
 
+        When `out` is given each chunk is written into it as soon as it is fetched, so memory use
+        is bounded by the chunks in flight rather than the size of the image.
+
         Args:
             bands (list): band indices to read from the image. Returns bands in the order specified in the list of bands.
+            out (ndarray): optional, an array (e.g. a `numpy.memmap`) of the same shape to read the image into
 
         Returns:
             ndarray: a numpy array of image data
@@ -86,7 +96,31 @@ class DaskImage(da.Array):
         arr = self
         if bands is not None:
             arr = self[bands, ...]
-        return arr.compute(scheduler=threaded_get)
+        if out is None:
+            return arr.compute(scheduler=threaded_get)
+        if tuple(out.shape) != tuple(arr.shape):
+            raise ValueError("Output shape {} does not match the image shape {}".format(out.shape, arr.shape))
+        # chunks are written to disjoint regions of out, no lock is needed
+        da.store(arr, out, lock=False, scheduler=threaded_get)
+        return out
+
+    def read_to_memmap(self, path, bands=None, **kwargs):
+        """Reads the image into a disk-backed `numpy.memmap`, for images larger than memory
+
+        Args:
+            path (str): path of the file backing the memmap, it is created or overwritten
+            bands (list): band indices to read from the image. Returns bands in the order specified in the list of bands.
+
+        Returns:
+            memmap: a numpy memmap of image data, usable as a regular ndarray
+        """
+        arr = self
+        if bands is not None:
+            arr = self[bands, ...]
+        out = np.memmap(path, dtype=arr.dtype, mode='w+', shape=arr.shape)
+        arr.read(out=out, **kwargs)
+        out.flush()
+        return out
 
     def randwindow(self, window_shape):
         """Get a random window of a given shape from within an image
@@ -216,6 +250,74 @@ class GeoDaskImage(DaskImage, Container, PlotMixin, BandMethodsTemplate, Depreca
     def asShape(self):
         return asShape(self)
 
+    def read(self, bands=None, target_shape=None, gsd=None, **kwargs):
+        """Reads data from the image and returns the computed ndarray matching the given bands
+
+        Args:
+            bands (list): band indices to read from the image. Returns bands in the order specified in the list of bands.
+            target_shape (tuple): optional, (rows, columns) to read the image at, see `at_resolution`
+            gsd (float): optional, ground sample distance to read the image at, see `at_resolution`
+            out (ndarray): optional, an array (e.g. a `numpy.memmap`) of the same shape to read the image into
+
+        Returns:
+            ndarray: a numpy array of image data
+        """
+        img = self.at_resolution(target_shape=target_shape, gsd=gsd)
+        return super(GeoDaskImage, img).read(bands=bands, **kwargs)
+
+    def at_resolution(self, target_shape=None, gsd=None):
+        """ The image at a coarser resolution, sized for previews
+
+        Images built from RDA are rebuilt at the coarser GSD, so fewer and smaller tiles are
+        fetched. Other images are decimated with nearest neighbour sampling.
+
+        Args:
+            target_shape (tuple): optional, (rows, columns) the image should still cover. The image
+                is reduced by the largest whole factor that keeps it at least this large.
+            gsd (float): optional, ground sample distance in units of the image projection
+
+        Returns:
+            image: the image at the reduced resolution, or the image itself when it is not larger
+        """
+        if gsd is not None:
+            if not isinstance(self.__geo_transform__, AffineTransform):
+                return self
+            factor = int(gsd / abs(self.affine.a) + 1e-6)
+        elif target_shape is not None:
+            factor = int(min(self.shape[-2] / float(target_shape[0]), self.shape[-1] / float(target_shape[1])))
+        else:
+            return self
+        if factor <= 1:
+            return self
+        return self._coarsened(factor, gsd=gsd)
+
+    def _coarsened(self, factor, gsd=None):
+        # every tile is still fetched, only the sampled pixels are kept
+        if not isinstance(self.__geo_transform__, AffineTransform):
+            return self
+        step = slice(None, None, factor)
+        darr = da.Array.__getitem__(self, (Ellipsis, step, step))
+        gt = AffineTransform(self.affine * Affine.scale(factor), proj=self.proj)
+        return GeoDaskImage(darr, __geo_interface__=self.__geo_interface__, __geo_transform__=gt)
+
+    def _select_bands(self, bands):
+        """ The image with only `bands`, selected before it is read """
+        return self[bands, ...]
+
+    def _on_grid(self, proj, gsd):
+        """ True when the image is north up in `proj` with square pixels of size `gsd` """
+        if not isinstance(self.__geo_transform__, AffineTransform) or self.proj is None:
+            return False
+        a = self.affine
+        return (self.proj.upper() == proj.upper() and a.b == 0 and a.d == 0 and a.e < 0
+                and abs(a.a - gsd) <= 1e-6 * gsd and abs(-a.e - gsd) <= 1e-6 * gsd)
+
+    def _regridded(self, proj, gsd):
+        """ The image in `proj` at `gsd`, warped unless it is already on such a grid """
+        if self._on_grid(proj, gsd):
+            return self
+        return self.warp(proj=proj, gsd=gsd)
+
     @property
     def affine(self):
         """ The geo transform of the image
@@ -302,8 +404,14 @@ class GeoDaskImage(DaskImage, Container, PlotMixin, BandMethodsTemplate, Depreca
             path (str): optional, path to write the geotiff file to, default is ./output.tif
             proj (str): optional, EPSG string of projection to reproject to
             spec (str): optional, if set to 'rgb', write out color-balanced 8-bit RGB tif
+            stretch (list): optional, with spec='rgb', percentiles the bands are stretched between on the
+                client, see `stretched`, instead of balanced by RDA
             bands (list): optional, list of bands to export. If spec='rgb' will default to RGB bands,
                 otherwise will export all bands
+            tiled (bool): optional, write a tiled geotiff with blocks aligned to the image chunks
+            compress (str): optional, one of 'deflate', 'lzw', 'zstd' or 'packbits'
+            predictor (int): optional, compression predictor (2 for integer, 3 for floating point data)
+            progress (bool): optional, print write progress and throughput
 
         Returns:
             str: path the geotiff was written to """
@@ -312,6 +420,201 @@ class GeoDaskImage(DaskImage, Container, PlotMixin, BandMethodsTemplate, Depreca
             kwargs['proj'] = self.proj
         return to_geotiff(self, **kwargs)
 
+    def to_cog(self, **kwargs):
+        """ Creates a cloud-optimized geotiff with internal overviews on the filesystem
+
+        Overviews are reduced from the image chunks as they are fetched, so the image is only read once.
+
+        Args:
+            path (str): optional, path to write the geotiff file to, default is ./output.tif
+            proj (str): optional, EPSG string of projection to reproject to
+            spec (str): optional, if set to 'rgb', write out color-balanced 8-bit RGB tif
+            stretch (list): optional, with spec='rgb', percentiles the bands are stretched between on the
+                client, see `stretched`, instead of balanced by RDA
+            bands (list): optional, list of bands to export. If spec='rgb' will default to RGB bands,
+                otherwise will export all bands
+            overviews (list): optional, decimation factors of the overview levels, e.g. [2, 4, 8]
+            resampling (str): optional, 'average' (default) or 'nearest'
+            compress (str): optional, one of 'deflate', 'lzw', 'zstd' or 'packbits'
+            predictor (int): optional, compression predictor (2 for integer, 3 for floating point data)
+
+        Returns:
+            str: path the geotiff was written to """
+
+        if 'proj' not in kwargs:
+            kwargs['proj'] = self.proj
+        return to_cog(self, **kwargs)
+
+    def to_zarr(self, path, **kwargs):
+        """ Writes the image chunks to a zarr store with the image geo transform, projection and RDA metadata
+
+        The store can be opened again as a lazy image with `gbdxtools.open_zarr`.
+
+        Args:
+            path (str): path of the zarr store directory
+            overwrite (bool): optional, replace an existing store, defaults to False
+            compressor: optional, numcodecs compressor to use for the chunks
+
+        Returns:
+            str: path the zarr store was written to """
+
+        return to_zarr(self, path, **kwargs)
+
+    def bandmath(self, expressions, bands=None, dtype="float32"):
+        """ Lazily evaluates band math expressions on each chunk of the image
+
+        Only the bands used by the expressions are read. All expressions are evaluated in a
+        single task per chunk.
+
+        Args:
+            expressions (str or list): expressions such as "($6 - $4) / ($6 + $4)" or "(nir - red) / (nir + red)"
+            bands (list or dict): optional, band indices referenced as $0, $1, ... or a dict of band names to indices
+            dtype (str): optional, "float32" (default) or "float16"
+
+        Returns:
+            GeoDaskImage: one band per expression
+        """
+        used, evaluate = compile_expressions(expressions, bands=bands)
+        dtype = np.dtype(dtype)
+        if dtype.kind != "f":
+            raise ValueError("Band math output must be a floating point dtype, got {}".format(dtype))
+        arr = self._select_bands(used)
+        if len(arr.chunks[0]) > 1:
+            arr = arr.rechunk({0: arr.shape[0]})
+        nexpr = len(evaluate(np.zeros((len(used), 1, 1), dtype=np.float32)))
+        darr = da.Array.map_blocks(arr, lambda block: evaluate(block).astype(dtype), dtype=dtype,
+                                   chunks=((nexpr,),) + arr.chunks[1:])
+        return GeoDaskImage(darr, __geo_interface__=self.__geo_interface__,
+                            __geo_transform__=self.__geo_transform__)
+
+    def index(self, name, dtype="float32"):
+        """ Lazily computes a spectral index preset
+
+        Args:
+            name (str): "ndvi" or "ndwi"
+            dtype (str): optional, "float32" (default) or "float16"
+
+        Returns:
+            GeoDaskImage: a single band image of the index
+        """
+        try:
+            expression, bands = INDEX_PRESETS[name]
+        except KeyError:
+            raise KeyError("Unknown index {}, use one of {}".format(name, sorted(INDEX_PRESETS)))
+        return self.bandmath(expression, bands=getattr(self, bands), dtype=dtype)
+
+    def stretched(self, bands=None, stretch=[2, 98], gamma=None):
+        """ Lazily contrast stretches bands of the image to 8 bits
+
+        The stretch limits are percentiles of the image histograms, see `histogram`. The stretch
+        is applied to each chunk as it is read or written, so images larger than memory can be
+        stretched. Histograms not found in the image metadata are counted first, in a separate
+        pass over the image.
+
+        Args:
+            bands (list): optional, bands to stretch, defaults to the RGB bands
+            stretch (list): optional, percentiles mapped to 0 and 255, default is [2, 98]
+            gamma (float): optional, gamma adjustment applied after the stretch
+
+        Returns:
+            GeoDaskImage: uint8 image of the bands
+        """
+        bands = self._rgb_bands if bands is None else bands
+        limits = self.histogram(bands).percentile(stretch)
+        arr = self[bands, ...]
+        if len(arr.chunks[0]) > 1:
+            arr = arr.rechunk({0: arr.shape[0]})
+        darr = da.Array.map_blocks(arr, partial(stretch_bands, limits=limits, gamma=gamma), dtype=np.uint8)
+        return GeoDaskImage(darr, __geo_interface__=self.__geo_interface__,
+                            __geo_transform__=self.__geo_transform__)
+
+    def predict(self, fn, window=(256, 256), overlap=32, batch_size=8, bands_out=None, dtype="float32"):
+        """ Lazily applies a model over sliding windows of the image
+
+        Windows overlapping by `overlap` pixels are passed to `fn` in batches and the predictions
+        of overlapping windows are blended with cosine weights, so window seams do not show. Each
+        chunk is predicted with a halo of `overlap` pixels taken from its neighbouring chunks, every
+        tile is fetched once however many windows cover it. `fn` may be called from several threads.
+
+        Args:
+            fn: function mapping a (windows, bands, y, x) batch to (windows, bands_out, y, x) predictions
+            window (tuple): optional, (rows, columns) of a window, default is (256, 256)
+            overlap (int): optional, pixels shared by neighbouring windows, default is 32
+            batch_size (int): optional, max number of windows passed to `fn` at once, default is 8
+            bands_out (int): optional, number of bands of the predictions, found by calling `fn` on a blank window by default
+            dtype (str): optional, data type of the predictions, default is "float32"
+
+        Returns:
+            GeoDaskImage: the predictions on the grid of the image, written or read chunk by chunk
+        """
+        wy, wx = window
+        if not 0 <= overlap < min(wy, wx):
+            raise ValueError("The overlap must be smaller than the window, got {} for {}".format(overlap, window))
+        if bands_out is None:
+            bands_out = np.asarray(fn(np.zeros((1, self.shape[0], wy, wx), dtype=self.dtype))).shape[1]
+        # chunks at least a window large, in a single chunk along bands
+        chunks = [(self.shape[0],)]
+        for axis, size in ((1, wy), (2, wx)):
+            axis_chunks = da.core.normalize_chunks((max(self.chunksize[axis], size),), (self.shape[axis],))[0]
+            chunks.append(min_chunks(axis_chunks, size))
+        arr = da.Array.rechunk(self, tuple(chunks))
+        depth = {0: 0, 1: min(overlap, self.shape[1]), 2: min(overlap, self.shape[2])}
+        if overlap:
+            arr = da.overlap.overlap(arr, depth=depth, boundary="reflect")
+        darr = arr.map_blocks(partial(predict_block, fn=fn, window=window, overlap=overlap,
+                                      batch_size=batch_size, bands_out=bands_out),
+                              dtype=np.float32, chunks=((bands_out,),) + arr.chunks[1:])
+        if overlap:
+            darr = da.overlap.trim_internal(darr, depth)
+        return GeoDaskImage(darr.astype(dtype), __geo_interface__=self.__geo_interface__,
+                            __geo_transform__=self.__geo_transform__)
+
+    def polygonize(self, band=0, values=None, nodata=0, simplify=None, proj=None, max_workers=None):
+        """ Vectorizes the regions of equal pixel values of a band, chunk by chunk
+
+        Chunks are read and vectorized in parallel. Polygons crossing seams between chunks are
+        merged and yielded once the chunks across those seams are done, the others as soon as
+        their chunk is, so the features of an image larger than memory can be streamed, e.g.
+        into `Vectors.create_iteratively`.
+
+        Args:
+            band (int): optional, the band holding the class values, default is 0
+            values (list): optional, values to vectorize, defaults to every value but `nodata`
+            nodata: optional, value of pixels left out, default is 0
+            simplify (float): optional, tolerance of the polygon simplification in units of the output projection
+            proj (str): optional, projection of the polygons, defaults to the image projection
+            max_workers (int): optional, number of chunks vectorized at the same time
+
+        Yields:
+            dict: GeoJSON features with the pixel value in the "value" property
+        """
+        arr = da.Array.__getitem__(self, band) if self.ndim == 3 else self
+        rows, cols = np.cumsum((0,) + arr.chunks[0]), np.cumsum((0,) + arr.chunks[1])
+        chunks = ((block, index) for index, block in np.ndenumerate(arr.to_delayed()))
+
+        def vectorize(block, index):
+            data = block.compute(scheduler="sync")
+            return index, polygonize_block(data, rows[index[0]], cols[index[1]], values=values, nodata=nodata)
+
+        stitcher = SeamStitcher(rows, cols)
+        for index, shapes in map_bounded(vectorize, chunks, max_workers or threads):
+            for polygon, value in stitcher.add(index, shapes):
+                yield self._polygon_feature(polygon, value, simplify, proj)
+        for polygon, value in stitcher.flush():
+            yield self._polygon_feature(polygon, value, simplify, proj)
+
+    def _polygon_feature(self, polygon, value, simplify=None, proj=None):
+        if isinstance(self.__geo_transform__, AffineTransform):
+            a = self.affine
+            geom = affine_transform(polygon, [a.a, a.b, a.d, a.e, a.c, a.f])
+        else:
+            geom = ops.transform(self.__geo_transform__.fwd, polygon)
+        if proj is not None and self.proj is not None and proj.upper() != self.proj.upper():
+            geom = self._reproject(geom, from_proj=self.proj, to_proj=proj)
+        if simplify:
+            geom = geom.simplify(simplify, preserve_topology=True)
+        return {"type": "Feature", "geometry": mapping(geom), "properties": {"value": value}}
+
     def preview(self, **kwargs):
         preview(self, **kwargs)
 
@@ -11,12 +11,24 @@ from shapely.geometry import box, shape, mapping, asShape
 from gbdxtools.deprecate import deprecation
 
 import numpy as np
+from gbdxtools.rda.local import compile_expressions
+from gbdxtools.images.util.histogram import Histogram, sketch, stretch, equalize
+from dask.base import is_dask_collection
 try:
     from matplotlib import pyplot as plt
     has_pyplot = True
 except:
     has_pyplot = False
 
+# dots per inch of plots when matplotlib is not configured
+PLOT_DPI = 100
+
+# spectral index presets, expressions over the bands of the image property named second
+INDEX_PRESETS = {
+    "ndvi": ("($0 - $1) / ($0 + $1)", "_ndvi_bands"),
+    "ndwi": ("($1 - $0) / ($0 + $1)", "_ndwi_bands")
+}
+
 
 class PlotMixin(object):
 
@@ -26,6 +38,8 @@ class PlotMixin(object):
         This method shares the same arguments as plot(). It will perform visual adjustment on the
         image and prepare the data for plotting in MatplotLib. Values are converted to an
         appropriate precision and the axis order is changed to put the band axis last.
+
+        Pass `target_shape` or `gsd` to read the image at a coarser resolution, see `at_resolution`.
         '''
 
         if "bands" in kwargs:
@@ -50,7 +64,7 @@ class PlotMixin(object):
             return self.histogram_stretch(use_bands, stretch=[0, 100], **kwargs)
         # DRA'ed images should be left alone if not explicitly adjusted
         elif kwargs["histogram"] == "ignore" or self.options.get('dra'):
-            data = self._read(self[use_bands,...], **kwargs)
+            data = self._read_bands(use_bands, **kwargs)
             return np.rollaxis(data, 0, 3)
         else:
             raise KeyError('Unknown histogram parameter, use "equalize", "match", "minmax", or "ignore"')
@@ -61,18 +75,8 @@ class PlotMixin(object):
     def histogram_equalize(self, use_bands, **kwargs):
         ''' Equalize and the histogram and normalize value range
             Equalization is on all three bands, not per-band'''
-        data = self._read(self[use_bands,...], **kwargs)
-        data = np.rollaxis(data.astype(np.float32), 0, 3)
-        flattened = data.flatten()
-        if 0 in data:
-            masked = np.ma.masked_values(data, 0).compressed()
-            image_histogram, bin_edges = np.histogram(masked, 256)
-        else:
-            image_histogram, bin_edges = np.histogram(flattened, 256)
-        bins = (bin_edges[:-1] + bin_edges[1:]) / 2.0
-        cdf = image_histogram.cumsum() 
-        cdf = cdf / float(cdf[-1])
-        image_equalized = np.interp(flattened, bins, cdf).reshape(data.shape)
+        data, hist = self._read_with_histogram(use_bands, **kwargs)
+        image_equalized = np.rollaxis(equalize(data, hist), 0, 3)
         if 'stretch' in kwargs or 'gamma' in kwargs:
             return self._histogram_stretch(image_equalized, **kwargs)
         else:
@@ -81,7 +85,8 @@ class PlotMixin(object):
     def histogram_match(self, use_bands, blm_source=None, **kwargs):
         ''' Match the histogram to existing imagery '''
         assert has_rio, "To match image histograms please install rio_hist"
-        data = self._read(self[use_bands,...], **kwargs)
+        img = self.at_resolution(target_shape=kwargs.pop("target_shape", None), gsd=kwargs.pop("gsd", None))
+        data = self._read(img._select_bands(use_bands), **kwargs)
         data = np.rollaxis(data.astype(np.float32), 0, 3)
         if 0 in data:
             data = np.ma.masked_values(data, 0)
@@ -91,7 +96,8 @@ class PlotMixin(object):
             ref = BrowseImage(self.cat_id, bbox=bounds).read()
         else:
             from gbdxtools.images.tms_image import TmsImage
-            tms = TmsImage(zoom=self._calc_tms_zoom(self.affine[0]), bbox=bounds, **kwargs)
+            # the reference tiles are fetched at the resolution the image is read at
+            tms = TmsImage(zoom=self._calc_tms_zoom(img.affine[0]), bbox=bounds, **kwargs)
             ref = np.rollaxis(tms.read(), 0, 3)
         out = np.dstack([rio_match(data[:,:,idx], ref[:,:,idx].astype(np.double)/255.0)
                         for idx in range(data.shape[-1])])
@@ -102,57 +108,79 @@ class PlotMixin(object):
 
     def histogram_stretch(self, use_bands, **kwargs):
         ''' entry point for contrast stretching '''
-        data = self._read(self[use_bands,...], **kwargs)
-        data = np.rollaxis(data.astype(np.float32), 0, 3)
-        return self._histogram_stretch(data, **kwargs)
+        data, hist = self._read_with_histogram(use_bands, **kwargs)
+        limits = hist.percentile(kwargs.get("stretch", [0,100]))
+        return np.rollaxis(stretch(data, limits, gamma=kwargs.get("gamma")), 0, 3)
 
     def _histogram_stretch(self, data, **kwargs):
         ''' perform a contrast stretch and/or gamma adjustment '''
-        limits = {}
-        # get the image min-max statistics
-        for x in range(3):
-            band = data[:,:,x]
-            try:
-                limits[x] = np.percentile(band, kwargs.get("stretch", [0,100]))
-            except IndexError:
-                # this band has no dynamic range and cannot be stretched
-                return data
-        # compute the stretch
-        for x in range(3):
-            band = data[:,:,x]
-            if 0 in band:
-                band = np.ma.masked_values(band, 0).compressed()
-            top = limits[x][1]
-            bottom = limits[x][0]
-            if top != bottom: # catch divide by zero
-                data[:,:,x] = (data[:,:,x] - bottom) / float(top - bottom) * 255.0
-        data = np.clip(data, 0, 255).astype("uint8")
-        # gamma adjust
-        if "gamma" in kwargs:
-            invGamma = 1.0 / kwargs['gamma']
-            lut = np.array([((i / 255.0) ** invGamma) * 255
-		            for i in np.arange(0, 256)]).astype("uint8")
-            data = np.take(lut, data)
-        return data
+        data = np.rollaxis(np.asarray(data), 2, 0)
+        limits = Histogram.from_array(data, nodata=None).percentile(kwargs.get("stretch", [0,100]))
+        return np.rollaxis(stretch(data, limits, gamma=kwargs.get("gamma")), 0, 3)
+
+    def _read_with_histogram(self, use_bands, **kwargs):
+        ''' reads the bands in their own data type and resolution asked for, with their histograms
+            from the RDA metadata or counted on the data read '''
+        img = self.at_resolution(target_shape=kwargs.pop("target_shape", None), gsd=kwargs.pop("gsd", None))
+        data = np.asarray(self._read(img._select_bands(use_bands), **kwargs))
+        hist = img._metadata_histogram(use_bands)
+        if hist is None:
+            hist = Histogram.from_array(data)
+        return data, hist
+
+    def _metadata_histogram(self, bands=None):
+        return None
+
+    def histogram(self, bands=None):
+        ''' Histograms of the image bands, zero valued pixels are not counted
+
+        Histograms come from the RDA image metadata when available, otherwise they are counted
+        on each chunk of the image and merged in a single pass, without holding the image in memory.
+
+        Args:
+            bands (list): bands to count, defaults to all bands
+
+        Returns:
+            Histogram: per band histograms, see `percentile` and `cdf`
+        '''
+        hist = self._metadata_histogram(bands)
+        if hist is not None:
+            return hist
+        arr = self if bands is None else self[bands,...]
+        if is_dask_collection(arr):
+            return sketch(arr)
+        return Histogram.from_array(arr)
 
     def ndvi(self, **kwargs):
         """
         Calculates Normalized Difference Vegetation Index using NIR and Red of an image.
 
+        Use `image.index("ndvi")` for a lazy result.
+
         Returns: numpy array with ndvi values
         """
-        data = self._read(self[self._ndvi_bands,...]).astype(np.float32)
-        return (data[0,:,:] - data[1,:,:]) / (data[0,:,:] + data[1,:,:])
+        return self._read_index("ndvi", **kwargs)
 
-    def ndwi(self):
+    def ndwi(self, **kwargs):
         """
         Calculates Normalized Difference Water Index using Coastal and NIR2 bands for WV02, WV03.
         For Landsat8 and sentinel2 calculated by using Green and NIR bands.
 
+        Use `image.index("ndwi")` for a lazy result.
+
         Returns: numpy array of ndwi values
         """
-        data = self._read(self[self._ndwi_bands,...]).astype(np.float32)
-        return (data[1,:,:] - data[0,:,:]) / (data[0,:,:] + data[1,:,:])
+        return self._read_index("ndwi", **kwargs)
+
+    def _read_index(self, name, target_shape=None, gsd=None, **kwargs):
+        expression, bands = INDEX_PRESETS[name]
+        bands = getattr(self, bands)
+        img = self.at_resolution(target_shape=target_shape, gsd=gsd)
+        if hasattr(img, "bandmath"):
+            # computed per chunk, only the index band is held in memory
+            return self._read(img.bandmath(expression, bands=bands), **kwargs)[0,:,:]
+        used, evaluate = compile_expressions(expression, bands=bands)
+        return evaluate(np.asarray(self._read(img[used,...], **kwargs)))[0,:,:]
 
     def plot(self, spec="rgb", **kwargs):
         ''' Plot the image with MatplotLib
@@ -179,8 +207,14 @@ class PlotMixin(object):
             histogram (str): either 'equalize', 'minmax', 'match', or ignore
             stretch (list): stretch the histogram between two percentile values, default is [2,98]
             gamma (float): adjust image gamma, default is 1.0
+            target_shape (tuple): (rows, columns) to read the image at, defaults to the plot size in pixels. Pass None to read at full resolution.
+            gsd (float): ground sample distance to read the image at, instead of target_shape
         '''
 
+        if "target_shape" not in kwargs and "gsd" not in kwargs:
+            # no more pixels than the figure can show
+            kwargs["target_shape"] = self._plot_shape(**kwargs)
+
         if self.shape[0] == 1 or ("bands" in kwargs and len(kwargs["bands"]) == 1):
             if "cmap" in kwargs:
                 cmap = kwargs["cmap"]
@@ -194,6 +228,10 @@ class PlotMixin(object):
             else:
                 self._plot(tfm=getattr(self, spec), **kwargs)
 
+    def _plot_shape(self, **kwargs):
+        dpi = plt.rcParams["figure.dpi"] if has_pyplot else PLOT_DPI
+        return (int(kwargs.get("h", 10) * dpi), int(kwargs.get("w", 10) * dpi))
+
     def _has_token(self, **kwargs):
         if "access_token" in kwargs or "MAPBOX_API_KEY" in os.environ:
             return True
@@ -210,6 +248,13 @@ class PlotMixin(object):
         plt.imshow(tfm(**kwargs), interpolation='nearest', cmap=kwargs.get("cmap", None))
         plt.show(block=False)
 
+    def at_resolution(self, target_shape=None, gsd=None):
+        return self
+
+    def _read_bands(self, use_bands, target_shape=None, gsd=None, **kwargs):
+        img = self.at_resolution(target_shape=target_shape, gsd=gsd)
+        return self._read(img._select_bands(use_bands), **kwargs)
+
     def _read(self, data, **kwargs):
         if hasattr(data, 'read'):
             return data.read(**kwargs)
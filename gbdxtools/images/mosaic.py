@@ -0,0 +1,177 @@
+"""
+Mosaics of several images on a common grid.
+
+The images are brought onto the projection and GSD of the mosaic once. Each output chunk is
+then composited from only the images whose footprints intersect it, found with an STRtree
+over the footprints, so a chunk never reads images that do not cover it. The chunks are tasks
+of one graph, so image tiles under several chunks are fetched once.
+"""
+import math
+
+import numpy as np
+import dask.array as da
+from dask.base import tokenize
+from dask.highlevelgraph import HighLevelGraph
+from affine import Affine
+from shapely.geometry import box, shape, mapping
+from shapely.geometry.base import BaseGeometry
+from shapely.strtree import STRtree
+
+from gbdxtools.images.meta import GeoDaskImage
+from gbdxtools.rda.util import AffineTransform
+
+MOSAIC_METHODS = ("first", "priority")
+
+def _tree_query(tree, footprints, geom):
+    """ Indices of the footprints intersecting `geom`, in ascending order """
+    hits = tree.query(geom)
+    if len(hits) and isinstance(hits[0], BaseGeometry):
+        # shapely 1.x returns the geometries rather than their indices
+        ids = {id(g): idx for idx, g in enumerate(footprints)}
+        hits = [ids[id(g)] for g in hits]
+    return sorted(int(idx) for idx in hits if footprints[int(idx)].intersects(geom))
+
+def _valid(data, nodata, axis=0):
+    """ Pixels with data in at least one band, bands are along `axis` """
+    valid = np.any(data != nodata, axis=axis)
+    if not np.issubdtype(data.dtype, np.integer):
+        valid &= np.all(np.isfinite(data), axis=axis)
+    return valid
+
+def _composite(shape, dtype, blocks, windows, method="first", nodata=0):
+    """ One chunk of a mosaic from the chunks of the images covering it
+
+    Args:
+        shape (tuple): (bands, rows, columns) of the chunk
+        dtype: data type of the chunk
+        blocks (list): chunks of the images on the mosaic grid, in priority order
+        windows (list): (row slice, column slice) of the chunk inside each image
+        method (str): "first" fills each pixel from the first image with data there,
+            "priority" from the first image covering it
+        nodata: value of pixels without data
+    """
+    out = np.full(shape, nodata, dtype=dtype)
+    filled = np.zeros(shape[1:], dtype=bool)
+    for data, (ys, xs) in zip(blocks, windows):
+        data = data[:, ys, xs]
+        todo = ~filled[ys, xs]
+        if method == "first":
+            todo &= _valid(data, nodata)
+        out[:, ys, xs][:, todo] = data[:, todo]
+        filled[ys, xs] |= todo
+        if filled.all():
+            break
+    return out
+
+def mosaic(images, proj=None, gsd=None, bounds=None, method="first", priority=None, nodata=0,
+           chunk_size=256, dtype=None):
+    """ Lazy mosaic of several images on a common grid
+
+    Images not already in `proj` at `gsd` are rebuilt there by RDA when their driver supports
+    it, otherwise warped. The mosaic grid is aligned with the first image in priority order.
+
+    Args:
+        images (list): images to mosaic, all with the same bands
+        proj (str): optional, projection of the mosaic, defaults to the one of the first image
+        gsd (float): optional, ground sample distance of the mosaic in units of `proj`, defaults
+            to the one of the first image
+        bounds (list): optional, (minx, miny, maxx, maxy) in `proj`, defaults to the union of the image footprints
+        method (str): "first" takes each pixel from the first image with data there, "priority"
+            from the first image whose footprint covers it
+        priority: optional, function of an image or list of values, images with higher values
+            are composited first. Images are composited in list order by default.
+        nodata: value of pixels without data, in the images and the mosaic
+        chunk_size (int): size of the square chunks of the mosaic
+        dtype: optional, data type of the mosaic, defaults to one holding the values of every image
+
+    Returns:
+        image: a GeoDaskImage of the mosaic
+    """
+    if method not in MOSAIC_METHODS:
+        raise ValueError("Unsupported mosaic method {}, use one of {}".format(method, MOSAIC_METHODS))
+    images = list(images)
+    if not images:
+        raise ValueError("No images to mosaic")
+    if priority is not None:
+        keys = [priority(img) for img in images] if callable(priority) else list(priority)
+        order = sorted(range(len(images)), key=lambda idx: keys[idx], reverse=True)
+        images = [images[idx] for idx in order]
+
+    sources, proj, gsd = _regrid(images, proj, gsd)
+    footprints = [shape(src) for src in sources]
+    dtype = np.dtype(dtype) if dtype is not None else np.result_type(*[src.dtype for src in sources])
+    gt, height, width, offsets = _common_grid(sources, footprints, gsd, bounds)
+    nbands = sources[0].shape[0]
+
+    # each image on the mosaic grid, chunked like the mosaic. Chunks straddling image tiles
+    # share them in the graph, so every tile is fetched once.
+    layers = []
+    for src, (oy, ox) in zip(sources, offsets):
+        if oy >= height or ox >= width or oy + src.shape[1] <= 0 or ox + src.shape[2] <= 0:
+            layers.append(None)
+            continue
+        layer, _, _ = src._slice_padded((-ox, -oy, width - ox, height - oy))
+        layers.append(layer.rechunk((nbands, chunk_size, chunk_size)))
+
+    tree = STRtree(footprints)
+    present = [layer for layer in layers if layer is not None]
+    name = "mosaic-{}".format(tokenize(method, nodata, dtype, chunk_size, *present))
+    dsk = {}
+    for i, r0 in enumerate(range(0, height, chunk_size)):
+        r1 = min(r0 + chunk_size, height)
+        for j, c0 in enumerate(range(0, width, chunk_size)):
+            c1 = min(c0 + chunk_size, width)
+            area = box(*((gt * (c0, r1)) + (gt * (c1, r0))))
+            keys, windows = [], []
+            for idx in _tree_query(tree, footprints, area):
+                src, (oy, ox) = sources[idx], offsets[idx]
+                ys0, ys1 = max(r0, oy), min(r1, oy + src.shape[1])
+                xs0, xs1 = max(c0, ox), min(c1, ox + src.shape[2])
+                if layers[idx] is None or ys0 >= ys1 or xs0 >= xs1:
+                    continue
+                keys.append((layers[idx].name, 0, i, j))
+                windows.append((slice(ys0 - r0, ys1 - r0), slice(xs0 - c0, xs1 - c0)))
+                if method == "priority" and footprints[idx].contains(area):
+                    break
+            dsk[(name, 0, i, j)] = (_composite, (nbands, r1 - r0, c1 - c0), dtype, keys, windows, method, nodata)
+    graph = HighLevelGraph.from_collections(name, dsk, dependencies=present)
+    chunks = ((nbands,),) + da.core.normalize_chunks((chunk_size, chunk_size), (height, width))
+    darr = da.Array(graph, name, chunks, dtype=dtype)
+    return GeoDaskImage(darr, __geo_interface__=mapping(box(*((gt * (0, height)) + (gt * (width, 0))))),
+                        __geo_transform__=AffineTransform(gt, proj=proj))
+
+def _regrid(images, proj=None, gsd=None):
+    """ The images in `proj` at `gsd`, which default to the projection and GSD of the first image
+
+    Returns:
+        tuple: the images, the projection and the GSD
+    """
+    if len(set(img.shape[0] for img in images)) > 1:
+        raise ValueError("Images must have the same number of bands")
+    first = images[0]
+    proj = proj or first.proj or "EPSG:4326"
+    if gsd is None:
+        if not isinstance(first.__geo_transform__, AffineTransform) or not first._on_grid(proj, abs(first.affine.a)):
+            raise ValueError("A gsd is required for images that are not in {}".format(proj))
+        gsd = abs(first.affine.a)
+    return [img._regridded(proj, gsd) for img in images], proj, gsd
+
+def _common_grid(sources, footprints, gsd, bounds=None):
+    """ Grid covering `bounds`, or every footprint, aligned with the pixels of the first image
+
+    Returns:
+        tuple: the affine transform, rows and columns of the grid, and the (row, column) offset
+        of each image in it
+    """
+    x0, y0 = sources[0].affine.c, sources[0].affine.f
+    if bounds is None:
+        extents = np.array([g.bounds for g in footprints])
+        bounds = extents[:, 0].min(), extents[:, 1].min(), extents[:, 2].max(), extents[:, 3].max()
+    minx, miny, maxx, maxy = bounds
+    col0, col1 = int(math.floor((minx - x0) / gsd + 1e-6)), int(math.ceil((maxx - x0) / gsd - 1e-6))
+    row0, row1 = int(math.floor((y0 - maxy) / gsd + 1e-6)), int(math.ceil((y0 - miny) / gsd - 1e-6))
+    gt = Affine(gsd, 0.0, x0 + col0 * gsd, 0.0, -gsd, y0 - row0 * gsd)
+    # sub-pixel shifts between the images are rounded away
+    offsets = [(int(round((gt.f - src.affine.f) / gsd)), int(round((src.affine.c - gt.c) / gsd)))
+               for src in sources]
+    return gt, row1 - row0, col1 - col0, offsets
@@ -1,15 +1,25 @@
+import os
 import sys
+import logging
+import warnings
 
 from gbdxtools.images.meta import DaskMeta, GeoDaskImage
-from gbdxtools.rda.util import RatPolyTransform, AffineTransform, deprecation, get_proj
-from gbdxtools.rda.interface import DaskProps
+from gbdxtools.rda.util import RatPolyTransform, AffineTransform, deprecation, get_proj, DTYPE_TO_RDA, RDA_TO_DTYPE
+from gbdxtools.images.util.histogram import Histogram
+from gbdxtools.rda.overviews import overviews
+from gbdxtools.rda.interface import DaskProps, Op, RDA
 from gbdxtools.rda.graph import get_rda_graph
+from gbdxtools.rda.local import split_graph, local_image
 from gbdxtools.auth import Auth
 
 from shapely import wkt, ops
 from shapely.geometry import mapping
 
 import pyproj
+import numpy as np
+import dask.array as da
+from dask.delayed import delayed
+from affine import Affine
 from functools import partial
 import math
 
@@ -18,6 +28,13 @@ try:
 except NameError:
     xrange = range
 
+# push band selections and data type conversions of reads into the RDA graph
+PUSHDOWN = os.environ.get("GBDX_PUSHDOWN", "1").lower() not in ("0", "false", "no")
+
+logger = logging.getLogger('gbdxtools')
+
+rda = RDA()
+
 def _reproject(geo, from_proj, to_proj):
     if from_proj != to_proj:
         from_proj = get_proj(from_proj)
@@ -116,6 +133,14 @@ class RDAGeoAdapter(object):
     def srs(self):
         return self._srs
 
+def _window_offset(gt, base):
+    """ x, y pixel offset of a geo transform from the transform it was shifted from """
+    if isinstance(gt, AffineTransform):
+        shift = ~base._affine * gt._affine
+        return int(round(shift.c)), int(round(shift.f))
+    y, x = base._px_offset - gt._px_offset
+    return int(round(x)), int(round(y))
+
 def rda_image_shift(image):
     minx, maxx = image.__geo__.minx, image.__geo__.maxx
     miny, maxy = image.__geo__.miny, image.__geo__.maxy
@@ -124,18 +149,23 @@ def rda_image_shift(image):
 class RDAImage(GeoDaskImage):
     _default_proj = "EPSG:4326"
 
+    # per image state, kept on the instance so images of the same class can be built concurrently
+    _instance_attrs = ("__geo__", "_rda_op", "__driver__", "__rda_id__")
+
     def __new__(cls, op, **kwargs):
-        cls.__geo__ = RDAGeoAdapter(op.metadata, dfp=cls._default_proj)
-        cls.__geo_transform__ = cls.__geo__.geo_transform
-        cls.__geo_interface__ = cls.__geo__.geo_interface
-        cls._rda_op = op
-        self = super(RDAImage, cls).__new__(cls, op)
+        geo = RDAGeoAdapter(op.metadata, dfp=cls._default_proj)
+        self = super(RDAImage, cls).__new__(cls, op, __geo_transform__=geo.geo_transform,
+                                            __geo_interface__=geo.geo_interface)
+        self.__geo__ = geo
+        self._rda_op = op
         return rda_image_shift(self)
 
     def __getitem__(self, geometry):
         im = super(RDAImage, self).__getitem__(geometry)
         if isinstance(im, GeoDaskImage):
-            im._rda_op = self._rda_op
+            for attr in self._instance_attrs:
+                if attr in self.__dict__:
+                    setattr(im, attr, self.__dict__[attr])
         return im
 
     @property
@@ -164,15 +194,186 @@ class RDAImage(GeoDaskImage):
         deprecation('The use of display_stats has been deprecated. For scaling imagery use histograms in the image metdata.')
         return self.rda.display_stats
 
+    def _coarsened(self, factor, gsd=None):
+        img = self._from_overviews(factor)
+        if img is not None:
+            return img
+        return super(RDAImage, self)._coarsened(factor, gsd=gsd)
+
+    def _from_overviews(self, factor):
+        """ The image reduced by up to `factor` from the overview pyramid, see `rda.overviews`
+
+        Returns None unless every tile under the image has an overview at the selected level.
+        The level is the coarsest one dividing `factor`, the rest of the reduction is decimated
+        locally.
+        """
+        level = overviews.level(factor)
+        if not level or not overviews.enabled or self.ndim != 3 or not isinstance(self.rda, DaskProps):
+            return None
+        full_gt = self.__geo__.geo_transform
+        if not isinstance(full_gt, AffineTransform):
+            return None
+        img_md = self.rda.metadata["image"]
+        scale = 2 ** level
+        tx_size, ty_size = img_md["tileXSize"], img_md["tileYSize"]
+        # the tiles only hold the pixels of this image while it is the graph output
+        if (self.shape[0] != img_md["numBands"] or self.dtype != self.rda.dtype
+                or tx_size % scale or ty_size % scale):
+            return None
+        xmin, ymin = _window_offset(self.__geo_transform__, full_gt)
+        _, ysize, xsize = self.shape
+        if xmin < 0 or ymin < 0:
+            return None
+        cols = range(xmin // tx_size, (xmin + xsize - 1) // tx_size + 1)
+        rows = range(ymin // ty_size, (ymin + ysize - 1) // ty_size + 1)
+        source = self.rda._tile_url_template()
+        tiles = [(col + img_md["minTileX"], row + img_md["minTileY"]) for row in rows for col in cols]
+        if not overviews.covers(source, level, tiles):
+            return None
+        shape = (self.shape[0], ty_size // scale, tx_size // scale)
+        darr = da.block([[da.from_delayed(delayed(overviews.load)(source, level, col + img_md["minTileX"],
+                                                                  row + img_md["minTileY"]),
+                                          shape=shape, dtype=self.dtype)
+                          for col in cols] for row in rows])
+        # the window starts on the overview pixel holding its first pixel
+        x0, y0 = (xmin - cols[0] * tx_size) // scale, (ymin - rows[0] * ty_size) // scale
+        darr = darr[:, y0:y0 + ysize // scale, x0:x0 + xsize // scale]
+        origin = (cols[0] * tx_size + x0 * scale, rows[0] * ty_size + y0 * scale)
+        gt = AffineTransform(full_gt._affine * Affine.translation(*origin) * Affine.scale(scale), proj=self.proj)
+        img = GeoDaskImage(darr, __geo_interface__=self.__geo_interface__, __geo_transform__=gt)
+        return GeoDaskImage._coarsened(img, factor // scale) if factor > scale else img
+
+    def _metadata_histogram(self, bands=None):
+        # RDA computes histograms of the full image, they describe the pixels of this image as
+        # long as the bands and data type are the ones of the graph
+        md = self.rda.metadata
+        hist = md.get("histogram")
+        if not hist or hist.get("numBands") != self.shape[0]:
+            return None
+        if np.dtype(RDA_TO_DTYPE.get(md["image"].get("dataType"), "V")) != self.dtype:
+            return None
+        return Histogram.from_rda(hist, bands)
+
     @property
     def ntiles(self):
         size = float(self.rda.metadata['image']['tileXSize'])
         return math.ceil((float(self.shape[-1]) / size)) * math.ceil(float(self.shape[1]) / size)
 
-    def read(self, bands=None, quiet=True, **kwargs):
+    def read(self, bands=None, quiet=True, dtype=None, target_shape=None, gsd=None, **kwargs):
+        """Reads data from the image and returns the computed ndarray matching the given bands
+
+        The resolution, band selection and data type are applied by RDA when possible, so only
+        the requested bands, at the requested resolution and precision, are downloaded.
+
+        Args:
+            bands (list): band indices to read from the image. Returns bands in the order specified in the
+                list of bands.
+            dtype (str): optional, data type to read the image as, e.g. "uint16"
+            target_shape (tuple): optional, (rows, columns) to read the image at, see `at_resolution`
+            gsd (float): optional, ground sample distance to read the image at, see `at_resolution`
+            out (ndarray): optional, an array (e.g. a `numpy.memmap`) of the same shape to read the image into
+
+        Returns:
+            ndarray: a numpy array of image data
+        """
+        img = self.at_resolution(target_shape=target_shape, gsd=gsd)
+        if img is not self:
+            # images rebuilt at the coarser gsd are read as RDA images, decimated ones locally
+            if isinstance(img, RDAImage):
+                return img.read(bands=bands, quiet=quiet, dtype=dtype, **kwargs)
+            arr = img.read(bands=bands, **kwargs)
+            return arr if dtype is None else arr.astype(dtype)
+        if PUSHDOWN and (bands is not None or dtype is not None):
+            pushed = img._pushdown_or_none(bands=bands, dtype=dtype)
+            if pushed is not None:
+                img, bands, dtype = pushed, None, None
         if not quiet:
-            print('Fetching Image... {} {}'.format(self.ntiles, 'tiles' if self.ntiles > 1 else 'tile'))
-        return super(RDAImage, self).read(bands=bands)
+            print('Fetching Image... {} {}'.format(img.ntiles, 'tiles' if img.ntiles > 1 else 'tile'))
+        arr = super(RDAImage, img).read(bands=bands, **kwargs)
+        return arr if dtype is None else arr.astype(dtype)
+
+    def local(self):
+        """Returns the same window of the image with the per-pixel operators ending its graph applied locally
+
+        Format, BandSelect and BandMath operators at the top of the graph are applied to each chunk
+        on the client. Only the graph under them is registered and fetched, so images differing
+        only in those operators share one registration and one set of tiles.
+
+        Returns:
+            image: a GeoDaskImage covering the same pixels, or the image itself when its graph
+            does not end in such operators
+        """
+        if not isinstance(self.rda, Op) or not split_graph(self.rda)[1]:
+            return self
+        if self.shape[0] != self.rda.metadata["image"]["numBands"] or self.dtype != self.rda.dtype:
+            raise ValueError("The bands of the image no longer match its graph")
+        img = local_image(self.rda)
+        xmin, ymin = _window_offset(self.__geo_transform__, img.__geo_transform__)
+        _, ysize, xsize = self.shape
+        return img[:, ymin:ymin + ysize, xmin:xmin + xsize]
+
+    def pushdown(self, bands=None, dtype=None):
+        """Returns the same window of the image with the band selection and data type applied by RDA
+
+        The image graph is extended with a BandSelect and a Format operator, so tiles only
+        carry the requested bands at the requested precision.
+
+        Args:
+            bands (list): band indices to keep, in the order given
+            dtype (str): data type of the image, one of "uint8", "uint16", "int16", "int32", "float32", "float64"
+
+        Returns:
+            image: an RDAImage covering the same pixels
+        """
+        if not isinstance(self.rda, Op):
+            raise ValueError("Only images built from RDA operators can be rewritten")
+        img_md = self.rda.metadata["image"]
+        if self.ndim != 3 or self.shape[0] != img_md["numBands"] or self.dtype != self.rda.dtype:
+            raise ValueError("Image bands or data type no longer match its RDA graph")
+        op = self.rda
+        if bands is not None:
+            nbands = self.shape[0]
+            if not all(-nbands <= b < nbands for b in bands):
+                raise ValueError("Band index out of range: {}".format(bands))
+            bands = [b % nbands for b in bands]
+            if bands != list(range(self.shape[0])):
+                op = rda.BandSelect(op, bandIndices=bands)
+        if dtype is not None and np.dtype(dtype) != self.dtype:
+            try:
+                op = rda.Format(op, dataType=DTYPE_TO_RDA[np.dtype(dtype).name])
+            except KeyError:
+                raise ValueError("Unsupported dtype for RDA: {}".format(dtype))
+        if op is self.rda:
+            return self
+        img = RDAImage(op)
+        # fetch plugins installed on the instance, see CatalogImage
+        for attr in ("__dask_optimize__", "__fetch__"):
+            if attr in self.__dict__:
+                setattr(img, attr, self.__dict__[attr])
+        xmin, ymin = _window_offset(self.__geo_transform__, img.__geo_transform__)
+        _, ysize, xsize = self.shape
+        if xmin < 0 or ymin < 0 or xmin + xsize > img.shape[2] or ymin + ysize > img.shape[1]:
+            raise ValueError("Image window extends past the RDA graph bounds")
+        return img[:, ymin:ymin + ysize, xmin:xmin + xsize]
+
+    def _select_bands(self, bands):
+        # indexing stays local, selections about to be read are pushed into the graph
+        if PUSHDOWN:
+            img = self._pushdown_or_none(bands=bands)
+            if img is not None:
+                return img
+        return super(RDAImage, self)._select_bands(bands)
+
+    def _pushdown_or_none(self, **kwargs):
+        try:
+            return self.pushdown(**kwargs)
+        except ValueError as e:
+            # the image was changed locally, its pixels no longer map to the graph
+            logger.info("Reading locally, the read cannot be pushed into the RDA graph: %s", e)
+            return None
+        except Exception as e:
+            warnings.warn("Reading locally, could not push the read into the RDA graph: {}".format(e))
+            return None
 
     def materialize(self, node=None, bounds=None, callback=None, out_format='TILE_STREAM', **kwargs):
         """
@@ -0,0 +1,148 @@
+"""
+Stacks of co-registered images.
+
+Images of one area acquired at different times are brought onto a single grid and stacked
+into a (time, band, y, x) dask array chunked along time. Per-pixel statistics over the stack
+are then computed chunk by chunk, without holding the stack in memory.
+"""
+import warnings
+from functools import partial
+
+import numpy as np
+import dask.array as da
+from shapely.geometry import box, shape, mapping
+
+from gbdxtools.images.meta import GeoDaskImage
+from gbdxtools.images.mosaic import _regrid, _common_grid, _valid
+from gbdxtools.rda.util import AffineTransform
+
+# reductions streaming over the time chunks, others are applied to the full time axis of each chunk
+STREAMING_REDUCTIONS = {"mean": da.nanmean, "min": da.nanmin, "max": da.nanmax,
+                        "std": da.nanstd, "sum": da.nansum}
+REDUCTIONS = {"median": np.nanmedian}
+
+def _mask_nodata(block, nodata, dtype):
+    # pixels without data in any band of an image are not part of the statistics
+    valid = _valid(block, nodata, axis=1)
+    block = block.astype(dtype)
+    block[np.broadcast_to(~valid[:, None], block.shape)] = np.nan
+    return block
+
+def _reduce_time(block, fn):
+    with warnings.catch_warnings():
+        # pixels with no data at any time
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return fn(block, axis=0)
+
+def _fill_nodata(block, nodata, dtype):
+    return np.where(np.isnan(block), nodata, block).astype(dtype)
+
+class ImageStack(da.Array):
+    """ (time, band, y, x) dask array of co-registered images, see `stack`
+
+    Attributes:
+        times (list): label of each image along the time axis
+    """
+    def __new__(cls, darr, times=None, __geo_interface__=None, __geo_transform__=None):
+        self = da.Array.__new__(cls, darr.dask, darr.name, darr.chunks, dtype=darr.dtype)
+        self.times = list(times) if times is not None else list(range(darr.shape[0]))
+        self.__geo_interface__ = __geo_interface__
+        self.__geo_transform__ = __geo_transform__
+        return self
+
+    @property
+    def affine(self):
+        """ The geo transform shared by the images of the stack """
+        return self.__geo_transform__._affine
+
+    @property
+    def bounds(self):
+        """ Bounds of the stack grid (minx, miny, maxx, maxy) in its projection """
+        return shape(self).bounds
+
+    @property
+    def proj(self):
+        """ The projection of the stack """
+        return self.__geo_transform__.proj
+
+    def image(self, idx):
+        """ The image at position `idx` along the time axis, as a GeoDaskImage """
+        return GeoDaskImage(da.Array.__getitem__(self, idx), __geo_interface__=self.__geo_interface__,
+                            __geo_transform__=self.__geo_transform__)
+
+    def reduce(self, func="median", nodata=0, dtype="float32"):
+        """ Per-pixel statistic over the time axis
+
+        Pixels without data in any band of an image are left out of the statistic of that pixel.
+        Means, extrema, standard deviations and sums stream over the time chunks, other statistics
+        hold the full time axis of one spatial chunk at a time.
+
+        Args:
+            func: "mean", "median", "min", "max", "std", "sum" or a function reducing a
+                (time, band, y, x) block along axis 0, ignoring NaNs
+            nodata: value of pixels without data, in the images and the result
+            dtype (str): data type the statistic is computed in
+
+        Returns:
+            image: a (band, y, x) GeoDaskImage of the statistic
+        """
+        masked = self.map_blocks(_mask_nodata, nodata, dtype, dtype=dtype)
+        if func in STREAMING_REDUCTIONS:
+            darr = STREAMING_REDUCTIONS[func](masked, axis=0)
+        else:
+            fn = REDUCTIONS.get(func, func)
+            if not callable(fn):
+                raise ValueError("Unsupported reduction {}".format(func))
+            masked = masked.rechunk({0: self.shape[0]})
+            darr = masked.map_blocks(partial(_reduce_time, fn=fn), drop_axis=0, dtype=dtype)
+        darr = darr.map_blocks(_fill_nodata, nodata, dtype, dtype=dtype)
+        return GeoDaskImage(darr, __geo_interface__=self.__geo_interface__,
+                            __geo_transform__=self.__geo_transform__)
+
+def stack(images, times=None, proj=None, gsd=None, bounds=None, chunk_size=256, time_chunks=1, dtype=None):
+    """ Lazy (time, band, y, x) stack of images on a common grid
+
+    Images not already in `proj` at `gsd` are rebuilt there by RDA when their driver supports
+    it, otherwise warped. The grid is aligned with the first image and pixels outside an image
+    are 0.
+
+    Args:
+        images (list): images to stack, all with the same bands
+        times (list): optional, acquisition time or other label of each image, the images are
+            sorted by it
+        proj (str): optional, projection of the stack, defaults to the one of the first image
+        gsd (float): optional, ground sample distance of the stack in units of `proj`, defaults
+            to the one of the first image
+        bounds (list): optional, (minx, miny, maxx, maxy) in `proj`, defaults to the union of the image footprints
+        chunk_size (int): size of the square spatial chunks
+        time_chunks (int): number of images in a chunk along the time axis
+        dtype: optional, data type of the stack, defaults to one holding the values of every image
+
+    Returns:
+        ImageStack: a 4-D dask array with the grid of the stack
+    """
+    images = list(images)
+    if not images:
+        raise ValueError("No images to stack")
+    if times is not None:
+        times = list(times)
+        order = sorted(range(len(images)), key=lambda idx: times[idx])
+        images, times = [images[idx] for idx in order], [times[idx] for idx in order]
+    sources, proj, gsd = _regrid(images, proj, gsd)
+    footprints = [shape(src) for src in sources]
+    dtype = np.dtype(dtype) if dtype is not None else np.result_type(*[src.dtype for src in sources])
+    gt, height, width, offsets = _common_grid(sources, footprints, gsd, bounds)
+
+    layers = []
+    for src, (oy, ox) in zip(sources, offsets):
+        nbands, rows, cols = src.shape
+        if oy >= height or ox >= width or oy + rows <= 0 or ox + cols <= 0:
+            # the image is outside the grid
+            layer = da.zeros((nbands, height, width), dtype=dtype, chunks=(nbands, chunk_size, chunk_size))
+        else:
+            layer, _, _ = src._slice_padded((-ox, -oy, width - ox, height - oy))
+            layer = layer.astype(dtype).rechunk((nbands, chunk_size, chunk_size))
+        layers.append(layer)
+    darr = da.stack(layers).rechunk({0: time_chunks})
+    return ImageStack(darr, times=times, __geo_interface__=mapping(box(*((gt * (0, height)) + (gt * (width, 0))))),
+                      __geo_transform__=AffineTransform(gt, proj=proj))
@@ -8,6 +8,9 @@ from gbdxtools.rda.interface import DaskProps
 from gbdxtools.rda.graph import get_rda_graph_template, get_rda_template_metadata, VIRTUAL_RDA_URL, get_template_stats
 from gbdxtools.auth import Auth
 from gbdxtools.rda.util import deprecation
+from gbdxtools.images.bulk import bulk_images
+
+from functools import partial
 
 try:
     from urllib import urlencode
@@ -58,6 +61,9 @@ class TemplateMeta(GraphMeta):
         qs = urlencode(kwargs)
         return "{}/template/{}/tile/{}/{}?{}".format(VIRTUAL_RDA_URL, rda_id, x, y, qs) 
 
+    def _tile_url_template(self):
+        return self._rda_tile("{x}", "{y}", self._rda_id, nodeId=self._id, **self._params)
+
     def _collect_urls(self):
         img_md = self.metadata["image"]
         rda_id = self._rda_id
@@ -79,3 +85,18 @@ class RDATemplateImage(object):
     '''
     def __new__(cls, template_id, node_id=None, **kwargs):
         return RDAImage(TemplateMeta(template_id, node_id, **kwargs))
+
+    @classmethod
+    def bulk(cls, template_id, params, node_id=None, max_workers=None):
+        '''Creates images of one template for many parameter sets concurrently.
+
+        Args:
+            template_id (str): The RDA template ID
+            params (list): a dict of template parameters for each image
+            node_id (str): the node ID to render as the image (defaults to None)
+            max_workers (int): max number of images being built at the same time
+
+        Returns:
+            list: images in the order of `params`, with the raised exception in place of each image that failed
+        '''
+        return bulk_images(partial(cls, template_id, node_id), params, max_workers=max_workers)
@@ -0,0 +1,188 @@
+"""
+Mergeable histograms of image bands.
+
+Histograms are computed per chunk and merged pairwise, so the percentiles and equalization
+curve of an image larger than memory are found in one pass without holding the image. The
+contrast stretch derived from them is then applied to each chunk independently.
+"""
+import os
+from functools import partial
+
+import numpy as np
+import dask
+from dask.delayed import delayed
+
+threads = int(os.environ.get('GBDX_THREADS', 8))
+threaded_get = partial(dask.threaded.get, num_workers=threads)
+
+# max number of bins of a band, percentiles are exact for integer data spanning fewer values
+SKETCH_BINS = 1024
+
+def _edges(lo, hi, bins, integer):
+    if integer and hi - lo < bins:
+        # one bin per value
+        return np.arange(lo, hi + 2, dtype=np.float64) - 0.5
+    if hi == lo:
+        hi = lo + 1
+    return np.linspace(lo, hi, bins + 1)
+
+def _rebin(edges, counts, new_edges):
+    centers = (edges[:-1] + edges[1:]) / 2.0
+    return np.histogram(centers, bins=new_edges, weights=counts)[0]
+
+def _band_histogram(band, nodata, bins, integer):
+    if band.dtype in (np.uint8, np.uint16):
+        # counting every value avoids copying the band
+        full = np.bincount(band.ravel())
+        if nodata is not None and 0 <= nodata < len(full):
+            full[int(nodata)] = 0
+        present = np.flatnonzero(full)
+        if not len(present):
+            return np.zeros(1), np.zeros(0), np.inf, -np.inf
+        vmin, vmax = int(present[0]), int(present[-1])
+        edges = _edges(vmin, vmax, bins, True)
+        counts = full[vmin:vmax + 1]
+        if len(counts) != len(edges) - 1:
+            counts = _rebin(np.arange(vmin, vmax + 2) - 0.5, counts, edges)
+        return edges, counts, vmin, vmax
+    values = band.ravel() if integer else band[np.isfinite(band)]
+    if nodata is not None:
+        values = values[values != nodata]
+    if not values.size:
+        return np.zeros(1), np.zeros(0), np.inf, -np.inf
+    vmin, vmax = values.min().item(), values.max().item()
+    edges = _edges(vmin, vmax, bins, integer)
+    return edges, np.histogram(values, bins=edges)[0], vmin, vmax
+
+class Histogram(object):
+    """ Histograms of each band of an image
+
+    Args:
+        edges (list): bin edges of each band
+        counts (list): bin counts of each band
+        lo (list): smallest value of each band
+        hi (list): largest value of each band
+        integer (bool): values are integers, bins are exact while the range fits in `bins`
+        bins (int): max number of bins of a band
+    """
+    def __init__(self, edges, counts, lo, hi, integer=False, bins=SKETCH_BINS):
+        self.edges = [np.asarray(e, dtype=np.float64) for e in edges]
+        self.counts = [np.asarray(c, dtype=np.float64) for c in counts]
+        self.lo = list(lo)
+        self.hi = list(hi)
+        self.integer = integer
+        self.bins = bins
+
+    @classmethod
+    def from_array(cls, arr, nodata=0, bins=SKETCH_BINS):
+        """ Histogram of a (bands, y, x) array, `nodata` values are not counted """
+        arr = np.asarray(arr)
+        integer = np.issubdtype(arr.dtype, np.integer)
+        bands = [_band_histogram(band, nodata, bins, integer) for band in arr]
+        return cls(*zip(*bands), integer=integer, bins=bins)
+
+    @classmethod
+    def from_rda(cls, md, bands=None, nodata=0):
+        """ Histogram of `bands` from the "histogram" entry of RDA image metadata """
+        bands = range(md["numBands"]) if bands is None else bands
+        edges, counts = [], []
+        for band in bands:
+            c = np.array(md["histograms"][str(band)], dtype=np.float64)
+            e = np.linspace(md["lowValue"][band], md["highValue"][band], len(c) + 1)
+            if nodata is not None and e[0] <= nodata <= e[-1]:
+                c[min(np.searchsorted(e, nodata, side="right") - 1, len(c) - 1)] = 0
+            edges.append(e)
+            counts.append(c)
+        return cls(edges, counts, [e[0] for e in edges], [e[-1] for e in edges])
+
+    def merge(self, other):
+        """ Histogram of the values counted by both histograms """
+        integer = self.integer and other.integer
+        bands = [self._merge_band(other, band, integer) for band in range(len(self.counts))]
+        return Histogram(*zip(*bands), integer=integer, bins=self.bins)
+
+    def _merge_band(self, other, band, integer):
+        if not other.counts[band].sum():
+            return self.edges[band], self.counts[band], self.lo[band], self.hi[band]
+        if not self.counts[band].sum():
+            return other.edges[band], other.counts[band], other.lo[band], other.hi[band]
+        vmin, vmax = min(self.lo[band], other.lo[band]), max(self.hi[band], other.hi[band])
+        edges = _edges(vmin, vmax, self.bins, integer)
+        counts = (_rebin(self.edges[band], self.counts[band], edges) +
+                  _rebin(other.edges[band], other.counts[band], edges))
+        return edges, counts, vmin, vmax
+
+    def combined(self):
+        """ Single band histogram of the values of all bands """
+        bands = [Histogram([e], [c], [l], [h], integer=self.integer, bins=self.bins)
+                 for e, c, l, h in zip(self.edges, self.counts, self.lo, self.hi)]
+        result = bands[0]
+        for band in bands[1:]:
+            result = result.merge(band)
+        return result
+
+    def percentile(self, q):
+        """ Values at percentiles `q` of each band, (bands, len(q)) """
+        q = np.asarray(q, dtype=np.float64) / 100.0
+        out = []
+        for e, c, vmin, vmax in zip(self.edges, self.counts, self.lo, self.hi):
+            total = c.sum()
+            if not total:
+                out.append(np.zeros(q.shape))
+                continue
+            cum = np.cumsum(c)
+            target = q * total
+            # bin where the cumulative count reaches the target, values are spread evenly in a bin
+            idx = np.minimum(np.searchsorted(cum, target, side="left"), len(c) - 1)
+            idx = np.where(target > 0, idx, np.flatnonzero(c)[0])
+            frac = (target - (cum[idx] - c[idx])) / c[idx]
+            out.append(np.clip(e[idx] + frac * (e[idx + 1] - e[idx]), vmin, vmax))
+        return np.array(out)
+
+    def cdf(self, band=0):
+        """ Bin centers and cumulative fraction of the values of a band, for use with np.interp """
+        e, c = self.edges[band], self.counts[band]
+        total = c.sum()
+        return (e[:-1] + e[1:]) / 2.0, np.cumsum(c) / (total if total else 1.0)
+
+def sketch(arr, nodata=0, bins=SKETCH_BINS):
+    """ Histogram of a (bands, y, x) dask array, counted per chunk and merged in a single pass """
+    if len(arr.chunks[0]) > 1:
+        arr = arr.rechunk({0: arr.shape[0]})
+    parts = [delayed(Histogram.from_array)(block, nodata=nodata, bins=bins)
+             for block in arr.to_delayed().ravel()]
+    while len(parts) > 1:
+        parts = [delayed(Histogram.merge)(*parts[i:i + 2]) if i + 1 < len(parts) else parts[i]
+                 for i in range(0, len(parts), 2)]
+    return dask.compute(parts[0], scheduler=threaded_get)[0]
+
+def stretch(block, limits, gamma=None):
+    """ Linear stretch of each band of a (bands, y, x) block between its (bottom, top) limits to uint8
+
+    Bands with no dynamic range are only clipped. Unsigned 8 and 16 bit blocks are mapped
+    through a lookup table.
+    """
+    out = np.empty(block.shape, dtype=np.uint8)
+    lut_gamma = None
+    if gamma is not None:
+        lut_gamma = (((np.arange(256) / 255.0) ** (1.0 / gamma)) * 255).astype(np.uint8)
+    use_lut = block.dtype in (np.uint8, np.uint16)
+    for idx, (bottom, top) in enumerate(limits):
+        values = np.arange(np.iinfo(block.dtype).max + 1, dtype=np.float32) if use_lut else block[idx].astype(np.float32)
+        if top != bottom:
+            values = (values - bottom) / float(top - bottom) * 255.0
+        values = np.clip(values, 0, 255).astype(np.uint8)
+        if lut_gamma is not None:
+            values = np.take(lut_gamma, values)
+        out[idx] = np.take(values, block[idx]) if use_lut else values
+    return out
+
+def equalize(block, hist):
+    """ Maps each value of a (bands, y, x) block to its cumulative fraction in the combined histogram """
+    centers, cdf = hist.combined().cdf()
+    if not len(centers):
+        return np.zeros(block.shape, dtype=np.float32)
+    out = np.empty(block.shape, dtype=np.float32)
+    for idx in range(block.shape[0]):
+        out[idx] = np.interp(block[idx], centers, cdf)
+    return out
@@ -1,5 +1,6 @@
 from gbdxtools.vectors import Vectors
 from gbdxtools.auth import Auth
+from gbdxtools.rda.latency import latency
 from shapely import wkt
 from shapely.geometry import box
 
@@ -33,7 +34,8 @@ def vector_services_query(query, aoi=None, **kwargs):
     vectors = Vectors()
     if not aoi:
         aoi = wkt.dumps(box(-180, -90, 180, 90))
-    _parts = sorted(vectors.query(aoi, query=query, **kwargs), key=lambda x: x['properties']['id'])
+    with latency.measure("catalog_query"):
+        _parts = sorted(vectors.query(aoi, query=query, **kwargs), key=lambda x: x['properties']['id'])
     return _parts
 
 def _req_with_retries(conn, url, retries=5):
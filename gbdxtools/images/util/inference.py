@@ -0,0 +1,54 @@
+"""
+Sliding window inference over image chunks.
+
+Each chunk is read with a halo from its neighbours and tiled with overlapping windows. The
+windows are passed to the model in batches and the overlapping predictions are blended with
+weights tapering towards the window edges, where the model sees the least context.
+"""
+import numpy as np
+
+def cosine_weights(window):
+    """ (rows, columns) blending weights of a window, largest at its center and never 0 """
+    wy, wx = window
+    y = np.sin(np.pi * (np.arange(wy) + 0.5) / wy) ** 2
+    x = np.sin(np.pi * (np.arange(wx) + 0.5) / wx) ** 2
+    return np.outer(y, x).astype(np.float32)
+
+def window_starts(size, window, stride):
+    """ Offsets of the windows covering `size` pixels, the last window ends on the last pixel """
+    if size <= window:
+        return [0]
+    return list(range(0, size - window, stride)) + [size - window]
+
+def predict_block(block, fn, window, overlap, batch_size, bands_out):
+    """ Blended predictions of `fn` over overlapping windows of a (bands, y, x) block
+
+    Returns:
+        ndarray: float32 (bands_out, y, x) predictions
+    """
+    bands, height, width = block.shape
+    wy, wx = window
+    # blocks smaller than a window are mirrored up to its size
+    pad = (max(wy - height, 0), max(wx - width, 0))
+    if any(pad):
+        block = np.pad(block, ((0, 0), (0, pad[0]), (0, pad[1])), mode="symmetric")
+    weights = cosine_weights(window)
+    acc = np.zeros((bands_out,) + block.shape[1:], dtype=np.float32)
+    norm = np.zeros(block.shape[1:], dtype=np.float32)
+    positions = [(y, x) for y in window_starts(block.shape[1], wy, wy - overlap)
+                 for x in window_starts(block.shape[2], wx, wx - overlap)]
+    for idx in range(0, len(positions), batch_size):
+        batch = positions[idx:idx + batch_size]
+        preds = np.asarray(fn(np.stack([block[:, y:y + wy, x:x + wx] for y, x in batch])), dtype=np.float32)
+        for (y, x), pred in zip(batch, preds):
+            acc[:, y:y + wy, x:x + wx] += pred * weights
+            norm[y:y + wy, x:x + wx] += weights
+    return (acc / norm)[:, :height, :width]
+
+def min_chunks(chunks, minimum):
+    """ Chunk sizes of an axis with every chunk at least `minimum`, unless the axis is shorter """
+    chunks = list(chunks)
+    while len(chunks) > 1 and chunks[-1] < minimum:
+        last = chunks.pop()
+        chunks[-1] += last
+    return tuple(chunks)
@@ -0,0 +1,75 @@
+import numpy as np
+import dask.array as da
+
+def brovey(ms, pan, weights=None):
+    """ Brovey pansharpening of a block
+
+    Args:
+        ms (ndarray): multispectral bands resampled to the pan grid, (bands, y, x)
+        pan (ndarray): panchromatic band, (1, y, x)
+        weights (list): per band weights of the intensity, defaults to equal weights
+
+    Returns:
+        ndarray: float32 sharpened bands
+    """
+    ms = ms.astype(np.float32)
+    if weights is None:
+        intensity = ms.mean(axis=0)
+    else:
+        weights = np.asarray(weights, dtype=np.float32)
+        intensity = np.tensordot(weights / weights.sum(), ms, axes=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(intensity > 0, pan[0].astype(np.float32) / intensity, 0)
+    return (ms * ratio).astype(np.float32)
+
+def _nearest(size, target):
+    # index of the source pixel whose center is nearest to each target pixel center
+    return np.minimum(((np.arange(target) + 0.5) * size / float(target)).astype(np.int64), size - 1)
+
+def upsample(ms, shape, chunks):
+    """ Nearest neighbour resampling of a dask array to `shape`, aligned with `chunks` """
+    _, h, w = ms.shape
+    ms = ms[:, _nearest(h, shape[0]), :]
+    ms = ms[:, :, _nearest(w, shape[1])]
+    return ms.rechunk((ms.shape[0],) + tuple(chunks))
+
+def pansharpen(ms, pan, weights=None):
+    """ Lazily pansharpens a multispectral image with a panchromatic image of the same area
+
+    The multispectral bands are fetched at their native resolution and resampled to the pan
+    grid chunk by chunk, so only the MS and the single pan band are transferred.
+
+    Args:
+        ms (dask.array): multispectral image, (bands, y, x)
+        pan (dask.array): panchromatic image covering the same bounds, (1, y, x)
+        weights (list): per band weights of the intensity, defaults to equal weights
+
+    Returns:
+        dask.array: float32 sharpened bands on the pan grid
+    """
+    if pan.ndim != 3 or pan.shape[0] != 1:
+        raise ValueError("Pan image must have a single band, got shape {}".format(pan.shape))
+    nbands = ms.shape[0]
+    ms_up = upsample(ms, pan.shape[1:], pan.chunks[1:])
+    # one chunk along the band axis holds the MS bands followed by the pan band
+    stacked = da.concatenate([ms_up, pan], axis=0).rechunk({0: nbands + 1})
+    return stacked.map_blocks(_brovey_stacked, weights=weights, dtype=np.float32,
+                              chunks=((nbands,),) + pan.chunks[1:])
+
+def _brovey_stacked(block, weights=None):
+    return brovey(block[:-1], block[-1:], weights=weights)
+
+def transfer_savings(ms, pan, dtype="float32"):
+    """ Bytes transferred for a pansharpened read, server side versus local
+
+    Args:
+        ms: multispectral image
+        pan: panchromatic image
+        dtype (str): data type of the server side pansharpened product
+
+    Returns:
+        dict: server and local byte counts and their ratio
+    """
+    server = ms.shape[0] * pan.shape[1] * pan.shape[2] * np.dtype(dtype).itemsize
+    local = ms.nbytes + pan.nbytes
+    return {"server_bytes": int(server), "local_bytes": int(local), "ratio": server / float(local)}
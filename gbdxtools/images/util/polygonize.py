@@ -0,0 +1,163 @@
+"""
+Polygonization of classified rasters chunk by chunk.
+
+Each chunk is vectorized on its own, in parallel with the others. Polygons reaching a seam
+between chunks are held back and merged with their neighbours across the seam as those
+chunks are done, and released once no chunk left can extend them. All other polygons are
+final as soon as their chunk is.
+"""
+from collections import defaultdict, deque
+from itertools import count
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from shapely.geometry import box
+from shapely.ops import unary_union
+
+def polygonize_block(block, row0=0, col0=0, values=None, nodata=0):
+    """ Polygons of the 4-connected pixels of each value of a 2-D block
+
+    Pixels are grouped into rectangles of identical runs on consecutive rows, which are
+    then merged.
+
+    Args:
+        block (ndarray): 2-D array of class values
+        row0 (int): row of the block in the image, polygons are in image pixel coordinates
+        col0 (int): column of the block in the image
+        values (list): optional, values to polygonize, defaults to every value but `nodata`
+        nodata: value of pixels left out
+
+    Returns:
+        dict: list of polygons of each value
+    """
+    rects = defaultdict(list)
+    # (start, end, value) of each run of the previous row, with the row its rectangle starts on
+    open_runs = {}
+    for row in range(block.shape[0] + 1):
+        runs = {}
+        if row < block.shape[0]:
+            line = block[row]
+            edges = np.flatnonzero(line[1:] != line[:-1]) + 1
+            for start, end in zip(np.r_[0, edges], np.r_[edges, len(line)]):
+                value = line[start]
+                if value == nodata or (values is not None and value not in values):
+                    continue
+                key = (start, end, value.item())
+                runs[key] = open_runs.pop(key, row)
+        for (start, end, value), top in open_runs.items():
+            rects[value].append(box(col0 + start, row0 + top, col0 + end, row0 + row))
+        open_runs = runs
+    return {value: parts(unary_union(boxes)) for value, boxes in rects.items()}
+
+def parts(geom):
+    """ The polygons of a polygon or multipolygon """
+    return list(geom.geoms) if hasattr(geom, "geoms") else [geom]
+
+def seam_neighbours(bounds, index, rows, cols):
+    """ Indices of the chunks across the seams reached by pixel `bounds` of the chunk at `index`
+
+    Args:
+        bounds (tuple): (minx, miny, maxx, maxy) in image pixels
+        index (tuple): (row, column) of the chunk in the chunk grid
+        rows (list): first row of each chunk, then the number of rows of the image
+        cols (list): first column of each chunk, then the number of columns of the image
+    """
+    minx, miny, maxx, maxy = bounds
+    i, j = index
+    neighbours = []
+    if minx <= cols[j] and j > 0:
+        neighbours.append((i, j - 1))
+    if maxx >= cols[j + 1] and j + 2 < len(cols):
+        neighbours.append((i, j + 1))
+    if miny <= rows[i] and i > 0:
+        neighbours.append((i - 1, j))
+    if maxy >= rows[i + 1] and i + 2 < len(rows):
+        neighbours.append((i + 1, j))
+    return neighbours
+
+class SeamStitcher(object):
+    """ Merges polygons across the seams between chunks as the chunks are done
+
+    Polygons reaching a seam are grouped with the polygons of the same value they share an
+    edge with. A group is released, merged, once every chunk across the seams its polygons
+    reach is done, since no polygon found later can extend it.
+
+    Args:
+        rows (list): first row of each chunk, then the number of rows of the image
+        cols (list): first column of each chunk, then the number of columns of the image
+    """
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.done = set()
+        # group id: [value, polygons, chunks still to be done]
+        self.groups = {}
+        # chunk: ids of the groups waiting for it
+        self.waiting = defaultdict(set)
+        self._ids = count()
+
+    def add(self, index, shapes):
+        """ Adds the polygons of the chunk at `index`
+
+        Args:
+            index (tuple): (row, column) of the chunk in the chunk grid
+            shapes (dict): list of polygons of each value, see `polygonize_block`
+
+        Returns:
+            list: (polygon, value) of the polygons that are final
+        """
+        self.done.add(index)
+        final = []
+        candidates = self.waiting.pop(index, set())
+        for value, polygons in shapes.items():
+            for polygon in polygons:
+                pending = set(seam_neighbours(polygon.bounds, index, self.rows, self.cols)) - self.done
+                merged = [gid for gid in candidates if gid in self.groups and self.groups[gid][0] == value
+                          and any(polygon.intersection(p).length > 0 for p in self.groups[gid][1])]
+                if not pending and not merged:
+                    final.append((polygon, value))
+                    continue
+                members = [polygon]
+                for gid in merged:
+                    _, others, others_pending = self.groups.pop(gid)
+                    members.extend(others)
+                    pending |= others_pending
+                    for chunk in others_pending:
+                        self.waiting[chunk].discard(gid)
+                gid = next(self._ids)
+                self.groups[gid] = [value, members, pending]
+                for chunk in pending:
+                    self.waiting[chunk].add(gid)
+                candidates.add(gid)
+        for gid in candidates:
+            group = self.groups.get(gid)
+            if group is None:
+                continue
+            group[2].discard(index)
+            if not group[2]:
+                del self.groups[gid]
+                final.extend(self._release(group))
+        return final
+
+    def flush(self):
+        """ (polygon, value) of every group still held """
+        final = []
+        for group in self.groups.values():
+            final.extend(self._release(group))
+        self.groups, self.waiting = {}, defaultdict(set)
+        return final
+
+    def _release(self, group):
+        value, polygons, _ = group
+        return [(polygon, value) for polygon in parts(unary_union(polygons))]
+
+def map_bounded(fn, items, max_workers):
+    """ Results of `fn(*item)` for each item, in order, with at most 2 * `max_workers` items in flight """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(fn, *item))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
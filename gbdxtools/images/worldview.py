@@ -5,13 +5,19 @@ Contact: chris.helm@digitalglobe.com
 from __future__ import print_function
 import json
 import warnings 
+from functools import partial
+
+import numpy as np
 
 from gbdxtools.images.drivers import WorldViewDriver, RDADaskImageDriver
 from gbdxtools.images.base import RDABaseImage
+from gbdxtools.images.bulk import bulk_images
 from gbdxtools import IdahoImage
 from gbdxtools.images.util import vector_services_query, vendor_id, band_types
 from gbdxtools.rda.interface import RDA
-from gbdxtools.rda.error import MissingIdahoImages, AcompUnavailable
+from gbdxtools.rda.error import MissingIdahoImages, AcompUnavailable, MissingMetadata
+from gbdxtools.rda.util import calc_correction_coefficients, rda_calibration
+from gbdxtools.images.meta import GeoDaskImage
 
 rda = RDA()
 
@@ -25,9 +31,86 @@ RDA_DTYPES = {
     'float64': "5"
 }
 
+def _apply_correction(block, gain=None, offset=None, dtype=None):
+    out = block * gain + offset
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        out = np.clip(np.rint(out), info.min, info.max)
+    return out.astype(dtype)
+
 class WorldViewImage(RDABaseImage):
     __Driver__ = WorldViewDriver
     _parts = None
+    _instance_attrs = RDABaseImage._instance_attrs + ("_correction",)
+
+    def __post_new_hook__(self, **kwargs):
+        img = super(WorldViewImage, self).__post_new_hook__(**kwargs)
+        correction = self.options.get("local_correction")
+        if correction:
+            img._correction = "DN"
+            img = img.correct(correction)
+        return img
+
+    def correct(self, correction="TOAREFLECTANCE"):
+        """
+          Applies a radiometric correction on the client to an image read with `local_correction`
+
+          The image tiles are fetched as DN once, corrections are applied to each chunk when the
+          image is read, so switching corrections does not change the tiles that are fetched.
+
+          Args:
+            correction (str): one of "DN", "RADIANCE" or "TOAREFLECTANCE"
+          Returns:
+            image: the image with the correction applied, float32 except for DN
+        """
+        current = self.__dict__.get("_correction")
+        if current is None:
+            raise ValueError("Client side corrections need an image created with local_correction")
+        if correction == current:
+            return self
+        gain0, offset0 = self._correction_coefficients(current)
+        gain1, offset1 = self._correction_coefficients(correction)
+        if self.ndim != 3 or self.shape[0] != len(gain1):
+            raise ValueError("Client side corrections need all {} bands of the image".format(len(gain1)))
+        # undo the current correction and apply the new one in a single step
+        gain = gain1 / gain0
+        offset = offset1 - offset0 * gain
+        dtype = np.dtype("uint16") if correction == "DN" else np.dtype("float32")
+        fn = partial(_apply_correction, gain=gain[:, None, None], offset=offset[:, None, None], dtype=dtype)
+        darr = self.map_blocks(fn, dtype=dtype)
+        img = super(GeoDaskImage, self.__class__).__new__(self.__class__, darr,
+                                                          __geo_interface__=self.__geo_interface__,
+                                                          __geo_transform__=self.__geo_transform__)
+        for attr in self._instance_attrs:
+            if attr in self.__dict__:
+                setattr(img, attr, self.__dict__[attr])
+        img._correction = correction
+        return img
+
+    def _coarsened(self, factor, gsd=None):
+        coarse = super(WorldViewImage, self)._coarsened(factor, gsd=gsd)
+        # the rebuilt image applies the correction it was created with, not a later one
+        current = self.__dict__.get("_correction")
+        if isinstance(coarse, WorldViewImage) and current is not None and coarse.__dict__.get("_correction") != current:
+            coarse = coarse.correct(current)
+        return coarse
+
+    def _metadata_histogram(self, bands=None):
+        # the metadata histograms are of the DN fetched from RDA
+        if self.__dict__.get("_correction") not in (None, "DN"):
+            return None
+        return super(WorldViewImage, self)._metadata_histogram(bands)
+
+    def _correction_coefficients(self, correction):
+        # IDAHO style calibration metadata: satid, bandid, abscalfactor, effbandwidth,
+        # latlonhae, img_datetime_obj_utc and mean_sun_el, mapped from the RDA metadata by default
+        meta = self.options.get("calibration")
+        try:
+            if meta is None:
+                meta = rda_calibration(self.metadata)
+            return calc_correction_coefficients(meta, correction)
+        except KeyError as e:
+            raise MissingMetadata("Calibration metadata not found, pass it as `calibration`: missing {}".format(e))
 
     @property
     def cat_id(self):
@@ -36,12 +119,16 @@ class WorldViewImage(RDABaseImage):
     @property
     def parts(self):
         if self._parts is None:
-            self._parts = [IdahoImage(rec['properties']['attributes']['idahoImageId'],
-                                      proj=self.options["proj"],
-                                      bucket=rec['properties']['attributes']['bucketName'],
-                                      gsd=self.options["gsd"],
-                                      acomp=self.options["acomp"])
-                           for rec in self._find_parts(self.cat_id, self.options["band_type"])]
+            # the parts are independent images, register them and fetch their metadata concurrently
+            args = [{"rda_id": rec['properties']['attributes']['idahoImageId'],
+                     "bucket": rec['properties']['attributes']['bucketName']}
+                    for rec in self._find_parts(self.cat_id, self.options["band_type"])]
+            parts = bulk_images(IdahoImage, args, proj=self.options["proj"],
+                                gsd=self.options["gsd"], acomp=self.options["acomp"])
+            for part in parts:
+                if isinstance(part, Exception):
+                    raise part
+            self._parts = parts
         return self._parts
 
     @staticmethod
@@ -72,10 +159,21 @@ class WorldViewImage(RDABaseImage):
         #raise AcompUnavailable("Cannot apply acomp to this image, data unavailable in bucket: {}".format(_bucket))
         return graph
 
+    def _pansharpened_graph(self):
+        # the strip graph is pansharpened by its band type rather than the pansharpen option
+        return self._build_graph(self.__rda_id__, **dict(self.options, pansharpen=True, band_type="PANSHARP"))
+
     @property
     def _rgb_bands(self):
         return [4, 2, 1]
 
+    @property
+    def _pansharpen_weights(self):
+        # the pan band spans blue to NIR1, coastal and NIR2 fall outside of it
+        if self.shape[0] == 8:
+            return [0, 1, 1, 1, 1, 1, 1, 0]
+        return None
+
     @property
     def _ndvi_bands(self):
         return [6, 4]
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import threading
+import tempfile
+from hashlib import sha256
+from collections import defaultdict
+
+CACHE_DIR = os.environ.get("GBDX_RDA_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".gbdx", "rda_cache"))
+CACHE_TTL = int(os.environ.get("GBDX_RDA_CACHE_TTL", 24 * 60 * 60))
+CACHE_ENABLED = os.environ.get("GBDX_RDA_CACHE", "1").lower() not in ("0", "false", "no")
+
+def content_hash(obj):
+    """ Stable hash of a JSON serializable object """
+    return sha256(json.dumps(obj, sort_keys=True).encode('utf-8')).hexdigest()
+
+class RDACache(object):
+    """ In memory and on disk cache of RDA graph registrations and image metadata
+
+    Registered graphs are keyed by the content hash of the graph and metadata by graph id and
+    node id, so images rebuilt from the same graph, in this or a later process, skip the
+    registration and metadata requests. Entries expire after `ttl` seconds.
+
+    Args:
+        path (str): directory of the on disk cache, `None` keeps the cache in memory only
+        ttl (int): seconds before an entry expires
+        enabled (bool): set to False to bypass the cache
+    """
+    def __init__(self, path=CACHE_DIR, ttl=CACHE_TTL, enabled=CACHE_ENABLED):
+        self.path = path
+        self.ttl = ttl
+        self.enabled = enabled
+        self._mem = {}
+        self._lock = threading.Lock()
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    def _file(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def get(self, kind, *parts):
+        """ Cached value or None, counts a hit or miss for `kind` """
+        if not self.enabled:
+            return None
+        key = content_hash([kind] + list(parts))
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+        if entry is None and self.path is not None:
+            try:
+                with open(self._file(key)) as f:
+                    entry = json.load(f)
+            except (IOError, OSError, ValueError):
+                entry = None
+        if entry is None or entry["expires"] < now:
+            with self._lock:
+                self.misses[kind] += 1
+            return None
+        with self._lock:
+            self._mem[key] = entry
+            self.hits[kind] += 1
+        return entry["value"]
+
+    def set(self, kind, value, *parts):
+        if not self.enabled:
+            return value
+        key = content_hash([kind] + list(parts))
+        entry = {"expires": time.time() + self.ttl, "value": value}
+        with self._lock:
+            self._mem[key] = entry
+        if self.path is not None:
+            try:
+                if not os.path.isdir(self.path):
+                    os.makedirs(self.path)
+                # write then rename so concurrent readers never see a partial entry
+                fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+                with os.fdopen(fd, "w") as f:
+                    json.dump(entry, f)
+                try:
+                    os.rename(tmp, self._file(key))
+                except OSError:
+                    # windows does not rename over an existing file
+                    os.remove(tmp)
+            except (IOError, OSError):
+                pass
+        return value
+
+    def clear(self):
+        """ Removes all entries from memory and disk """
+        with self._lock:
+            self._mem = {}
+        if self.path is not None and os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                if name.endswith(".json"):
+                    try:
+                        os.remove(os.path.join(self.path, name))
+                    except OSError:
+                        pass
+
+    def report(self):
+        """ Number of requests avoided and made, by request kind """
+        kinds = set(self.hits) | set(self.misses)
+        return {kind: {"avoided": self.hits[kind], "requested": self.misses[kind]} for kind in kinds}
+
+rda_cache = RDACache()
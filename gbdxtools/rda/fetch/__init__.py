@@ -1,11 +1,58 @@
+import os
+import math
+import operator
+from collections import defaultdict
+
 import dask.array as da
 from dask import optimization
-import operator
 
 from gbdxtools.images.meta import DaskMeta
+from gbdxtools.rda.error import Unauthorized
+from gbdxtools.rda.overviews import overviews
 from gbdxtools.rda.fetch.conc.libcurl.select import load_urls as mcfetch
 from gbdxtools.rda.fetch.threaded.libcurl.easy import load_url as easyfetch
 
+class TileFetcher(object):
+    """ Shared fetch context for the tile tasks of an image
+
+    Tile tasks are `(fetcher, tile_x, tile_y)`. The url template, credentials and chunk shape
+    are held once per image by the fetcher instead of being repeated in every task, and the
+    tile url and token are resolved when the task runs.
+
+    Args:
+        url_template (str): tile url with `{x}` and `{y}` placeholders
+        credentials: a `TokenProvider` or a bearer token string for the tile requests
+        chunks (tuple): shape of a tile
+        fetch (callable): function loading a single url, defaults to the threaded curl fetcher
+    """
+    def __init__(self, url_template, credentials, chunks, fetch=easyfetch):
+        self.url_template = url_template
+        self.credentials = credentials
+        self.chunks = chunks
+        self.fetch = fetch
+
+    @property
+    def token(self):
+        return getattr(self.credentials, "token", self.credentials)
+
+    def url(self, x, y):
+        return self.url_template.format(x=x, y=y)
+
+    def __call__(self, x, y):
+        token = self.token
+        try:
+            tile = self.fetch(self.url(x, y), token, self.chunks)
+        except Unauthorized:
+            if not hasattr(self.credentials, "refresh"):
+                raise
+            # the token expired or was revoked while the graph was running
+            tile = self.fetch(self.url(x, y), self.credentials.refresh(expired=token), self.chunks)
+        return self.record(tile, x, y)
+
+    def record(self, tile, x, y):
+        """ Adds the overviews of a fetched tile to the overview pyramid, returns the tile """
+        return overviews.record(self.url_template, x, y, tile)
+
 class BaseFetch(object):
     @staticmethod
     def __fetch__(*args, **kwargs):
@@ -22,21 +69,35 @@ class ThreadedBaseFetch(BaseFetch):
         return da.Array.__dask_optimize__(dsk, keys)
 
 class AsyncBaseFetch(BaseFetch):
+    """ Fetches tiles in groups, one concurrent multi-request task per group
+
+    Tiles are partitioned into spatially local square blocks of about `__batch_size__`
+    tiles. Each block is fetched by a single task, so downstream computation on a block
+    starts as soon as its tiles arrive and at most one block of decoded tiles per
+    worker is held in memory.
+    """
     __fetch_type__ = "async"
+    __batch_size__ = int(os.environ.get('GBDX_FETCH_BATCH_SIZE', 64))
+
     @classmethod
     def __dask_optimize__(cls, dsk, keys):
         dsk1, _ = optimization.cull(dsk, keys)
         dsk2 = {}
-        coll = []
+        groups = defaultdict(list)
+        side = max(int(math.sqrt(cls.__batch_size__)), 1)
         for key, val in dsk1.items():
-            if isinstance(key, tuple) and key[0].startswith('image'):
-                name, z, x, y = key
-                dfn, url, token, chunk = val
-                dsk2[key] = (operator.getitem, "load_urls", (z, x, y))
-                coll.append([url, token, (z, x, y)])
+            if isinstance(key, tuple) and key[0].startswith('image') and isinstance(val[0], TileFetcher):
+                name, z, y, x = key
+                fetcher, tile_x, tile_y = val
+                group = "load_urls-{}-{}-{}".format(name, y // side, x // side)
+                dsk2[key] = (operator.getitem, group, (z, y, x))
+                if overviews.enabled:
+                    dsk2[key] = (fetcher.record, dsk2[key], tile_x, tile_y)
+                groups[group].append([fetcher.url(tile_x, tile_y), fetcher.credentials, (z, y, x)])
             else:
                 dsk2[key] = val
-        dsk2['load_urls'] = (cls.__fetch__, coll)
+        for group, coll in groups.items():
+            dsk2[group] = (cls.__fetch__, coll)
         return dsk2
 
 class EasyCurlFetch(ThreadedBaseFetch):
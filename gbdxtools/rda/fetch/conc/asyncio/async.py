@@ -11,6 +11,7 @@ import numpy as np
 from skimage.io import imread
 
 from tempfile import NamedTemporaryFile
+from functools import partial
 import os
 
 MAX_RETRIES = 5
@@ -40,13 +41,21 @@ def bytes_to_array(bstring):
         os.remove(fd.name)
     return arr
 
-async def consume_reqs(qreq, qres, session, max_tries=5):
+async def consume_reqs(qreq, qres, session, credentials=None, max_tries=5):
     await asyncio.sleep(0.1)
     while True:
         try:
             url, index, tries = await qreq.get()
             tries += 1
-            async with session.get(url) as response:
+            # credentials are either a token string or a refreshable provider
+            token = getattr(credentials, "token", credentials)
+            headers = {"Authorization": "Bearer {}".format(token)}
+            async with session.get(url, headers=headers) as response:
+                if response.status == 401 and hasattr(credentials, "refresh") and tries < max_tries:
+                    await asyncio.get_event_loop().run_in_executor(None, partial(credentials.refresh, expired=token))
+                    await qreq.put([url, index, tries])
+                    qreq.task_done()
+                    continue
                 response.raise_for_status()
                 bstring = await response.read()
                 await qres.put([index, bstring])
@@ -80,10 +89,10 @@ async def process(qres, results):
             break
     return True
 
-async def fetch(reqs, session, nconn, batch_size=2000, nprocs=10):
+async def fetch(reqs, session, nconn, credentials=None, batch_size=2000, nprocs=10):
     results = {}
     qreq, qres = asyncio.Queue(maxsize=batch_size), asyncio.Queue()
-    consumers = [asyncio.ensure_future(consume_reqs(qreq, qres, session)) for _ in range(nconn)]
+    consumers = [asyncio.ensure_future(consume_reqs(qreq, qres, session, credentials)) for _ in range(nconn)]
     producer = await produce_reqs(qreq, reqs)
     processors = [asyncio.ensure_future(process(qres, results)) for _ in range(nprocs)]
     await qreq.join()
@@ -95,19 +104,18 @@ async def fetch(reqs, session, nconn, batch_size=2000, nprocs=10):
     done, pending = await asyncio.wait(processors)
     return results
 
-async def run_fetch(reqs, nconn, headers, loop):
-    async with aiohttp.ClientSession(loop=loop, connector=aiohttp.TCPConnector(limit=nconn), headers=headers) as session:
-        results = await fetch(reqs, session, nconn)
+async def run_fetch(reqs, nconn, credentials, loop):
+    async with aiohttp.ClientSession(loop=loop, connector=aiohttp.TCPConnector(limit=nconn)) as session:
+        results = await fetch(reqs, session, nconn, credentials)
         return results
 
 def load_urls(collection, shape=(8,256,256), max_retries=MAX_RETRIES, loop=None):
     reqs = []
     for url, token, index in collection:
         reqs.append([url, tuple(index), 0])
-    headers = {"Authorization": "Bearer {}".format(token)}
     if not loop:
         loop = asyncio.get_event_loop()
-    results = loop.run_until_complete(run_fetch(reqs, len(reqs), headers, loop))
+    results = loop.run_until_complete(run_fetch(reqs, len(reqs), token, loop))
     loop.run_until_complete(asyncio.sleep(0))
     loop.close()
     return results
@@ -53,12 +53,17 @@ def _init_curl(NOSIGNAL=1, CONNECTTIMEOUT=120, TIMEOUT=300):
     _curl.setopt(pycurl.TIMEOUT, TIMEOUT)
     return _curl
 
+def _bearer(token):
+    """ tokens are either strings or refreshable providers with a token attribute """
+    return getattr(token, "token", token)
+
 def _load_curl(url, token, index, _curl):
     _, ext = os.path.splitext(urlparse(url).path)
     fd = NamedTemporaryFile(prefix='gbdxtools', suffix=ext, delete=False)
+    _curl.bearer = _bearer(token)
     _curl.setopt(pycurl.WRITEDATA, fd.file)
     _curl.setopt(pycurl.URL, url)
-    _curl.setopt(pycurl.HTTPHEADER, ['Authorization: Bearer {}'.format(token)])
+    _curl.setopt(pycurl.HTTPHEADER, ['Authorization: Bearer {}'.format(_curl.bearer)])
     _curl.index = index
     _curl.token = token
     _curl.url = url
@@ -106,12 +111,19 @@ def load_urls(collection, max_workers=64, max_retries=MAX_RETRIES, shape=(8,256,
         while True:
             nq, suc, failed = cmulti.info_read()
             for _curl in suc:
-                results[_curl.index] = _curl.fd.name
-                _fd_handler(_curl.fd, delete=False)
+                if (_curl.getinfo(pycurl.HTTP_CODE) == 401 and hasattr(_curl.token, "refresh")
+                        and runcount[_curl.index] < max_retries):
+                    # the token expired during the fetch, refresh it and retry the tile
+                    _fd_handler(_curl.fd)
+                    _curl.token.refresh(expired=_curl.bearer)
+                    taskq.append([_curl.url, _curl.token, _curl.index])
+                else:
+                    results[_curl.index] = _curl.fd.name
+                    _fd_handler(_curl.fd, delete=False)
+                    nprocessed += 1
                 _curl.fd = None
                 cmulti.remove_handle(_curl)
                 curlq.append(_curl)
-                nprocessed += 1
             for _curl, err_num, err_msg in failed:
                 _fd_handler(_curl.fd)
                 _curl.fd = None
@@ -16,6 +16,8 @@ from skimage.io import imread
 import pycurl
 import numpy as np
 
+from gbdxtools.rda.error import Unauthorized
+
 #import warnings
 #warnings.filterwarnings('ignore')
 
@@ -50,6 +52,8 @@ def load_url(url, token, shape=(8, 256, 256)):
             content_type = _curl.getinfo(pycurl.CONTENT_TYPE)
 
             try:
+                if code == 401:
+                    raise Unauthorized("Request for {} was not authorized".format(url))
                 if(code != 200):
                     raise TypeError("Request for {} returned unexpected error code: {}".format(url, code))
                 temp.file.flush()
@@ -64,6 +68,8 @@ def load_url(url, token, shape=(8, 256, 256)):
                     arr = np.expand_dims(arr, axis=0)
                 success = True
                 return arr
+            except Unauthorized:
+                raise
             except Exception as e:
                 _curl.close()
                 del _curl_pool[thread_id]
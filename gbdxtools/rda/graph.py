@@ -2,6 +2,8 @@ import os
 import json
 from concurrent.futures import Future
 from gbdxtools.rda.error import NotFound, BadRequest
+from gbdxtools.rda.cache import rda_cache
+from gbdxtools.rda.latency import latency
 
 try:
     from urllib import urlencode
@@ -51,18 +53,26 @@ def get_rda_graph_template(conn, template_id):
 
 
 def register_rda_graph(conn, rda_graph):
+    payload = json.dumps(rda_graph, sort_keys=True)
+    rda_id = rda_cache.get("graph", VIRTUAL_RDA_URL, payload)
+    if rda_id is not None:
+        return rda_id
     url = "{}/graph".format(VIRTUAL_RDA_URL)
-    res = resolve_if_future(conn.post(url, json.dumps(rda_graph, sort_keys=True),
-                                      headers={'Content-Type': 'application/json'}))
+    with latency.measure("register"):
+        res = resolve_if_future(conn.post(url, payload, headers={'Content-Type': 'application/json'}))
     if res.status_code == 200:
-        return res.text
+        return rda_cache.set("graph", res.text, VIRTUAL_RDA_URL, payload)
     else:
         raise BadRequest("Problem registering graph: {}".format(res.text))
 
 
 
 def get_rda_metadata(conn, rda_id, node='toa_reflectance'):
-    md_response = conn.get(VIRTUAL_RDA_URL + "/metadata/{}/{}/metadata.json".format(rda_id, node)).result()
+    md = rda_cache.get("metadata", VIRTUAL_RDA_URL, rda_id, node)
+    if md is not None:
+        return md
+    with latency.measure("metadata"):
+        md_response = conn.get(VIRTUAL_RDA_URL + "/metadata/{}/{}/metadata.json".format(rda_id, node)).result()
     if md_response.status_code != 200:
         md_json = md_response.json()
         if 'error' in md_json:
@@ -70,15 +80,20 @@ def get_rda_metadata(conn, rda_id, node='toa_reflectance'):
         raise BadRequest("Problem fetching image metadata: status {} {}, graph_id: {}".format(md_response.status_code, md_response.reason, rda_id))
     else:
         md_json = md_response.json()
-        return {
+        return rda_cache.set("metadata", {
             "image": md_json["imageMetadata"],
             "georef": md_json.get("imageGeoreferencing", None),
-            "rpcs": md_json.get("rpcSensorModel", None)
-        }
+            "rpcs": md_json.get("rpcSensorModel", None),
+            "histogram": md_json.get("histogram", None)
+        }, VIRTUAL_RDA_URL, rda_id, node)
 
 def get_rda_template_metadata(conn, _id, **kwargs):
+    md = rda_cache.get("template_metadata", VIRTUAL_RDA_URL, _id, kwargs)
+    if md is not None:
+        return md
     qs = urlencode(kwargs)
-    md_response = conn.get(VIRTUAL_RDA_URL + "/template/{}/metadata?{}".format(_id, qs)).result()
+    with latency.measure("template_metadata"):
+        md_response = conn.get(VIRTUAL_RDA_URL + "/template/{}/metadata?{}".format(_id, qs)).result()
     if md_response.status_code != 200:
         md_json = md_response.json()
         if 'error' in md_json:
@@ -86,11 +101,12 @@ def get_rda_template_metadata(conn, _id, **kwargs):
         raise BadRequest("Problem fetching image metadata: status {} {}, graph_id: {}".format(md_response.status_code, md_response.reason, _id))
     else:
         md_json = md_response.json()
-        return {
+        return rda_cache.set("template_metadata", {
             "image": md_json["imageMetadata"],
             "georef": md_json.get("imageGeoreferencing", None),
-            "rpcs": md_json.get("rpcSensorModel", None)
-        }
+            "rpcs": md_json.get("rpcSensorModel", None),
+            "histogram": md_json.get("histogram", None)
+        }, VIRTUAL_RDA_URL, _id, kwargs)
 
 def create_rda_template(conn, graph):
     r = conn.post("{}/template".format(VIRTUAL_RDA_URL), json=graph).result()
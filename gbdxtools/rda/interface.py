@@ -3,7 +3,6 @@ import os
 import uuid
 import json
 from hashlib import sha256
-from itertools import chain
 from collections import OrderedDict
 
 import operator
@@ -17,8 +16,8 @@ from gbdxtools.rda.graph import VIRTUAL_RDA_URL, register_rda_graph, \
                                 get_rda_metadata, get_graph_stats, \
                                 materialize_template, create_rda_template, \
                                 materialize_status
-from gbdxtools.auth import Auth
-from gbdxtools.rda.fetch import easyfetch as load_url
+from gbdxtools.auth import Auth, TokenProvider
+from gbdxtools.rda.fetch import TileFetcher
 from gbdxtools.images.meta import DaskMeta
 
 #import warnings
@@ -37,17 +36,53 @@ except NameError:
 NAMESPACE_UUID = uuid.NAMESPACE_DNS
 
 class ContentHashedDict(dict):
+    """ dict identified by a hash of its content, the hash is memoized until the dict changes """
     @property
     def _id(self):
-        _id = str(uuid.uuid5(NAMESPACE_UUID, self.__hash__()))
+        _id = self.__dict__.get("_cached_id")
+        if _id is None:
+            _id = str(uuid.uuid5(NAMESPACE_UUID, self.__hash__()))
+            self._cached_id = _id
         return _id
 
     def __hash__(self):
-        dup = OrderedDict({k:v for k,v in self.items() if k is not "id"})
+        dup = OrderedDict({k:v for k,v in self.items() if k != "id"})
         return sha256(str(dup).encode('utf-8')).hexdigest()
 
+    def _changed(self):
+        self.__dict__.pop("_cached_id", None)
+
+    def __setitem__(self, key, value):
+        self._changed()
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._changed()
+        dict.__delitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        self._changed()
+        dict.update(self, *args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        self._changed()
+        return dict.setdefault(self, key, default)
+
+    def pop(self, *args):
+        self._changed()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self._changed()
+        return dict.popitem(self)
+
+    def clear(self):
+        self._changed()
+        dict.clear(self)
+
     def populate_id(self):
-        self.update({"id": self._id})
+        # the id is not part of the content hash, setting it keeps the memoized hash
+        dict.__setitem__(self, "id", self._id)
 
 
 class DaskProps(object):
@@ -73,12 +108,14 @@ class DaskProps(object):
 
     @property
     def dask(self):
-        token = self._interface.gbdx_connection.access_token
-        _chunks = self.chunks
+        # the url template and credentials are shared by every tile task through the fetcher,
+        # the token is looked up and refreshed when tiles are fetched rather than captured here
+        fetcher = TileFetcher(self._tile_url_template(), TokenProvider(), self.chunks)
         _name = self.name
         img_md = self.metadata["image"]
-        return {(_name, 0, y - img_md['minTileY'], x - img_md['minTileX']): (load_url, url, token, _chunks)
-                for (y, x), url in self._collect_urls().items()}
+        return {(_name, 0, y - img_md['minTileY'], x - img_md['minTileX']): (fetcher, x, y)
+                for y in xrange(img_md['minTileY'], img_md["maxTileY"]+1)
+                for x in xrange(img_md['minTileX'], img_md["maxTileX"]+1)}
 
     @property
     def name(self):
@@ -134,6 +171,9 @@ class DaskProps(object):
     def _rda_tile(self, x, y, rda_id, _id):
         return "{}/tile/{}/{}/{}/{}/{}.tif".format(VIRTUAL_RDA_URL, "idaho-virtual", rda_id, _id, x, y)
 
+    def _tile_url_template(self):
+        return self._rda_tile("{x}", "{y}", self._rda_id, self._id)
+
     def _collect_urls(self):
         img_md = self.metadata["image"]
         rda_id = self._rda_id
@@ -143,10 +183,18 @@ class DaskProps(object):
                 for x in xrange(img_md['minTileX'], img_md["maxTileX"]+1)}
 
 class Op(DaskProps):
+    """ A node of an RDA graph
+
+    Ops form an immutable DAG: each op holds its own node, the edges to its inputs and
+    references to the input ops. The full list of nodes and edges is collected, without
+    duplicates, only when the graph is serialized.
+    """
     def __init__(self, name, interface=None):
         self._operator = name
-        self._edges = []
-        self._nodes = []
+        self._node = None
+        self._args = ()
+        self._own_edges = []
+        self._dag = None       # memoized (nodes, edges) of the whole graph
 
         self._rda_id = None    # The graph ID
         self._rda_graph = None # the RDA graph
@@ -157,31 +205,61 @@ class Op(DaskProps):
 
     @property
     def _id(self):
-        return self._nodes[0]._id
+        return self._node._id
+
+    @property
+    def _nodes(self):
+        return self._collect()[0]
+
+    @property
+    def _edges(self):
+        return self._collect()[1]
+
+    def _collect(self):
+        if self._dag is None:
+            nodes, edges, seen = [], [], set()
+            stack = [self]
+            # depth first in argument order, the first occurrence of a shared ancestor is kept
+            while stack:
+                op = stack.pop()
+                if op._node is None or op._id in seen:
+                    continue
+                seen.add(op._id)
+                nodes.append(op._node)
+                edges.extend(op._own_edges)
+                stack.extend(reversed(op._args))
+            self._dag = (nodes, edges)
+        return self._dag
 
     def __call__(self, *args, **kwargs):
         if len(args) > 0 and all([isinstance(arg, gbdx.images.rda_image.RDAImage) for arg in args]):
             return self._rda_image_call(*args, **kwargs)
-        self._nodes = [ContentHashedDict({
+        self._node = ContentHashedDict({
             "operator": self._operator,
             "_ancestors": [arg._id for arg in args],
             "parameters": OrderedDict({
                 k:json.dumps(v, sort_keys=True) if not isinstance(v, basestring) else v
                 for k,v in sorted(kwargs.items(), key=lambda x: x[0])})
-        })]
-        for arg in args:
-            self._nodes.extend(arg._nodes)
-
-        self._edges = [ContentHashedDict({"index": idx + 1, "source": arg._nodes[0]._id,
-                                          "destination": self._nodes[0]._id})
-                       for idx, arg in enumerate(args)]
-        for arg in args:
-            self._edges.extend(arg._edges)
-
-        for e in chain(self._nodes, self._edges):
+        })
+        self._node.populate_id()
+        self._args = tuple(args)
+        self._own_edges = [ContentHashedDict({"index": idx + 1, "source": arg._id,
+                                              "destination": self._id})
+                           for idx, arg in enumerate(args)]
+        for e in self._own_edges:
             e.populate_id()
+        self._dag = None
         return self
 
+    def local(self):
+        """ Image of the op with the per-pixel operators at the top of its graph evaluated on the client
+
+        See `gbdxtools.rda.local.local_image`, only the graph under those operators is registered
+        and its tiles fetched.
+        """
+        from gbdxtools.rda.local import local_image
+        return local_image(self)
+
     def _rda_image_call(self, *args, **kwargs):
         out = self(*[arg.rda for arg in args], **kwargs)
         rda_img = gbdx.images.rda_image.RDAImage(out)
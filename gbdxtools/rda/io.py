@@ -1,43 +1,134 @@
 try:
     import rasterio
+    import rasterio.shutil
     has_rasterio = True
 except:
     has_rasterio = False
 
+try:
+    import zarr
+    has_zarr = True
+except ImportError:
+    has_zarr = False
+
 from functools import partial
 import os
+import sys
+import time
+import threading
+import shutil
+import tempfile
+import json
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 
 import dask
+import dask.array as da
 from dask.array import store
+from dask.base import tokenize
+from affine import Affine
 
 import numpy as np
 
 threads = int(os.environ.get('GBDX_THREADS', 64))
 threaded_get = partial(dask.threaded.get, num_workers=threads)
 
+GDAL_DTYPES = {
+    'uint8': 'Byte',
+    'uint16': 'UInt16',
+    'int16': 'Int16',
+    'uint32': 'UInt32',
+    'int32': 'Int32',
+    'float32': 'Float32',
+    'float64': 'Float64'
+}
+
+# max number of computed chunks waiting on the writer thread
+WRITE_QUEUE_SIZE = int(os.environ.get('GBDX_WRITE_QUEUE_SIZE', 2 * threads))
+
 class rio_writer(object):
-    def __init__(self, dst):
+    ''' Collects chunks computed in parallel and writes them from a single thread
+
+    dask calls `__setitem__` from its worker threads. Chunks are handed through a
+    bounded queue to one writer thread that owns the rasterio dataset, so the dataset
+    is never written concurrently and workers block once `queue_size` chunks are
+    waiting to be written.
+
+    Args:
+        dst: an open, writable rasterio dataset
+        queue_size (int): max number of chunks waiting to be written
+        nchunks (int): total number of chunks, used for progress reporting
+        progress (bool): print progress and throughput while writing
+    '''
+    def __init__(self, dst, queue_size=WRITE_QUEUE_SIZE, nchunks=None, progress=False):
         self.dst = dst
-        
+        self.nchunks = nchunks
+        self.progress = progress
+        self.written = 0
+        self.nbytes = 0
+        self._error = None
+        self._start = time.time()
+        self._queue = Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._drain)
+        self._thread.daemon = True
+        self._thread.start()
+
     def __setitem__(self, location, chunk):
-        window = ((location[1].start, location[1].stop), 
+        window = ((location[1].start, location[1].stop),
                   (location[2].start, location[2].stop))
-        self.dst.write(chunk, window=window)
+        self._queue.put((window, chunk))
 
-def to_geotiff(arr, path='./output.tif', proj=None, spec=None, bands=None, **kwargs):
-    ''' Write out a geotiff file of the image
+    @property
+    def throughput(self):
+        ''' Bytes written per second since the writer was opened '''
+        elapsed = time.time() - self._start
+        return self.nbytes / elapsed if elapsed > 0 else 0.0
 
-    Args:
-        path (str): path to write the geotiff file to, default is ./output.tif
-        proj (str): EPSG string of projection to reproject to
-        spec (str): if set to 'rgb', write out color-balanced 8-bit RGB tif
-        bands (list): list of bands to export. If spec='rgb' will default to RGB bands
-    
-    Returns:
-        str: path the geotiff was written to'''
-        
-    assert has_rasterio, "To create geotiff images please install rasterio" 
+    def _drain(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            # keep draining after a failure so workers never block on a full queue
+            if self._error is not None:
+                continue
+            window, chunk = item
+            try:
+                self.dst.write(chunk, window=window)
+            except Exception as e:
+                self._error = e
+                continue
+            self.written += 1
+            self.nbytes += chunk.nbytes
+            if self.progress:
+                self._report()
+
+    def _report(self):
+        total = self.nchunks if self.nchunks is not None else '?'
+        sys.stdout.write('\rWrote {}/{} chunks, {:.2f} MB/s'.format(self.written, total,
+                                                                      self.throughput / 1e6))
+        sys.stdout.flush()
+
+    def close(self):
+        ''' Waits for queued chunks to be written and re-raises any write error '''
+        self._queue.put(None)
+        self._thread.join()
+        if self.progress:
+            sys.stdout.write('\n')
+        if self._error is not None:
+            raise self._error
 
+def _block_size(arr, x_size, y_size):
+    ''' GeoTIFF block size aligned to the array chunks when the chunks are valid tile sizes '''
+    y_chunk, x_chunk = arr.chunks[1][0], arr.chunks[2][0]
+    if y_chunk % 16 == 0 and x_chunk % 16 == 0:
+        return x_chunk, y_chunk
+    return x_size, y_size
+
+def _prepare(arr, proj=None, spec=None, bands=None, **kwargs):
+    ''' Selects the bands to export and builds the rasterio profile of the output file '''
     try:
         img_md = arr.rda.metadata["image"]
         x_size = img_md["tileXSize"]
@@ -51,20 +142,25 @@ def to_geotiff(arr, path='./output.tif', proj=None, spec=None, bands=None, **kwa
     except:
         tfm = None
 
-    dtype = arr.dtype.name if arr.dtype.name != 'int8' else 'uint8' 
+    dtype = arr.dtype.name if arr.dtype.name != 'int8' else 'uint8'
 
     if spec is not None and spec.lower() == 'rgb':
         if bands is None:
             bands = arr._rgb_bands
-        # skip if already DRA'ed
-        if not arr.options.get('dra'):
-            # add the RDA HistogramDRA op to get a RGB 8-bit image
-            from gbdxtools.rda.interface import RDA
-            rda = RDA()
-            dra = rda.HistogramDRA(arr)
-            # Reset the bounds and select the bands on the new Dask
-            arr = dra.aoi(bbox=arr.bounds)
-        arr = arr[bands,...].astype(np.uint8)
+        if kwargs.get("stretch") is not None or not hasattr(arr, "rda"):
+            # stretched chunk by chunk as they are written, the histograms take a first pass over
+            # the image unless they come with its metadata
+            arr = arr.stretched(bands, stretch=kwargs.get("stretch") or [2, 98], gamma=kwargs.get("gamma"))
+        else:
+            # skip if already DRA'ed
+            if not arr.options.get('dra'):
+                # add the RDA HistogramDRA op to get a RGB 8-bit image
+                from gbdxtools.rda.interface import RDA
+                rda = RDA()
+                dra = rda.HistogramDRA(arr)
+                # Reset the bounds and select the bands on the new Dask
+                arr = dra.aoi(bbox=arr.bounds)
+            arr = arr[bands,...].astype(np.uint8)
         dtype = 'uint8'
     else:
         if bands is not None:
@@ -81,11 +177,247 @@ def to_geotiff(arr, path='./output.tif', proj=None, spec=None, bands=None, **kwa
         meta["crs"] = {'init': proj}
 
     if "tiled" in kwargs and kwargs["tiled"]:
-        meta.update(blockxsize=x_size, blockysize=y_size, tiled="yes")
+        blockxsize, blockysize = _block_size(arr, x_size, y_size)
+        meta.update(blockxsize=blockxsize, blockysize=blockysize, tiled="yes")
 
-    with rasterio.open(path, "w", **meta) as dst:
-        writer = rio_writer(dst)
-        result = store(arr, writer, compute=False)
+    if kwargs.get("compress") is not None:
+        meta.update(compress=kwargs["compress"].lower())
+        if kwargs.get("predictor") is not None:
+            meta.update(predictor=kwargs["predictor"])
+    return arr, meta
+
+def _store(sources, targets, **kwargs):
+    ''' Computes all sources in one pass, each target dataset is written by its own writer thread '''
+    # progress is reported for the first (full resolution) target only
+    writers = [rio_writer(dst, queue_size=kwargs.get("queue_size", WRITE_QUEUE_SIZE),
+                          nchunks=int(np.prod([len(c) for c in src.chunks])),
+                          progress=kwargs.get("progress", False) and idx == 0)
+               for idx, (src, dst) in enumerate(zip(sources, targets))]
+    try:
+        result = store(sources, writers, lock=False, compute=False)
         result.compute(scheduler=threaded_get)
-    
+    finally:
+        for writer in writers:
+            writer.close()
+
+def to_geotiff(arr, path='./output.tif', proj=None, spec=None, bands=None, **kwargs):
+    ''' Write out a geotiff file of the image
+
+    Chunks are computed in parallel and written in the order they complete by a single
+    writer thread, memory is bounded by the number of chunks waiting to be written.
+
+    Args:
+        path (str): path to write the geotiff file to, default is ./output.tif
+        proj (str): EPSG string of projection to reproject to
+        spec (str): if set to 'rgb', write out color-balanced 8-bit RGB tif
+        bands (list): list of bands to export. If spec='rgb' will default to RGB bands
+        tiled (bool): write a tiled geotiff with blocks aligned to the image chunks
+        compress (str): compression to apply, one of 'deflate', 'lzw', 'zstd' or 'packbits'
+        predictor (int): compression predictor, 2 for integer data and 3 for floating point data
+        queue_size (int): max number of computed chunks waiting to be written
+        progress (bool): print the number of chunks written and the write throughput
+
+    Returns:
+        str: path the geotiff was written to'''
+
+    assert has_rasterio, "To create geotiff images please install rasterio"
+
+    arr, meta = _prepare(arr, proj=proj, spec=spec, bands=bands, **kwargs)
+    with rasterio.open(path, "w", **meta) as dst:
+        _store([arr], [dst], **kwargs)
+
     return path
+
+def _overview_factors(height, width, blocksize):
+    ''' Decimation factors (2, 4, 8, ...) until an overview level fits in a single block '''
+    factors = []
+    factor = 2
+    while max(height, width) // (factor // 2) > blocksize and min(height, width) // factor > 0:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+def _decimate(arr, chunks, resampling='average'):
+    ''' Halves the resolution of a (bands, y, x) dask array '''
+    height, width = arr.shape[1] - arr.shape[1] % 2, arr.shape[2] - arr.shape[2] % 2
+    arr = arr[:, :height, :width]
+    if resampling == 'nearest':
+        return arr[:, ::2, ::2]
+    # coarsen needs every chunk to divide evenly, rechunking keeps all but the last chunk
+    # at the (even) block size and the last one is even since the trimmed shape is even
+    arr = arr.rechunk(chunks)
+    return da.coarsen(np.mean, arr, {1: 2, 2: 2}).astype(arr.dtype)
+
+def _vrt_with_overviews(path, meta, overviews):
+    ''' Writes a VRT of the file at `path` that lists the given files as its overviews '''
+    with rasterio.open(path) as src:
+        crs = src.crs.to_wkt() if src.crs is not None else ''
+        gt = ', '.join(str(v) for v in src.transform.to_gdal())
+    bands = []
+    for band in range(1, meta['count'] + 1):
+        ovr = ''.join('<Overview><SourceFilename relativeToVRT="0">{}</SourceFilename>'
+                      '<SourceBand>{}</SourceBand></Overview>'.format(ovr_path, band)
+                      for ovr_path in overviews)
+        bands.append('<VRTRasterBand dataType="{dtype}" band="{band}">'
+                     '<SimpleSource><SourceFilename relativeToVRT="0">{path}</SourceFilename>'
+                     '<SourceBand>{band}</SourceBand></SimpleSource>{ovr}</VRTRasterBand>'.format(
+                         dtype=GDAL_DTYPES[meta['dtype']], band=band, path=path, ovr=ovr))
+    vrt_path = os.path.splitext(path)[0] + '.vrt'
+    with open(vrt_path, 'w') as vrt:
+        vrt.write('<VRTDataset rasterXSize="{}" rasterYSize="{}"><SRS>{}</SRS>'
+                  '<GeoTransform>{}</GeoTransform>{}</VRTDataset>'.format(
+                      meta['width'], meta['height'], crs, gt, ''.join(bands)))
+    return vrt_path
+
+def to_cog(arr, path='./output.tif', proj=None, spec=None, bands=None, overviews=None,
+           resampling='average', **kwargs):
+    ''' Write out a cloud-optimized geotiff of the image with internal overviews
+
+    Overview levels are reduced from the image chunks in the same pass that fetches them,
+    the image is not read a second time to build overviews. The output is tiled and laid out
+    with the image file directories and overviews ahead of the full resolution data so that
+    readers can fetch a single level with range requests.
+
+    Args:
+        path (str): path to write the geotiff file to, default is ./output.tif
+        proj (str): EPSG string of projection to reproject to
+        spec (str): if set to 'rgb', write out color-balanced 8-bit RGB tif
+        bands (list): list of bands to export. If spec='rgb' will default to RGB bands
+        overviews (list): decimation factors of the overview levels, powers of 2. Defaults to
+            halving the image until it fits in a single tile.
+        resampling (str): 'average' or 'nearest', the resampling used to build overviews
+        compress (str): compression to apply, one of 'deflate', 'lzw', 'zstd' or 'packbits'
+        predictor (int): compression predictor, 2 for integer data and 3 for floating point data
+        progress (bool): print the number of chunks written and the write throughput
+
+    Returns:
+        str: path the geotiff was written to'''
+
+    assert has_rasterio, "To create geotiff images please install rasterio"
+    assert resampling in ('average', 'nearest'), "resampling must be 'average' or 'nearest'"
+
+    kwargs["tiled"] = True
+    arr, meta = _prepare(arr, proj=proj, spec=spec, bands=bands, **kwargs)
+    blockxsize, blockysize = meta["blockxsize"], meta["blockysize"]
+    if overviews is None:
+        overviews = _overview_factors(meta["height"], meta["width"], max(blockxsize, blockysize))
+
+    # work on a plain dask array, overview levels don't carry geo information
+    base = da.Array(arr.dask, arr.name, arr.chunks, arr.dtype)
+    chunks = (base.shape[0], blockysize, blockxsize)
+    levels, level, factor = [], base, 1
+    for target in sorted(overviews):
+        while factor < target:
+            level = _decimate(level, chunks, resampling=resampling)
+            factor *= 2
+        levels.append(level)
+
+    # intermediate files are uncompressed, compression is applied in the final copy
+    tmpdir = tempfile.mkdtemp(prefix='gbdxtools', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        base_meta = {k: v for k, v in meta.items() if k not in ("compress", "predictor")}
+        base_path = os.path.join(tmpdir, 'base.tif')
+        ovr_paths = [os.path.join(tmpdir, 'ovr_{}.tif'.format(idx)) for idx in range(len(levels))]
+        dsts = [rasterio.open(base_path, "w", **base_meta)]
+        for level, ovr_path in zip(levels, ovr_paths):
+            ovr_meta = dict(base_meta, width=level.shape[2], height=level.shape[1])
+            if meta["transform"] is not None:
+                ovr_meta["transform"] = meta["transform"] * Affine.scale(float(meta["width"]) / level.shape[2],
+                                                                         float(meta["height"]) / level.shape[1])
+            dsts.append(rasterio.open(ovr_path, "w", **ovr_meta))
+        try:
+            _store([base] + levels, dsts, **kwargs)
+        finally:
+            for dst in dsts:
+                dst.close()
+
+        vrt_path = _vrt_with_overviews(base_path, meta, ovr_paths)
+        copy_opts = {k: v for k, v in meta.items() if k in ("compress", "predictor")}
+        rasterio.shutil.copy(vrt_path, path, driver="GTiff", tiled=True, blockxsize=blockxsize,
+                             blockysize=blockysize, copy_src_overviews=True, **copy_opts)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return path
+
+def _dump_geo_transform(gt):
+    ''' JSON serializable description of an AffineTransform or RatPolyTransform '''
+    from gbdxtools.rda.util import RatPolyTransform
+    if isinstance(gt, RatPolyTransform):
+        return {
+            "type": "rpc",
+            "A": gt._A.tolist(),
+            "B": gt._B.tolist(),
+            "offset": gt._offset.tolist(),
+            "scale": gt._scale.tolist(),
+            "px_offset": gt._px_offset.tolist(),
+            "px_scale": gt._px_scale.tolist(),
+            "gsd": gt.gsd,
+            "proj": gt.proj,
+            "default_z": gt._default_z
+        }
+    return {"type": "affine", "affine": list(gt._affine)[:6], "proj": gt.proj}
+
+def _load_geo_transform(attrs):
+    from gbdxtools.rda.util import RatPolyTransform, AffineTransform
+    if attrs["type"] == "rpc":
+        params = [np.asarray(attrs[k]) for k in ("A", "B", "offset", "scale", "px_offset", "px_scale")]
+        return RatPolyTransform(*params, gsd=attrs["gsd"], proj=attrs["proj"], default_z=attrs["default_z"])
+    return AffineTransform(Affine(*attrs["affine"]), proj=attrs["proj"])
+
+def _is_regular(chunks):
+    ''' True if all chunks but the last have the same size and the last one is not larger '''
+    return all(len(set(c[:-1])) <= 1 and c[-1] <= c[0] for c in chunks)
+
+def to_zarr(arr, path, overwrite=False, **kwargs):
+    ''' Write the image chunks in parallel to a zarr store along with its geo information
+
+    Args:
+        path (str): path of the zarr store directory
+        overwrite (bool): replace an existing store at the same path, defaults to False
+        compressor: optional numcodecs compressor, defaults to the zarr default
+
+    Returns:
+        str: path the zarr store was written to'''
+
+    assert has_zarr, "To create zarr stores please install zarr"
+
+    # zarr chunks are regular, slicing an image leaves partial chunks on its edges
+    if not _is_regular(arr.chunks):
+        arr = arr.rechunk(tuple(max(c) for c in arr.chunks))
+    chunks = tuple(c[0] for c in arr.chunks)
+
+    opts = {k: v for k, v in kwargs.items() if k in ("compressor", "filters")}
+    z = zarr.open_array(path, mode='w' if overwrite else 'w-', shape=arr.shape, chunks=chunks,
+                        dtype=arr.dtype, **opts)
+    attrs = {
+        "__geo_transform__": _dump_geo_transform(arr.__geo_transform__),
+        "__geo_interface__": json.loads(json.dumps(arr.__geo_interface__))
+    }
+    try:
+        attrs["rda_metadata"] = arr.rda.metadata
+    except AttributeError:
+        pass
+    z.attrs.update(attrs)
+
+    # chunk aligned writes touch separate zarr chunks and are safe without a lock
+    result = store(arr, z, lock=False, compute=False)
+    result.compute(scheduler=threaded_get)
+    return path
+
+def open_zarr(path):
+    ''' Open a zarr store written by `to_zarr` as a GeoDaskImage
+
+    Args:
+        path (str): path of the zarr store directory
+
+    Returns:
+        GeoDaskImage: a lazy image backed by the zarr chunks with the geo information of the source image'''
+
+    assert has_zarr, "To read zarr stores please install zarr"
+    from gbdxtools.images.meta import GeoDaskImage
+
+    z = zarr.open_array(path, mode='r')
+    darr = da.from_array(z, chunks=z.chunks, name="zarr-{}".format(tokenize(os.path.abspath(path))))
+    return GeoDaskImage(darr, __geo_transform__=_load_geo_transform(z.attrs["__geo_transform__"]),
+                        __geo_interface__=z.attrs["__geo_interface__"])
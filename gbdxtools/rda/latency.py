@@ -0,0 +1,39 @@
+import time
+import threading
+from contextlib import contextmanager
+
+class Latency(object):
+    """ Wall clock time spent in each phase of image construction
+
+    Phases are the network round trips made while an image is built, e.g. the catalog
+    query, the graph registration and the metadata fetch.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def record(self, phase, seconds):
+        with self._lock:
+            count, total, slowest = self._stats.get(phase, (0, 0.0, 0.0))
+            self._stats[phase] = (count + 1, total + seconds, max(slowest, seconds))
+
+    @contextmanager
+    def measure(self, phase):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(phase, time.time() - start)
+
+    def report(self):
+        """ Number of calls, mean and max seconds by phase """
+        with self._lock:
+            stats = dict(self._stats)
+        return {phase: {"count": count, "mean": total / count, "max": slowest}
+                for phase, (count, total, slowest) in stats.items()}
+
+latency = Latency()
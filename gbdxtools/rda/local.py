@@ -0,0 +1,178 @@
+"""
+Local evaluation of per-pixel RDA operators.
+
+Graphs ending in cheap per-pixel operators (data type conversions, band selections and band
+math) are split in two: the base graph is registered and its tiles fetched from RDA, the
+operators on top of it are applied to each fetched chunk with NumPy. Variations of the same
+base graph then share one registration and one set of cached tiles.
+"""
+import re
+import ast
+import json
+import operator
+from functools import partial
+
+import six
+import numpy as np
+
+from gbdxtools.rda.util import DTYPE_TO_RDA
+
+RDA_TO_NUMPY = {v: k for k, v in DTYPE_TO_RDA.items()}
+
+LOCAL_OPERATORS = {}
+
+def local_operator(name):
+    """ Registers a NumPy implementation of the RDA operator `name`
+
+    The implementation takes a (bands, y, x) chunk and the operator parameters and returns
+    the transformed chunk.
+    """
+    def register(fn):
+        LOCAL_OPERATORS[name] = fn
+        return fn
+    return register
+
+def _param(params, key, default=None):
+    value = params.get(key, default)
+    if isinstance(value, six.string_types):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+@local_operator("Format")
+def _format(arr, params):
+    dtype = np.dtype(RDA_TO_NUMPY[str(_param(params, "dataType"))])
+    if np.issubdtype(dtype, np.integer):
+        # saturate rather than wrap around
+        if not np.issubdtype(arr.dtype, np.integer):
+            arr = np.rint(arr)
+        info = np.iinfo(dtype)
+        arr = np.clip(arr, info.min, info.max)
+    return arr.astype(dtype)
+
+@local_operator("BandSelect")
+def _band_select(arr, params):
+    return arr[list(_param(params, "bandIndices")), ...]
+
+_BINOPS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+           ast.Div: operator.truediv, ast.Pow: operator.pow, ast.Mod: operator.mod}
+_UNARYOPS = {ast.USub: operator.neg, ast.UAdd: operator.pos}
+_COMPARE = {ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt,
+            ast.GtE: operator.ge, ast.Eq: operator.eq, ast.NotEq: operator.ne}
+_NUMBERS = (ast.Constant,) if hasattr(ast, "Constant") else (ast.Num,)
+_FUNCTIONS = {"sqrt": np.sqrt, "abs": np.abs, "log": np.log, "exp": np.exp,
+              "min": np.minimum, "max": np.maximum, "where": np.where}
+
+def _evaluate(node, bands):
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body, bands)
+    if isinstance(node, _NUMBERS):
+        value = getattr(node, "value", getattr(node, "n", None))
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+    if isinstance(node, ast.Name) and node.id.startswith("b") and node.id[1:].isdigit():
+        return bands[int(node.id[1:])]
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINOPS:
+        return _BINOPS[type(node.op)](_evaluate(node.left, bands), _evaluate(node.right, bands))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARYOPS:
+        return _UNARYOPS[type(node.op)](_evaluate(node.operand, bands))
+    if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in _COMPARE:
+        return _COMPARE[type(node.ops[0])](_evaluate(node.left, bands), _evaluate(node.comparators[0], bands))
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _FUNCTIONS
+            and not node.keywords):
+        return _FUNCTIONS[node.func.id](*[_evaluate(arg, bands) for arg in node.args])
+    raise ValueError("Unsupported band math expression: {}".format(ast.dump(node)))
+
+def parse_expression(expression):
+    """ Parses a band math expression, bands are referenced as $0, $1, ... """
+    return ast.parse(expression.replace("$", "b"), mode="eval")
+
+_TOKEN = re.compile(r"\$(\d+)|\b([A-Za-z_]\w*)\b")
+
+def compile_expressions(expressions, bands=None):
+    """ Compiles band math expressions into a single function evaluated per block
+
+    Bands are referenced as $0, $1, ... or by name. With a list of `bands`, $i refers to band
+    `bands[i]` of the image, with a dict names refer to the band index they map to.
+
+    Returns:
+        tuple: the image band indices read by the expressions, in order, and a function
+        mapping a block of those bands to a float32 (expressions, y, x) block
+    """
+    if isinstance(expressions, six.string_types):
+        expressions = [expressions]
+    names = bands if isinstance(bands, dict) else {}
+    used = []
+
+    def band_ref(match):
+        index, name = match.groups()
+        if index is not None:
+            band = bands[int(index)] if isinstance(bands, (list, tuple)) else int(index)
+        elif name in names:
+            band = names[name]
+        else:
+            return name
+        if band not in used:
+            used.append(band)
+        return "$" + str(used.index(band))
+
+    parsed = [parse_expression(_TOKEN.sub(band_ref, e)) for e in expressions]
+
+    def evaluate(block):
+        block = block.astype(np.float32)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out = [np.broadcast_to(_evaluate(p, block), block.shape[1:]) for p in parsed]
+        return np.stack(out).astype(np.float32)
+    return used, evaluate
+
+@local_operator("BandMath")
+def _band_math(arr, params):
+    expressions = _param(params, "expressions")
+    if isinstance(expressions, six.string_types):
+        expressions = expressions.split(";")
+    used, evaluate = compile_expressions(expressions)
+    return evaluate(arr[used, ...])
+
+def split_graph(op):
+    """ Splits an op into the base op evaluated by RDA and the operators evaluated locally
+
+    Returns:
+        tuple: the base op and a list of (operator, parameters), first to apply first
+    """
+    local = []
+    while op._operator in LOCAL_OPERATORS and len(op._args) == 1:
+        local.append((op._operator, op._node["parameters"]))
+        op = op._args[0]
+    return op, local[::-1]
+
+def apply_local(arr, steps):
+    """ Applies local operators to a (bands, y, x) array """
+    for name, params in steps:
+        arr = LOCAL_OPERATORS[name](arr, params)
+    return arr
+
+def local_image(op):
+    """ Image of an RDA op with the per-pixel operators at the top of its graph evaluated locally
+
+    Only the base graph is registered with RDA, so images differing only in those operators
+    reuse the same registration and tiles.
+
+    Args:
+        op: an RDA op, e.g. `rda.Format(rda.BandSelect(strip, bandIndices=[4, 2, 1]), dataType="1")`
+
+    Returns:
+        image: a GeoDaskImage of the op
+    """
+    from gbdxtools.images.rda_image import RDAImage
+    base, steps = split_graph(op)
+    img = RDAImage(base)
+    if not steps:
+        return img
+    if len(img.chunks[0]) > 1:
+        img = img.rechunk({0: img.shape[0]})
+    # infer the output bands and dtype from a single pixel
+    sample = apply_local(np.zeros((img.shape[0], 1, 1), dtype=img.dtype), steps)
+    return img.map_blocks(partial(apply_local, steps=steps), dtype=sample.dtype,
+                          chunks=((sample.shape[0],),) + img.chunks[1:])
@@ -0,0 +1,113 @@
+import os
+import shutil
+import threading
+import tempfile
+from hashlib import sha256
+from collections import defaultdict
+
+import numpy as np
+
+OVERVIEW_DIR = os.environ.get("GBDX_OVERVIEW_DIR", os.path.join(os.path.expanduser("~"), ".gbdx", "overviews"))
+OVERVIEW_LEVELS = int(os.environ.get("GBDX_OVERVIEW_LEVELS", 4))
+# off unless asked for, the pyramid is written as tiles are fetched and is not pruned
+OVERVIEW_ENABLED = os.environ.get("GBDX_OVERVIEWS", "0").lower() in ("1", "true", "yes")
+
+def decimate(tile, factor):
+    """ Averages a (bands, y, x) tile over `factor` x `factor` pixel blocks """
+    bands, height, width = tile.shape
+    blocks = tile.reshape(bands, height // factor, factor, width // factor, factor)
+    return blocks.mean(axis=(2, 4)).astype(tile.dtype)
+
+class OverviewPyramid(object):
+    """ On disk pyramid of decimated RDA tiles
+
+    Level k holds every fetched tile averaged over 2^k x 2^k pixel blocks. The levels of a tile
+    are built when the tile is fetched, each from the level below it, so coarse reads of areas
+    that were viewed before are served from disk without requests to RDA. Tiles are keyed by
+    the tile url template of their graph node and their tile x, y.
+
+    Args:
+        path (str): directory of the pyramid
+        levels (int): number of levels kept, the coarsest is reduced by 2^levels
+        enabled (bool): set to True to record and serve overviews, defaults to the GBDX_OVERVIEWS
+            environment variable
+    """
+    def __init__(self, path=OVERVIEW_DIR, levels=OVERVIEW_LEVELS, enabled=OVERVIEW_ENABLED):
+        self.path = path
+        self.levels = levels
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    def _file(self, source, level, x, y):
+        key = sha256(source.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, key, str(level), "{}_{}.npy".format(x, y))
+
+    def record(self, source, x, y, tile):
+        """ Adds the overviews of a fetched tile, returns the tile """
+        if not self.enabled or not isinstance(tile, np.ndarray) or tile.ndim != 3:
+            return tile
+        overview = tile
+        try:
+            for level in range(1, self.levels + 1):
+                if overview.shape[1] % 2 or overview.shape[2] % 2:
+                    break
+                overview = decimate(overview, 2)
+                self._write(self._file(source, level, x, y), overview)
+        except (IOError, OSError):
+            pass
+        return tile
+
+    def _write(self, path, arr):
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # created by another thread
+                pass
+        # write then rename so concurrent readers never see a partial tile
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, arr)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # windows does not rename over an existing file
+            os.remove(tmp)
+
+    def level(self, factor):
+        """ Coarsest level whose reduction divides `factor`, 0 when no level does
+
+        The rest of the reduction is then an exact whole factor of the level.
+        """
+        level = 0
+        while level < self.levels and factor % 2 ** (level + 1) == 0:
+            level += 1
+        return level
+
+    def covers(self, source, level, tiles):
+        """ True when every (x, y) tile of `tiles` has an overview at `level`, counts hits and misses """
+        missing = sum(1 for x, y in tiles if not os.path.exists(self._file(source, level, x, y)))
+        with self._lock:
+            self.hits[level] += len(tiles) - missing
+            self.misses[level] += missing
+        return self.enabled and missing == 0
+
+    def load(self, source, level, x, y):
+        return np.load(self._file(source, level, x, y))
+
+    def clear(self):
+        """ Removes all overviews from disk """
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def report(self):
+        """ Tiles found and missing, and the hit ratio, by level """
+        levels = set(self.hits) | set(self.misses)
+        return {level: {"hits": self.hits[level], "misses": self.misses[level],
+                        "ratio": self.hits[level] / float(self.hits[level] + self.misses[level] or 1)}
+                for level in levels}
+
+overviews = OverviewPyramid()
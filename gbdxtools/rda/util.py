@@ -45,6 +45,16 @@ RDA_TO_DTYPE = {
     "DOUBLE": "float64"
 }
 
+# dataType codes of the Format operator
+DTYPE_TO_RDA = {
+    "uint8": "0",
+    "uint16": "1",
+    "int16": "2",
+    "int32": "3",
+    "float32": "4",
+    "float64": "5"
+}
+
 CUSTOM_PRJ = {
     "EPSG:54008": "+proj=sinu +lon_0=0 +x_0=0 +y_0=0 +ellps=WGS84 +datum=WGS84 +units=m +no_defs"
 }
@@ -287,6 +297,45 @@ def calc_toa_gain_offset(meta):
     return zip(scale, scale2, offset)
 
 
+def rda_calibration(md):
+    """
+    IDAHO style calibration metadata, as used by calc_toa_gain_offset, from RDA image metadata
+
+    RDA lists the calibration factors and bandwidths in band order, IDAHO metadata in the order
+    of its band_names. The earth-sun distance is computed at the center of the image bounds.
+    """
+    img_md = md["image"]
+    satid, _, bandid = img_md["sensorAlias"].partition("_")
+    date = img_md["acquisitionDate"].rstrip("Z")
+    acquired = datetime.datetime.strptime(date, "%Y-%m-%dT%H:%M:%S.%f" if "." in date else "%Y-%m-%dT%H:%M:%S")
+    center = loads(img_md["imageBoundsWGS84"]).centroid
+    return {
+        "satid": satid,
+        "bandid": bandid,
+        "abscalfactor": img_md["absoluteCalibrationFactors"],
+        "effbandwidth": img_md["effectiveBandwidths"],
+        "mean_sun_el": img_md["sunElevation"],
+        "img_datetime_obj_utc": {"$date": (acquired - datetime.datetime(1970, 1, 1)).total_seconds() * 1000.0},
+        "latlonhae": [center.y, center.x, 0.0]
+    }
+
+
+def calc_correction_coefficients(meta, correction="TOAREFLECTANCE"):
+    """
+    Compute per band (gain, offset) arrays converting DN to the given correction, value = DN * gain + offset
+
+    Supported corrections are "DN", "RADIANCE" and "TOAREFLECTANCE".
+    """
+    scale, scale2, offset = [np.asarray(v, dtype=np.float64) for v in zip(*calc_toa_gain_offset(meta))]
+    if correction == "DN":
+        return np.ones_like(scale), np.zeros_like(scale)
+    elif correction == "RADIANCE":
+        return scale, offset
+    elif correction == "TOAREFLECTANCE":
+        return scale * scale2, offset * scale2
+    raise ValueError("Unsupported client side correction: {}".format(correction))
+
+
 class RatPolyTransform(GeometricTransform):
     def __init__(self, A, B, offset, scale, px_offset, px_scale, gsd=None, proj=None, default_z=0):
         self.proj = proj
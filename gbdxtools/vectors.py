@@ -17,6 +17,8 @@ import requests
 from shapely.wkt import loads as load_wkt
 from collections import OrderedDict
 import json, time, os
+import threading
+from six.moves import queue
 
 from shapely.ops import cascaded_union
 from shapely.geometry import shape, box
@@ -26,10 +28,126 @@ from gbdxtools.vector_layers import VectorGeojsonLayer, VectorTileLayer, \
                                     ImageLayer
 from gbdxtools.map_templates import BaseTemplate
 from gbdxtools.auth import Auth
+from gbdxtools.rda.latency import latency
+
+# (rows, columns) image layers of maps are read at, at least
+IMAGE_LAYER_SHAPE = (1024, 1024)
+
+_END = object()
+# max number of geohash buckets used to partition queries
+GEOHASH_BUCKETS = 10000
+
+def merge_iters(iterables, max_workers=4, size=2):
+    """ Items of several iterables, each iterated in one of `max_workers` background threads
+
+    Items are yielded as they arrive, at most `size` of them waiting for the consumer. Errors
+    raised by an iterable are raised to the consumer. Closing the generator stops the threads.
+    """
+    tasks = queue.Queue()
+    for iterable in iterables:
+        tasks.put(iterable)
+    buf = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buf.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            while not stop.is_set():
+                try:
+                    iterable = tasks.get_nowait()
+                except queue.Empty:
+                    break
+                for item in iterable:
+                    if not put((item, None)):
+                        return
+            put((_END, None))
+        except Exception as e:
+            put((_END, e))
+
+    workers = max(1, min(max_workers, tasks.qsize()))
+    for _ in range(workers):
+        thread = threading.Thread(target=produce)
+        thread.daemon = True
+        thread.start()
+    try:
+        done = 0
+        while done < workers:
+            item, error = buf.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                done += 1
+                continue
+            yield item
+    finally:
+        stop.set()
+
+def prefetch_iter(iterable, size=2):
+    """ Iterates over `iterable` in a background thread, at most `size` items ahead of the consumer """
+    return merge_iters([iterable], max_workers=1, size=size)
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+def geohash_bounds(geohash):
+    """ (left, lower, right, upper) of a geohash cell """
+    lon, lat = [-180.0, 180.0], [-90.0, 90.0]
+    even = True
+    for char in geohash:
+        bits = GEOHASH_BASE32.index(char)
+        for shift in range(4, -1, -1):
+            interval = lon if even else lat
+            mid = (interval[0] + interval[1]) / 2.0
+            if bits >> shift & 1:
+                interval[0] = mid
+            else:
+                interval[1] = mid
+            even = not even
+    return lon[0], lat[0], lon[1], lat[1]
+
+def partition_area(bounds, buckets, max_items=10000, max_depth=8, complete=True):
+    """ Quadtree of boxes covering `bounds`, each holding about `max_items` results at most
+
+    Args:
+        bounds (tuple): (left, lower, right, upper) of the area
+        buckets (list): (geometry, count) of each bucket of a geohash aggregation of the results,
+            counts are assumed spread evenly over their bucket
+        max_items (int): boxes with more results are split in four
+        max_depth (int): max number of times a box is split
+        complete (bool): the buckets hold every result, boxes without results are left out
+
+    Returns:
+        list: shapely boxes
+    """
+    def estimate(cell):
+        return sum(count * cell.intersection(g).area / g.area
+                   for g, count in buckets if g.area and cell.intersects(g))
+
+    cells, partitions = [(box(*bounds), 0)], []
+    while cells:
+        cell, depth = cells.pop()
+        items = estimate(cell)
+        if depth < max_depth and items > max_items:
+            left, lower, right, upper = cell.bounds
+            x, y = (left + right) / 2.0, (lower + upper) / 2.0
+            cells.extend((box(*b), depth + 1) for b in [(left, lower, x, y), (x, lower, right, y),
+                                                        (left, y, x, upper), (x, y, right, upper)])
+        elif items > 0 or not complete:
+            partitions.append(cell)
+    return partitions
 
 
 class Vectors(object):
     default_index = 'vector-gbdx-alpha-catalog-v2-*'
+    # top level vector properties, others are attributes
+    vector_fields = ('item_type', 'ingest_source', 'text', 'name', 'attributes')
 
     def __init__(self, **kwargs):
         ''' Construct the Vectors interface class
@@ -49,6 +167,8 @@ class Vectors(object):
         self.create_url = 'https://vector.geobigdata.io/insight-vector/api/vectors'
         self.aggregations_url = 'https://vector.geobigdata.io/insight-vector/api/aggregation'
         self.aggregations_by_index_url = 'https://vector.geobigdata.io/insight-vector/api/index/aggregation/%s'
+        # items, pages, seconds and items per second of the last paged query
+        self.query_stats = None
 
     def create(self,vectors):
         """ Create a vectors in the vector service.
@@ -100,6 +220,40 @@ class Vectors(object):
         r.raise_for_status()
         return r.json()
 
+    def create_iteratively(self, vectors, item_type=None, ingest_source=None, batch_size=1000):
+        """ Create vectors in the vector service in batches, e.g. from a generator
+
+        At most `batch_size` vectors are held at a time, so features produced lazily, like the
+        ones of `GeoDaskImage.polygonize`, are ingested without holding all of them.
+
+        Args:
+            vectors: an iterable of geojson vectors
+            item_type (str): optional, item_type of the vectors without one
+            ingest_source (str): optional, ingest_source of the vectors without one
+            batch_size (int): optional, number of vectors created per request, default is 1000
+
+        Returns:
+            (list): IDs of the vectors created
+        """
+        ids, batch = [], []
+        for vector in vectors:
+            props = vector.setdefault('properties', {})
+            if 'attributes' not in props:
+                # plain feature properties become the vector attributes
+                attributes = {k: props.pop(k) for k in list(props) if k not in self.vector_fields}
+                props['attributes'] = attributes
+            if item_type is not None:
+                props.setdefault('item_type', item_type)
+            if ingest_source is not None:
+                props.setdefault('ingest_source', ingest_source)
+            batch.append(vector)
+            if len(batch) >= batch_size:
+                ids.extend(self.create(batch))
+                batch = []
+        if batch:
+            ids.extend(self.create(batch))
+        return ids
+
     def create_from_wkt(self, wkt, item_type, ingest_source, **attributes):
         '''
         Create a single vector in the vector service
@@ -146,7 +300,7 @@ class Vectors(object):
         return r.json()
 
 
-    def query(self, searchAreaWkt, query, count=100, ttl='5m', index=default_index):
+    def query(self, searchAreaWkt, query, count=100, ttl='5m', index=default_index, page_size=1000, prefetch=2):
         '''
         Perform a vector services query using the QUERY API
         (https://gbdxdocs.digitalglobe.com/docs/vs-query-list-vector-items-returns-default-fields)
@@ -156,6 +310,8 @@ class Vectors(object):
             query: Elastic Search query
             count: Maximum number of results to return
             ttl: Amount of time for each temporary vector page to exist
+            page_size: Number of results per page of paged queries, at most 1000
+            prefetch: Number of pages fetched ahead while paging, see `query_iteratively`
 
         Returns:
             List of vector results
@@ -180,31 +336,69 @@ class Vectors(object):
             r.raise_for_status()
             return r.json()
         else:
-            return list(self.query_iteratively(searchAreaWkt, query, count, ttl, index))
+            return list(self.query_iteratively(searchAreaWkt, query, count, ttl, index,
+                                               page_size=page_size, prefetch=prefetch))
 
 
-    def query_iteratively(self, searchAreaWkt, query, count=100, ttl='5m', index=default_index):
+    def query_iteratively(self, searchAreaWkt, query, count=100, ttl='5m', index=default_index, page_size=1000,
+                          prefetch=2):
         '''
         Perform a vector services query using the QUERY API
         (https://gbdxdocs.digitalglobe.com/docs/vs-query-list-vector-items-returns-default-fields)
 
+        Pages are fetched in a background thread up to `prefetch` pages ahead of the consumer,
+        so the next page is on its way while the current one is processed. Once the generator
+        is exhausted or closed, `query_stats` holds the items, pages, seconds and items per
+        second of the query.
+
         Args:
             searchAreaWkt: WKT Polygon of area to search
             query: Elastic Search query
             count: Maximum number of results to return
             ttl: Amount of time for each temporary vector page to exist
+            page_size: Number of results per page, at most 1000
+            prefetch: Number of pages buffered ahead of the consumer, 0 fetches each page when it is needed
 
         Returns:
             generator of vector results
     
         '''
+        pages = self._query_pages(searchAreaWkt, query, count, ttl, index, page_size)
+        if prefetch > 0:
+            pages = prefetch_iter(pages, prefetch)
 
+        start = time.time()
+        num_results, num_pages = 0, 0
+        try:
+            for data in pages:
+                num_pages += 1
+                for vector in data:
+                    if num_results >= count:
+                        return
+                    num_results += 1
+                    yield vector
+        finally:
+            pages.close()
+            seconds = time.time() - start
+            self.query_stats = {"items": num_results, "pages": num_pages, "seconds": seconds,
+                                "items_per_second": num_results / seconds if seconds > 0 else 0.0}
+
+    def _query_pages(self, searchAreaWkt, query, count, ttl, index, page_size=1000, remaining=None):
+        """ Generator of the pages of a paged query, until `count` results are fetched
+
+        `remaining` is an optional function returning the number of results still wanted by
+        the consumer of several queries sharing `count`, paging stops once it reaches 0.
+        """
+        if remaining is not None:
+            count = min(count, remaining())
+            if count <= 0:
+                return
         search_area_polygon = from_wkt(searchAreaWkt)
         left, lower, right, upper = search_area_polygon.bounds
 
         params = {
             "q": query,
-            "count": min(count,1000),
+            "count": min(count, page_size, 1000),
             "ttl": ttl,
             "left": left,
             "right": right,
@@ -214,44 +408,90 @@ class Vectors(object):
 
         # initialize paging request
         url = self.query_index_page_url % index if index else self.query_page_url
-        r = self.gbdx_connection.get(url, params=params)
+        with latency.measure("vector_page"):
+            r = self.gbdx_connection.get(url, params=params)
         r.raise_for_status()
         page = r.json()
         paging_id = page['next_paging_id']
         item_count = int(page['item_count'])
-        data = page['data']
+        num_results = len(page['data'])
+        yield page['data']
 
+        # get vectors from each page
+        while paging_id and item_count > 0 and num_results < count and (remaining is None or remaining() > 0):
+            headers = {'Content-Type':'application/x-www-form-urlencoded'}
+            data = {
+                "pagingId": paging_id,
+                "ttl": ttl
+            }
+            with latency.measure("vector_page"):
+                r = self.gbdx_connection.post(self.page_url, headers=headers, data=data)
+            r.raise_for_status()
+            page = r.json()
+            paging_id = page['next_paging_id']
+            item_count = int(page['item_count'])
+            num_results += len(page['data'])
+            yield page['data']
+
+    def query_partitioned(self, searchAreaWkt, query, count=None, ttl='5m', index=default_index,
+                          max_items=10000, hash_length=3, max_workers=8, page_size=1000):
+        '''
+        Perform a vector services query over large areas as concurrent queries of sub-areas
 
-        num_results = 0
-        for vector in data:
-          num_results += 1
-          if num_results > count: break
-          yield vector
+        A geohash aggregation of the query estimates where the results are. The bounding box of
+        the search area is then split into a quadtree of boxes holding about `max_items` results
+        each, and boxes without results are dropped. The boxes are paged through concurrently and
+        their results are yielded as they arrive. Results found in several boxes are yielded once.
+        `query_stats` holds the items, duplicates, partitions, seconds and items per second of the
+        query once the generator is exhausted or closed.
 
-        if num_results == count:
-          return
+        Args:
+            searchAreaWkt: WKT Polygon of area to search
+            query: Elastic Search query
+            count: Maximum number of results to return, defaults to all
+            ttl: Amount of time for each temporary vector page to exist
+            max_items: Number of results above which a box is split
+            hash_length: Length of the geohashes of the aggregation
+            max_workers: Number of boxes queried at the same time
+            page_size: Number of results per page, at most 1000
 
+        Returns:
+            generator of vector results
+        '''
+        count = float('inf') if count is None else count
+        bounds = from_wkt(searchAreaWkt).bounds
+        aggs = self.aggregate_query(searchAreaWkt, GeohashAggDef(hash_length), query=query,
+                                    count=GEOHASH_BUCKETS, index=index)
+        terms = aggs[0]['terms'] if aggs else []
+        buckets = [(box(*geohash_bounds(term['term'])), term['count']) for term in terms]
+        partitions = partition_area(bounds, buckets, max_items=max_items,
+                                    complete=len(terms) < GEOHASH_BUCKETS)
+        start = time.time()
+        seen = set()
+        num_results, duplicates = 0, 0
+        # the boxes stop paging once the results yielded so far fill `count`
+        remaining = lambda: count - num_results
+        pages = merge_iters([self._query_pages(cell.wkt, query, count, ttl, index, page_size, remaining=remaining)
+                             for cell in partitions], max_workers=max_workers, size=2 * max_workers)
 
-        # get vectors from each page
-        while paging_id and item_count > 0 and num_results < count:
-
-          headers = {'Content-Type':'application/x-www-form-urlencoded'}
-          data = {
-              "pagingId": paging_id,
-              "ttl": ttl
-          }
-
-          r = self.gbdx_connection.post(self.page_url, headers=headers, data=data)
-          r.raise_for_status()
-          page = r.json()
-          paging_id = page['next_paging_id']
-          item_count = int(page['item_count'])
-          data = page['data']
-
-          for vector in data:
-              num_results += 1
-              if num_results > count: break
-              yield vector
+        try:
+            for data in pages:
+                for vector in data:
+                    if num_results >= count:
+                        return
+                    vector_id = vector.get('properties', {}).get('id')
+                    if vector_id is not None:
+                        if vector_id in seen:
+                            duplicates += 1
+                            continue
+                        seen.add(vector_id)
+                    num_results += 1
+                    yield vector
+        finally:
+            pages.close()
+            seconds = time.time() - start
+            self.query_stats = {"items": num_results, "duplicates": duplicates, "partitions": len(partitions),
+                                "seconds": seconds, "items_per_second": num_results / seconds if seconds > 0 else 0.0}
 
     def aggregate_query(self, searchAreaWkt, agg_def, query=None, start_date=None, end_date=None, count=10, index=default_index):
         """Aggregates results of a query into buckets defined by the 'agg_def' parameter.  The aggregations are
@@ -354,7 +594,7 @@ class Vectors(object):
             zoom (int): the initial zoom level of the map
             center (list): a list of [lat, lon] used to center the map
             api_key (str): a valid Mapbox API key
-            image (dict): a CatalogImage or a ndarray
+            image (dict): a CatalogImage or a ndarray, images are read at a resolution of about IMAGE_LAYER_SHAPE pixels
             image_bounds (list): a list of bounds for image positioning 
             Use outside of GBDX Notebooks requires a MapBox API key, sign up for free at https://www.mapbox.com/pricing/
             Pass the key using the `api_key` keyword or set an environmental variable called `MAPBOX API KEY`
@@ -409,11 +649,15 @@ class Vectors(object):
     def _build_image_layer(self, image, image_bounds, cmap='viridis'):
         if image is not None:
             if isinstance(image, da.Array):
+                # images are read at about the size the map displays them
                 if len(image.shape) == 2 or \
                     (image.shape[0] == 1 and len(image.shape) == 3):
-                    arr = image.compute()
+                    if hasattr(image, 'at_resolution'):
+                        arr = image.read(target_shape=IMAGE_LAYER_SHAPE)
+                    else:
+                        arr = image.compute()
                 else:
-                    arr = image.rgb()
+                    arr = image.rgb(target_shape=IMAGE_LAYER_SHAPE)
                 coords = box(*image.bounds)
             else:
                 assert image_bounds is not None, "Must pass image_bounds with ndarray images"
@@ -0,0 +1,35 @@
+import pytest
+
+from gbdxtools.rda.cache import rda_cache
+from gbdxtools.images import rda_image, catalog_image
+
+
+@pytest.fixture(autouse=True)
+def rda_cache_dir(tmpdir, monkeypatch):
+    """ Each test caches RDA registrations in a temporary directory of its own
+
+    Registrations cached by an earlier test or run would skip requests the cassettes replay.
+    """
+    monkeypatch.setattr(rda_cache, "path", str(tmpdir.join("rda_cache")))
+    monkeypatch.setattr(rda_cache, "_mem", {})
+    yield rda_cache
+
+
+@pytest.fixture
+def no_pushdown(monkeypatch):
+    """ Band selections of reads are sliced locally
+
+    For cassettes recorded before reads pushed band selections into the RDA graph, the
+    registration of the rewritten graph is not among their responses.
+    """
+    monkeypatch.setattr(rda_image, "PUSHDOWN", False)
+
+
+@pytest.fixture
+def no_speculation(monkeypatch):
+    """ Catalog images do not register the WorldView graph speculatively
+
+    Cassettes replay the catalog query and the registration in order, a speculative
+    registration would take the responses out of turn.
+    """
+    monkeypatch.setattr(catalog_image, "SPECULATE", False)
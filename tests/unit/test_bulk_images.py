@@ -0,0 +1,46 @@
+'''
+Unit tests for concurrent image construction
+'''
+import threading
+import time
+import unittest
+
+from gbdxtools.images.bulk import bulk_images
+
+
+class MockImage(object):
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def __init__(self, _id, **kwargs):
+        if _id == "bad":
+            raise ValueError("no catalog entry for {}".format(_id))
+        with self.lock:
+            MockImage.active += 1
+            MockImage.peak = max(MockImage.peak, MockImage.active)
+        time.sleep(0.01)
+        with self.lock:
+            MockImage.active -= 1
+        self.id = _id
+        self.kwargs = kwargs
+
+
+class BulkImagesTest(unittest.TestCase):
+
+    def test_results_in_order_with_errors(self):
+        ids = ["a", "bad", "c", {"_id": "d", "bbox": [1, 2, 3, 4]}]
+        images = bulk_images(MockImage, ids, max_workers=4, proj="EPSG:3857")
+        self.assertEqual([img.id for img in images if isinstance(img, MockImage)], ["a", "c", "d"])
+        self.assertIsInstance(images[1], ValueError)
+        self.assertEqual(images[0].kwargs, {"proj": "EPSG:3857"})
+        self.assertEqual(images[3].kwargs, {"proj": "EPSG:3857", "bbox": [1, 2, 3, 4]})
+
+    def test_bounded_parallelism(self):
+        MockImage.peak = 0
+        images = bulk_images(MockImage, [str(i) for i in range(20)], max_workers=3)
+        self.assertEqual(len(images), 20)
+        self.assertTrue(1 < MockImage.peak <= 3)
+
+    def test_empty(self):
+        self.assertEqual(bulk_images(MockImage, []), [])
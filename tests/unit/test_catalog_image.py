@@ -7,9 +7,19 @@ from gbdxtools import *
 from gbdxtools.rda.error import UnsupportedImageType
 from auth_mock import gbdx 
 import vcr
+import os
 from os.path import join, isfile, dirname, realpath
+import shutil
 import tempfile
+import threading
 import unittest
+import pytest
+from mock import patch
+
+from gbdxtools.rda import graph
+from gbdxtools.rda.cache import rda_cache
+from gbdxtools.images import catalog_image
+from gbdxtools.images.worldview import WorldViewImage
 
 # How to use the mock_gbdx_session and vcr to create unit tests:
 # 1. Add a new test that is dependent upon actually hitting GBDX APIs.
@@ -36,11 +46,13 @@ class CatalogImageTest(unittest.TestCase):
         cls._temp_path = tempfile.mkdtemp()
         print("Created: {}".format(cls._temp_path))
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_cat_image_wv2.yaml', filter_headers=['authorization'])
     def test_wv2_image(self):
         wv2 = CatalogImage('1030010076B8F500')
         self.assertTrue(isinstance(wv2, WV02))
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_cat_image_wv3.yaml', filter_headers=['authorization'])
     def test_wv3_image(self):
         wv3 = CatalogImage('10400100343F3D00')
@@ -73,4 +85,160 @@ class CatalogImageTest(unittest.TestCase):
     #        img = CatalogImage('S2A_OPER_MSI_L1C_DS_MPS__20160904T224944_S20160904T180250_N02.04')
     #    except UnsupportedImageType:
     #        pass
-    
+
+
+class MockResponse(object):
+    status_code = 200
+    text = "graph-id-1234"
+
+
+class MockConn(object):
+    def __init__(self):
+        self.posts = 0
+
+    def post(self, url, data, headers=None):
+        self.posts += 1
+        return MockResponse()
+
+
+class SpeculativeOp(object):
+    """ Stands in for the WorldView graph, its metadata registers it through the cache """
+    GRAPH = {"nodes": [{"id": "strip", "operator": "DigitalGlobeStrip"}], "edges": []}
+
+    def __init__(self, conn, release=None):
+        self.conn = conn
+        self.release = release
+
+    @property
+    def metadata(self):
+        if self.release is not None:
+            self.release.wait(10)
+        return graph.register_rda_graph(self.conn, self.GRAPH)
+
+
+def catalog_record(item_type):
+    return {"properties": {"item_type": [item_type], "attributes": {"catalogID": "1030010076B8F500"}}}
+
+
+class SpeculativeRegistrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_path = tempfile.mkdtemp()
+        self.conn = MockConn()
+        # the speculative registration is handed over through the cache, kept in a temporary directory
+        self._patches = [patch.object(rda_cache, "path", self._temp_path), patch.object(rda_cache, "_mem", {}),
+                         patch.object(rda_cache, "enabled", True), patch.object(catalog_image, "SPECULATE", True)]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+        shutil.rmtree(self._temp_path)
+
+    def _image_by_type(self, records, op, cat_id='1030010076B8F500'):
+        register = CatalogImage._register_speculatively
+        def capture(cat_id, **kwargs):
+            self.speculative = register(cat_id, **kwargs)
+            return self.speculative
+        with patch.object(catalog_image, "vector_services_query", return_value=records), \
+                patch.object(WorldViewImage, "_build_graph", return_value=op), \
+                patch.object(CatalogImage, "_register_speculatively", side_effect=capture), \
+                patch.object(CatalogImage, "_image_class", side_effect=lambda rec, **kwargs: rec):
+            return CatalogImage._image_by_type(cat_id)
+
+    def test_registration_lands_in_cache(self):
+        record = catalog_record("WV02")
+        self.assertEqual(self._image_by_type([record], SpeculativeOp(self.conn)), record)
+        self.assertEqual(self.conn.posts, 1)
+        # the image registering the same graph finds it in the cache, in memory and on disk
+        self.assertEqual(graph.register_rda_graph(self.conn, SpeculativeOp.GRAPH), "graph-id-1234")
+        self.assertEqual(self.conn.posts, 1)
+        self.assertTrue(any(name.endswith(".json") for name in os.listdir(self._temp_path)))
+
+    def test_failed_lookup_does_not_wait(self):
+        release = threading.Event()
+        try:
+            with self.assertRaises(Exception):
+                self._image_by_type([], SpeculativeOp(self.conn, release=release))
+            self.assertFalse(self.speculative.done())
+        finally:
+            release.set()
+        self.speculative.exception()
+
+    def test_wrong_guess_does_not_wait(self):
+        release = threading.Event()
+        record = catalog_record("WV01")
+        try:
+            self.assertEqual(self._image_by_type([record], SpeculativeOp(self.conn, release=release)), record)
+            self.assertFalse(self.speculative.done())
+        finally:
+            release.set()
+        self.speculative.exception()
+
+    def test_no_speculation(self):
+        record = catalog_record("Landsat8")
+        op = SpeculativeOp(self.conn)
+        self._image_by_type([record], op, cat_id='LC80380302013160LGN00')
+        self.assertIsNone(self.speculative)
+        with patch.object(catalog_image, "SPECULATE", False):
+            self._image_by_type([catalog_record("WV02")], op)
+        self.assertIsNone(self.speculative)
+        self.assertEqual(self.conn.posts, 0)
+
+
+class SpeculativeCatalogImageTest(unittest.TestCase):
+    """ Catalog images built from cassettes with speculative registration on """
+
+    def setUp(self):
+        self.speculative = None
+        self._patches = [patch.object(rda_cache, "enabled", True), patch.object(catalog_image, "SPECULATE", True)]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+
+    def _capture(self):
+        register = CatalogImage._register_speculatively
+        def capture(cat_id, **kwargs):
+            self.speculative = register(cat_id, **kwargs)
+            return self.speculative
+        return patch.object(CatalogImage, "_register_speculatively", side_effect=capture)
+
+    def test_correct_guess(self):
+        query = catalog_image.vector_services_query
+        def query_after_speculation(*args, **kwargs):
+            # the cassette replays in order, the registration lands before the catalog query returns
+            self.speculative.exception()
+            return query(*args, **kwargs)
+        with my_vcr.use_cassette('tests/unit/cassettes/test_cat_image_wv2_speculative.yaml',
+                                 filter_headers=['authorization']) as cassette, self._capture(), \
+                patch.object(catalog_image, "vector_services_query", side_effect=query_after_speculation):
+            wv2 = CatalogImage('1030010076B8F500')
+        self.assertTrue(isinstance(wv2, WV02))
+        self.assertTrue(self.speculative.done())
+        # the image found the speculative registration and metadata in the cache
+        self.assertEqual(cassette.play_count, 3)
+        self.assertTrue(cassette.all_played)
+
+    def test_wrong_guess(self):
+        release = threading.Event()
+        executor = catalog_image.ThreadPoolExecutor(max_workers=1)
+        # keep the worker busy so the speculative registration is still queued when the catalog record returns
+        executor.submit(release.wait, 10)
+        try:
+            # a WorldView 2 looking catalog id, the catalog record says WorldView 1
+            with my_vcr.use_cassette('tests/unit/cassettes/test_cat_image_wv1.yaml',
+                                     filter_headers=['authorization']) as cassette, self._capture(), \
+                    patch.object(catalog_image, "_speculation_executor", return_value=executor):
+                wv1 = CatalogImage('1030010044CEA300')
+        finally:
+            release.set()
+            executor.shutdown()
+        self.assertTrue(isinstance(wv1, WV01))
+        self.assertTrue(self.speculative.cancelled())
+        # only the catalog query and the WorldView 1 registration and metadata were requested
+        self.assertEqual(cassette.play_count, 3)
+        self.assertTrue(cassette.all_played)
@@ -2,6 +2,7 @@ import warnings
 import contextlib
 import vcr
 import unittest
+import pytest
 
 
 def force(r1, r2):
@@ -33,6 +34,7 @@ class TestLegacySupport(unittest.TestCase):
         from gbdxtools import RDAImage
         self.assertTrue(hasattr(RDAImage, "ipe"))
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_cat_image_wv2.yaml', filter_headers=['authorization'])
     def test_class_instance_legacy_access(self):
         # Test access raises warning
@@ -67,6 +69,7 @@ class TestLegacySupport(unittest.TestCase):
         from gbdxtools import IpeImage
         #TODO: instantiate an IpeImage and check it raises DeprecationWarning
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_cat_image_wv2.yaml', filter_headers=['authorization'])
     def test_base_layer_match_dep(self):
         # Test access raises warning
@@ -0,0 +1,94 @@
+'''
+Unit tests for mergeable band histograms and contrast stretching
+'''
+import unittest
+
+import numpy as np
+import dask.array as da
+
+from gbdxtools.images.util.histogram import Histogram, sketch, stretch, equalize
+
+
+class HistogramTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = np.random.randint(1, 500, (3, 200, 150)).astype(np.uint16)
+
+    def test_integer_percentiles(self):
+        hist = Histogram.from_array(self.data)
+        expected = np.percentile(self.data, [2, 50, 98], axis=(1, 2)).T
+        np.testing.assert_allclose(hist.percentile([2, 50, 98]), expected, atol=1)
+        np.testing.assert_array_equal(hist.percentile([0, 100]),
+                                      np.stack([self.data.min(axis=(1, 2)), self.data.max(axis=(1, 2))], axis=1))
+
+    def test_nodata_is_not_counted(self):
+        data = self.data.copy()
+        data[:, :100, :] = 0
+        hist = Histogram.from_array(data)
+        self.assertEqual(sum(c.sum() for c in hist.counts), 3 * 100 * 150)
+        np.testing.assert_array_equal(hist.percentile([0])[:, 0], data[:, 100:, :].min(axis=(1, 2)))
+
+    def test_sketch_matches_in_memory_histogram(self):
+        hist = sketch(da.from_array(self.data, chunks=(1, 64, 64)))
+        expected = Histogram.from_array(self.data)
+        for band in range(3):
+            np.testing.assert_array_equal(hist.edges[band], expected.edges[band])
+            np.testing.assert_array_equal(hist.counts[band], expected.counts[band])
+
+    def test_sketch_float_percentiles(self):
+        data = np.random.random((2, 300, 300)).astype(np.float32) * 1000
+        hist = sketch(da.from_array(data, chunks=(2, 100, 100)))
+        expected = np.percentile(data, [2, 98], axis=(1, 2)).T
+        np.testing.assert_allclose(hist.percentile([2, 98]), expected, atol=5)
+
+    def test_from_rda(self):
+        md = {"numBands": 2, "lowValue": [0.0, 0.0], "highValue": [4.0, 4.0], "numBins": [4, 4],
+              "histograms": {"0": [5, 1, 1, 1], "1": [0, 0, 2, 2]}}
+        hist = Histogram.from_rda(md)
+        np.testing.assert_array_equal(hist.percentile([0, 100])[0], [1, 4])
+        np.testing.assert_array_equal(hist.percentile([0, 50, 100])[1], [2, 3, 4])
+        self.assertEqual(len(Histogram.from_rda(md, bands=[1]).counts), 1)
+
+
+class StretchTest(unittest.TestCase):
+
+    def test_stretch(self):
+        block = np.array([[[0, 100, 150, 200, 300]]], dtype=np.uint16)
+        expected = [0, 0, 127, 255, 255]
+        np.testing.assert_array_equal(stretch(block, [[100, 200]])[0, 0], expected)
+        np.testing.assert_array_equal(stretch(block.astype(np.float32), [[100, 200]])[0, 0], expected)
+
+    def test_stretch_gamma(self):
+        block = np.array([[[128]]], dtype=np.uint16)
+        self.assertEqual(stretch(block, [[0, 256]], gamma=2.0)[0, 0, 0], 179)
+
+    def test_stretch_no_dynamic_range(self):
+        block = np.array([[[5, 5]]], dtype=np.uint16)
+        np.testing.assert_array_equal(stretch(block, [[5, 5]]), [[[5, 5]]])
+
+    def test_equalize(self):
+        data = np.random.randint(1, 200, (3, 50, 50)).astype(np.uint16)
+        out = equalize(data, Histogram.from_array(data))
+        self.assertEqual(out.dtype, np.float32)
+        self.assertAlmostEqual(out.max(), 1.0)
+        order = np.argsort(data[0].ravel(), kind="mergesort")
+        self.assertTrue(np.all(np.diff(out[0].ravel()[order]) >= 0))
+
+
+class StretchedImageTest(unittest.TestCase):
+
+    def test_stretched_image(self):
+        from gbdxtools.images.meta import GeoDaskImage
+        from gbdxtools.rda.util import AffineTransform
+        from shapely.geometry import box, mapping
+        from affine import Affine
+        data = np.random.randint(1, 2000, (4, 100, 120)).astype(np.uint16)
+        gt = AffineTransform(Affine(0.5, 0, 100, 0, -0.5, 50), "EPSG:32616")
+        img = GeoDaskImage(da.from_array(data, chunks=(2, 64, 64)),
+                           __geo_interface__=mapping(box(100, 0, 160, 50)), __geo_transform__=gt)
+        rgb = img.stretched(bands=[2, 1, 0])
+        self.assertEqual(rgb.shape, (3, 100, 120))
+        self.assertEqual(rgb.dtype, np.uint8)
+        limits = img.histogram([2, 1, 0]).percentile([2, 98])
+        np.testing.assert_allclose(limits, np.percentile(data[[2, 1, 0]], [2, 98], axis=(1, 2)).T, atol=10)
+        np.testing.assert_array_equal(rgb.compute(), stretch(data[[2, 1, 0]], limits))
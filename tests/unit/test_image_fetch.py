@@ -9,6 +9,7 @@ from auth_mock import gbdx
 import vcr
 import tempfile
 import unittest
+import pytest
 
 import numpy as np 
 
@@ -37,6 +38,7 @@ class ImageFetchTest(unittest.TestCase):
     def setUpClass(cls):
         cls.gbdx = gbdx
 
+    @pytest.mark.usefixtures("no_speculation", "no_pushdown")
     @my_vcr.use_cassette('tests/unit/cassettes/test_wv_fetch.yaml', filter_headers=['authorization'])
     def test_image_fetch(self):
         wv2 = CatalogImage('1030010076B8F500')
@@ -48,3 +50,56 @@ class ImageFetchTest(unittest.TestCase):
         self.assertEquals(rgb.shape, (256,256,3))
         ndvi = aoi.ndvi()
         self.assertEquals(ndvi.shape, (256,256))
+
+
+def mock_load_urls(collection):
+    return {tuple(index): np.ones((8, 256, 256)) * len(collection) for url, token, index in collection}
+
+class GroupedFetchTest(unittest.TestCase):
+
+    def test_tiles_are_fetched_in_spatial_groups(self):
+        from gbdxtools.rda.fetch import AsyncBaseFetch, TileFetcher
+
+        class MockFetch(AsyncBaseFetch):
+            __fetch__ = staticmethod(mock_load_urls)
+            __batch_size__ = 4
+
+        fetcher = TileFetcher("url/{x}/{y}", "token", (8, 256, 256))
+        dsk = {("image-abc", 0, y, x): (fetcher, x + 10, y + 20) for y in range(4) for x in range(3)}
+        opt = MockFetch.__dask_optimize__(dsk, list(dsk.keys()))
+        groups = [k for k in opt if not isinstance(k, tuple)]
+        # 2x2 tile blocks over a 4x3 tile grid
+        self.assertEqual(len(groups), 4)
+        self.assertEqual(sorted(len(opt[g][1]) for g in groups), [2, 2, 4, 4])
+        tile = opt[("image-abc", 0, 3, 2)]
+        self.assertEqual(tile[1], "load_urls-image-abc-1-1")
+        self.assertIn(["url/12/23", "token", (0, 3, 2)], opt[tile[1]][1])
+
+    def test_tile_fetcher_resolves_urls(self):
+        from gbdxtools.rda.fetch import TileFetcher
+        calls = []
+        fetcher = TileFetcher("https://rda/tile/{x}/{y}.tif", "token", (8, 256, 256),
+                              fetch=lambda url, token, chunks: calls.append((url, token, chunks)))
+        fetcher(3, 7)
+        self.assertEqual(calls, [("https://rda/tile/3/7.tif", "token", (8, 256, 256))])
+
+    def test_tile_fetcher_refreshes_on_401(self):
+        from gbdxtools.rda.fetch import TileFetcher
+        from gbdxtools.rda.error import Unauthorized
+
+        class MockProvider(object):
+            token = "expired"
+            def refresh(self, expired=None):
+                self.expired = expired
+                self.token = "fresh"
+                return self.token
+
+        def fetch(url, token, chunks):
+            if token != "fresh":
+                raise Unauthorized(url)
+            return np.ones(chunks)
+
+        provider = MockProvider()
+        fetcher = TileFetcher("tile/{x}/{y}", provider, (1, 4, 4), fetch=fetch)
+        self.assertEqual(fetcher(0, 0).shape, (1, 4, 4))
+        self.assertEqual(provider.expired, "expired")
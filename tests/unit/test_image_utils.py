@@ -38,3 +38,55 @@ class ImageUtilTest(unittest.TestCase):
         self.assertTrue(ordered)
 
 
+
+
+# IDAHO metadata of a WV03 multispectral image, from tests/unit/cassettes/test_image_open.yaml
+WV03_CALIBRATION = {
+    "satid": "WV03", "bandid": "Multi", "mean_sun_el": 59.1,
+    "latlonhae": [10.30275313, -85.82977031, 67.58],
+    "img_datetime_obj_utc": {"$date": 1486485913540},
+    "abscalfactor": [0.0106378, 0.00621996, 0.0133187, 0.00684307, 0.0176201, 0.0143287, 0.0117971, 0.0102],
+    "effbandwidth": [0.0889, 0.0387, 0.0618, 0.0381, 0.054, 0.0405, 0.1004, 0.0585]
+}
+
+# RDA metadata of a WV03 multispectral strip, from tests/unit/cassettes/test_wv_image_default_aoi.yaml
+WV03_RDA_METADATA = {
+    "sensorAlias": "WV03_MULTI", "sunElevation": 58.5, "acquisitionDate": "2017-02-07T16:45:03.042Z",
+    "imageBoundsWGS84": "POLYGON ((-85.82997948 11.03403918, -85.68343600173914 11.03403918, "
+                        "-85.68343600173914 9.965752025849802, -85.82997948 9.965752025849802, -85.82997948 11.03403918))",
+    "absoluteCalibrationFactors": [0.0143287, 0.0176201, 0.0133187, 0.00684307, 0.0102, 0.00621996, 0.0117971, 0.0106378],
+    "effectiveBandwidths": [0.0405, 0.054, 0.0618, 0.0381, 0.0585, 0.0387, 0.1004, 0.0889]
+}
+
+class CorrectionCoefficientsTest(unittest.TestCase):
+
+    def test_correction_coefficients(self):
+        import numpy as np
+        from gbdxtools.rda.util import calc_toa_gain_offset, calc_correction_coefficients
+        scale, scale2, offset = [np.asarray(v) for v in zip(*calc_toa_gain_offset(WV03_CALIBRATION))]
+        gain, bias = calc_correction_coefficients(WV03_CALIBRATION, "DN")
+        np.testing.assert_array_equal(gain, np.ones(8))
+        np.testing.assert_array_equal(bias, np.zeros(8))
+        gain, bias = calc_correction_coefficients(WV03_CALIBRATION, "RADIANCE")
+        np.testing.assert_allclose(gain, scale)
+        gain, bias = calc_correction_coefficients(WV03_CALIBRATION, "TOAREFLECTANCE")
+        dn = np.array([300.0] * 8)
+        np.testing.assert_allclose(dn * gain + bias, (dn * scale + offset) * scale2)
+        with self.assertRaises(ValueError):
+            calc_correction_coefficients(WV03_CALIBRATION, "ACOMP")
+
+    def test_rda_calibration(self):
+        import numpy as np
+        from gbdxtools.rda import constants
+        from gbdxtools.rda.util import rda_calibration, calc_correction_coefficients
+        calibration = rda_calibration({"image": WV03_RDA_METADATA})
+        self.assertEqual((calibration["satid"], calibration["bandid"]), ("WV03", "MULTI"))
+        self.assertEqual(calibration["img_datetime_obj_utc"], {"$date": 1486485903042.0})
+        self.assertAlmostEqual(calibration["latlonhae"][0], 10.49989560, places=6)
+        gain, bias = calc_correction_coefficients(calibration, "RADIANCE")
+        # the RDA calibration factors are in band order
+        acf = np.array(WV03_RDA_METADATA["absoluteCalibrationFactors"])
+        ebw = np.array(WV03_RDA_METADATA["effectiveBandwidths"])
+        np.testing.assert_allclose(gain, acf / ebw * np.array(constants.DG_ABSCAL_GAIN["WV03_MULTI"]))
+        with self.assertRaises(KeyError):
+            rda_calibration({"image": {"sensorAlias": "WV03_MULTI"}})
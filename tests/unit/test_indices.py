@@ -12,6 +12,7 @@ from auth_mock import gbdx
 import vcr
 import tempfile
 import unittest
+import pytest
 import numpy as np
 from auth_mock import get_mock_gbdx_session
 from gbdxtools import Interface
@@ -34,12 +35,14 @@ class TestIndices(unittest.TestCase):
         cls._temp_path = tempfile.mkdtemp()
         print("Created: {}".format(cls._temp_path))
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_wv_image_ndvi.yaml', filter_headers=['authorization'])
     def test_ndvi_bands(self):
         _id = '103001006F31E000'
         img = self.gbdx.catalog_image(_id, bbox= [-95.527024269104, 29.200273324360754, -95.50655364990236, 29.2170547703652])
         self.assertEqual(img._ndvi_bands, [6, 4])
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_wv_image_ndvi.yaml', filter_headers=['authorization'])
     def test_ndwi_bands(self):
         _id = '103001006F31E000'
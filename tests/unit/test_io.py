@@ -0,0 +1,109 @@
+'''
+Unit tests for the geotiff chunk writer
+'''
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+import dask.array as da
+from dask.array import store
+
+from affine import Affine
+from shapely.geometry import box, mapping
+
+from gbdxtools.images.meta import GeoDaskImage
+from gbdxtools.rda.util import AffineTransform
+from gbdxtools.rda.io import rio_writer, _overview_factors, _decimate, _prepare, open_zarr, has_zarr
+
+
+class MockDataset(object):
+    def __init__(self, shape):
+        self.data = np.zeros(shape)
+        self.threads = set()
+
+    def write(self, chunk, window=None):
+        (ymin, ymax), (xmin, xmax) = window
+        self.threads.add(threading.current_thread().ident)
+        self.data[:, ymin:ymax, xmin:xmax] = chunk
+
+
+class FailingDataset(object):
+    def write(self, chunk, window=None):
+        raise IOError("disk full")
+
+
+class RioWriterTest(unittest.TestCase):
+
+    def test_single_writer_thread(self):
+        arr = da.random.random((3, 512, 512), chunks=(3, 64, 64))
+        dst = MockDataset(arr.shape)
+        writer = rio_writer(dst, queue_size=4, nchunks=64)
+        store(arr, writer, lock=False, compute=False).compute(scheduler='threads')
+        writer.close()
+        self.assertEqual(len(dst.threads), 1)
+        self.assertEqual(writer.written, 64)
+        self.assertEqual(writer.nbytes, arr.nbytes)
+        np.testing.assert_array_equal(dst.data, arr.compute())
+
+    def test_write_error_is_raised(self):
+        arr = da.ones((1, 256, 256), chunks=(1, 32, 32))
+        writer = rio_writer(FailingDataset(), queue_size=2)
+        store(arr, writer, lock=False, compute=False).compute(scheduler='threads')
+        with self.assertRaises(IOError):
+            writer.close()
+
+
+class OverviewTest(unittest.TestCase):
+
+    def test_prepare_rgb_stretch(self):
+        data = np.random.randint(1, 2000, (4, 64, 80)).astype(np.uint16)
+        gt = AffineTransform(Affine(0.5, 0, 100, 0, -0.5, 50), "EPSG:32616")
+        img = GeoDaskImage(da.from_array(data, chunks=(4, 32, 32)),
+                           __geo_interface__=mapping(box(100, 18, 140, 50)), __geo_transform__=gt)
+        arr, meta = _prepare(img, spec="rgb", bands=[2, 1, 0], stretch=[1, 99])
+        self.assertEqual((meta["count"], meta["dtype"]), (3, "uint8"))
+        np.testing.assert_array_equal(arr.compute(), img.stretched(bands=[2, 1, 0], stretch=[1, 99]).compute())
+
+    def test_overview_factors(self):
+        self.assertEqual(_overview_factors(1000, 1000, 256), [2, 4])
+        self.assertEqual(_overview_factors(4096, 1024, 256), [2, 4, 8, 16])
+        self.assertEqual(_overview_factors(200, 200, 256), [])
+
+    def test_decimate_average(self):
+        arr = da.from_array(np.arange(2 * 10 * 6, dtype=np.float32).reshape(2, 10, 6), chunks=(2, 4, 4))
+        out = _decimate(arr, (2, 4, 4))
+        self.assertEqual(out.shape, (2, 5, 3))
+        self.assertEqual(out.dtype, np.float32)
+        expected = arr.compute().reshape(2, 5, 2, 3, 2).mean(axis=(2, 4))
+        np.testing.assert_allclose(out.compute(), expected)
+
+    def test_decimate_nearest_odd_shape(self):
+        arr = da.ones((1, 11, 7), chunks=(1, 4, 4), dtype=np.uint16)
+        out = _decimate(arr, (1, 4, 4), resampling='nearest')
+        self.assertEqual(out.shape, (1, 5, 3))
+
+
+@unittest.skipUnless(has_zarr, "zarr is not installed")
+class ZarrTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_path)
+
+    def test_zarr_round_trip(self):
+        gt = AffineTransform(Affine(0.5, 0.0, -105.0, 0.0, -0.5, 40.0), proj="EPSG:4326")
+        darr = da.random.random((3, 600, 500), chunks=(3, 256, 256))
+        img = GeoDaskImage(darr, __geo_transform__=gt, __geo_interface__=mapping(box(-105.0, -260.0, 145.0, 40.0)))
+        img = img[:, 10:590, 20:480]
+        path = img.to_zarr(os.path.join(self._temp_path, "image.zarr"))
+        opened = open_zarr(path)
+        self.assertIsInstance(opened, GeoDaskImage)
+        self.assertEqual(opened.shape, img.shape)
+        self.assertEqual(tuple(opened.affine), tuple(img.affine))
+        self.assertEqual(opened.bounds, img.bounds)
+        np.testing.assert_array_equal(opened.read(), img.read())
@@ -56,3 +56,23 @@ class RdaInterfaceTest(unittest.TestCase):
         self.assertIn("nodes", g)
         self.assertEqual(len(g["nodes"]), 1)
         self.assertEqual(len(g["edges"]), 0)
+
+    def test_shared_ancestors_are_not_duplicated(self):
+        src = Op("Source")(catId="abc")
+        left = Op("BandSelect")(src, bandIndices=[0])
+        right = Op("BandSelect")(src, bandIndices=[1])
+        op = Op("BandMath")(left, right, expression="$0 - $1")
+        self.assertEqual(len(op._nodes), 4)
+        self.assertEqual(len(op._edges), 4)
+        self.assertEqual([n["operator"] for n in op._nodes], ["BandMath", "BandSelect", "Source", "BandSelect"])
+        self.assertEqual(len(set(n["id"] for n in op._nodes)), 4)
+
+    def test_deep_graph(self):
+        op = Op("Source")(catId="abc")
+        for i in range(100):
+            op = Op("Format")(op, dataType=str(i % 6))
+        g = op.graph(conn=None)
+        self.assertEqual(len(g["nodes"]), 101)
+        self.assertEqual(len(g["edges"]), 100)
+        self.assertEqual(g["nodes"][0]["id"], op._id)
+        self.assertTrue(all(not k.startswith("_") for n in g["nodes"] for k in n))
@@ -13,6 +13,10 @@ from os.path import join, isfile, dirname, realpath
 import tempfile
 import unittest
 import dask.array as da
+import numpy as np
+from mock import patch
+
+from gbdxtools.images.meta import DaskImage, GeoDaskImage
 
 def force(r1, r2):
     return True
@@ -48,6 +52,21 @@ class IpeImageTest(unittest.TestCase):
         assert img.shape == (8, 566, 685)
         assert img.proj == 'EPSG:32612'
 
+    @my_vcr.use_cassette('tests/unit/cassettes/test_landsat_image.yaml', filter_headers=['authorization'])
+    def test_landsat_image_read_target_shape(self):
+        _id = 'LC80370302014268LGN00'
+        img = self.gbdx.landsat_image(_id, bbox=[-109.84, 43.19, -109.59, 43.34])
+        read = []
+        def fake_read(arr, bands=None, **kwargs):
+            read.append(arr)
+            return np.zeros(arr.shape, dtype=arr.dtype)
+        # landsat images have no gsd option, they are decimated locally
+        with patch.object(DaskImage, "read", autospec=True, side_effect=fake_read):
+            arr = img.read(target_shape=(100, 100), dtype="float32", quiet=False)
+        assert arr.shape == (8, 114, 137)
+        assert arr.dtype == np.float32
+        assert type(read[0]) is GeoDaskImage
+
     @my_vcr.use_cassette('tests/unit/cassettes/test_landsat_image_pansharp.yaml', filter_headers=['authorization'])
     def test_landsat_image_pansharpen(self):
         _id = 'LC80370302014268LGN00'
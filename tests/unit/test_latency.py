@@ -0,0 +1,29 @@
+'''
+Unit tests for the image construction latency recorder
+'''
+import unittest
+
+from gbdxtools.rda.latency import Latency
+
+
+class LatencyTest(unittest.TestCase):
+
+    def test_measure(self):
+        latency = Latency()
+        for _ in range(3):
+            with latency.measure("register"):
+                pass
+        latency.record("metadata", 0.5)
+        latency.record("metadata", 1.5)
+        report = latency.report()
+        self.assertEqual(report["register"]["count"], 3)
+        self.assertEqual(report["metadata"], {"count": 2, "mean": 1.0, "max": 1.5})
+
+    def test_measure_records_failures(self):
+        latency = Latency()
+        with self.assertRaises(ValueError):
+            with latency.measure("catalog_query"):
+                raise ValueError()
+        self.assertEqual(latency.report()["catalog_query"]["count"], 1)
+        latency.reset()
+        self.assertEqual(latency.report(), {})
@@ -9,6 +9,9 @@ from auth_mock import gbdx
 import vcr
 import tempfile
 import unittest
+import pytest
+import os
+import numpy as np
 
 # How to use the mock_gbdx_session and vcr to create unit tests:
 # 1. Add a new test that is dependent upon actually hitting GBDX APIs.
@@ -35,6 +38,7 @@ class MetaImageTest(unittest.TestCase):
         cls._temp_path = tempfile.mkdtemp()
         print("Created: {}".format(cls._temp_path))
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_meta_pxbounds_overlap.yaml', filter_headers=['authorization'])
     def test_image_pxbounds_overlapping(self):
         wv2 = CatalogImage('1030010076B8F500')
@@ -49,6 +53,7 @@ class MetaImageTest(unittest.TestCase):
         self.assertEquals(xmax, xsize/2)
         self.assertEquals(ymax, ysize)
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_meta_pxbounds_disjoint.yaml', filter_headers=['authorization'])
     def test_image_pxbounds_disjoint(self):
         wv2 = CatalogImage('1030010076B8F500')
@@ -58,6 +63,7 @@ class MetaImageTest(unittest.TestCase):
             clipped = wv2.pxbounds(clip)
 
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_meta_window_at.yaml', filter_headers=['authorization'])
     def test_image_window_at(self):
         wv2 = CatalogImage('1030010076B8F500')
@@ -72,6 +78,7 @@ class MetaImageTest(unittest.TestCase):
         # of where it should be
         self.assertTrue(c1.distance(c2) < wv2.metadata['georef']['scaleX'])
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_meta_window_cover.yaml', filter_headers=['authorization'])
     def test_image_window_cover(self):
         """ Window cover should padd the image by 25 pixels and return 9 windows """
@@ -80,6 +87,7 @@ class MetaImageTest(unittest.TestCase):
         coverage = [dsk for dsk in aoi.window_cover((100,100), pad=True)]
         self.assertEquals(len(coverage), 9)
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_meta_window_cover_false.yaml', filter_headers=['authorization'])
     def test_image_window_cover_false(self):
         """ Window cover should not padd the image and return only tiles of 100, 100 (9 windows) """
@@ -89,3 +97,201 @@ class MetaImageTest(unittest.TestCase):
         self.assertEquals(len(coverage), 9)
 
     
+
+
+class DaskImageReadTest(unittest.TestCase):
+
+    def setUp(self):
+        from gbdxtools.images.meta import DaskImage
+        import dask.array as da
+        self.data = np.random.random((4, 300, 200)).astype(np.float32)
+        self.img = DaskImage(da.from_array(self.data, chunks=(4, 64, 64)))
+
+    def test_read_into_out(self):
+        out = np.zeros(self.img.shape, dtype=self.img.dtype)
+        result = self.img.read(out=out)
+        self.assertIs(result, out)
+        np.testing.assert_array_equal(out, self.data)
+
+    def test_read_out_shape_mismatch(self):
+        with self.assertRaises(ValueError):
+            self.img.read(out=np.zeros((4, 10, 10)))
+
+    def test_read_to_memmap(self):
+        path = os.path.join(tempfile.mkdtemp(), 'image.dat')
+        mm = self.img.read_to_memmap(path, bands=[2, 0])
+        self.assertIsInstance(mm, np.memmap)
+        self.assertEqual(mm.shape, (2, 300, 200))
+        np.testing.assert_array_equal(mm, self.data[[2, 0], ...])
+        reopened = np.memmap(path, dtype=np.float32, mode='r', shape=(2, 300, 200))
+        np.testing.assert_array_equal(reopened, self.data[[2, 0], ...])
+
+
+class BandMathTest(unittest.TestCase):
+
+    def setUp(self):
+        from gbdxtools.images.meta import GeoDaskImage
+        from gbdxtools.rda.util import AffineTransform
+        from shapely.geometry import box, mapping
+        from affine import Affine
+        import dask.array as da
+        self.data = (np.random.random((8, 100, 120)) * 1000).astype(np.uint16)
+        gt = AffineTransform(Affine(0.5, 0, 100, 0, -0.5, 50), "EPSG:32616")
+        self.img = GeoDaskImage(da.from_array(self.data, chunks=(8, 64, 64)),
+                                __geo_interface__=mapping(box(100, 0, 160, 50)),
+                                __geo_transform__=gt)
+
+    def test_bandmath_reads_used_bands(self):
+        res = self.img.bandmath(["($6 - $4) / ($6 + $4)", "$1 * 2"])
+        self.assertEqual(res.shape, (2, 100, 120))
+        self.assertEqual(res.dtype, np.float32)
+        nir, red = self.data[6].astype(np.float32), self.data[4].astype(np.float32)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            expected = (nir - red) / (nir + red)
+        np.testing.assert_allclose(res[0].compute(), expected, rtol=1e-6)
+        np.testing.assert_allclose(res[1].compute(), self.data[1] * 2.0)
+
+    def test_bandmath_named_bands(self):
+        res = self.img.bandmath("nir - red", bands={"nir": 6, "red": 4}, dtype="float16")
+        self.assertEqual(res.dtype, np.float16)
+        np.testing.assert_array_equal(res.compute()[0],
+                                      (self.data[6].astype(np.float32) - self.data[4]).astype(np.float16))
+
+    def test_bandmath_integer_dtype(self):
+        with self.assertRaises(ValueError):
+            self.img.bandmath("$0", dtype="uint8")
+
+
+class ResolutionTest(unittest.TestCase):
+
+    def setUp(self):
+        from gbdxtools.images.meta import GeoDaskImage
+        from gbdxtools.rda.util import AffineTransform
+        from shapely.geometry import box, mapping
+        from affine import Affine
+        import dask.array as da
+        self.data = np.random.random((4, 1000, 800)).astype(np.float32)
+        gt = AffineTransform(Affine(0.5, 0, 100, 0, -0.5, 500), "EPSG:32616")
+        self.img = GeoDaskImage(da.from_array(self.data, chunks=(4, 256, 256)),
+                                __geo_interface__=mapping(box(100, 0, 500, 500)),
+                                __geo_transform__=gt)
+
+    def test_target_shape(self):
+        coarse = self.img.at_resolution(target_shape=(240, 190))
+        self.assertEqual(coarse.shape, (4, 250, 200))
+        self.assertEqual(coarse.affine.a, 2.0)
+        self.assertEqual(coarse.affine.e, -2.0)
+        self.assertEqual((coarse.affine.c, coarse.affine.f), (100, 500))
+        np.testing.assert_array_equal(self.img.read(target_shape=(240, 190)), self.data[:, ::4, ::4])
+
+    def test_gsd(self):
+        coarse = self.img.at_resolution(gsd=1.0)
+        self.assertEqual(coarse.shape, (4, 500, 400))
+        np.testing.assert_array_equal(self.img.read(bands=[1], gsd=1.0), self.data[[1], ::2, ::2])
+
+    def test_no_reduction(self):
+        self.assertIs(self.img.at_resolution(target_shape=(1000, 1000)), self.img)
+        self.assertIs(self.img.at_resolution(gsd=0.25), self.img)
+        self.assertIs(self.img.at_resolution(), self.img)
+
+
+class PredictTest(unittest.TestCase):
+
+    def geo_image(self, data):
+        from gbdxtools.images.meta import GeoDaskImage
+        from gbdxtools.rda.util import AffineTransform
+        from shapely.geometry import box, mapping
+        from affine import Affine
+        import dask.array as da
+        gt = AffineTransform(Affine(0.5, 0, 100, 0, -0.5, 500), "EPSG:32616")
+        return GeoDaskImage(da.from_array(data, chunks=(data.shape[0], 100, 100)),
+                            __geo_interface__=mapping(box(100, 500 - data.shape[1] / 2.0,
+                                                          100 + data.shape[2] / 2.0, 500)),
+                            __geo_transform__=gt)
+
+    def test_predict_blends_windows(self):
+        data = np.random.random((3, 300, 260)).astype(np.float32)
+        img = self.geo_image(data)
+        batches = []
+
+        def model(batch):
+            batches.append(batch.shape)
+            return batch.mean(axis=1, keepdims=True) * 2
+
+        pred = img.predict(model, window=(64, 64), overlap=16, batch_size=4)
+        self.assertEqual(pred.shape, (1, 300, 260))
+        self.assertEqual(pred.affine, img.affine)
+        self.assertEqual(pred.chunks[1:], ((100, 100, 100), (100, 160)))
+        np.testing.assert_allclose(pred.compute()[0], data.mean(axis=0) * 2, rtol=1e-5)
+        self.assertTrue(all(shape[0] <= 4 and shape[1:] == (3, 64, 64) for shape in batches))
+
+    def test_predict_small_image(self):
+        data = np.random.random((2, 50, 40)).astype(np.float32)
+        pred = self.geo_image(data).predict(lambda batch: batch[:, ::-1] + 1, window=(64, 64),
+                                            overlap=8, bands_out=2, dtype="float64")
+        self.assertEqual(pred.dtype, np.float64)
+        np.testing.assert_allclose(pred.compute(), data[::-1] + 1, rtol=1e-5)
+
+    def test_predict_invalid_overlap(self):
+        img = self.geo_image(np.zeros((1, 100, 100), dtype=np.float32))
+        with self.assertRaises(ValueError):
+            img.predict(lambda batch: batch, window=(32, 32), overlap=32)
+
+
+class PolygonizeTest(unittest.TestCase):
+
+    def setUp(self):
+        from gbdxtools.images.meta import GeoDaskImage
+        from gbdxtools.rda.util import AffineTransform
+        from shapely.geometry import box, mapping
+        from affine import Affine
+        import dask.array as da
+        self.data = np.zeros((2, 120, 100), dtype=np.uint8)
+        self.data[0, 10:90, 20:70] = 1    # spans several chunks
+        self.data[0, 40:50, 40:50] = 3    # a hole in the region of 1s
+        self.data[0, 100:110, 5:15] = 2
+        self.data[0, 100:110, 20:25] = 2
+        gt = AffineTransform(Affine(2.0, 0, 1000, 0, -2.0, 500), "EPSG:32616")
+        self.img = GeoDaskImage(da.from_array(self.data, chunks=(2, 32, 32)),
+                                __geo_interface__=mapping(box(1000, 260, 1200, 500)),
+                                __geo_transform__=gt)
+
+    def test_polygonize(self):
+        from shapely.geometry import shape
+        features = list(self.img.polygonize(max_workers=2))
+        by_value = {}
+        for f in features:
+            by_value.setdefault(f["properties"]["value"], []).append(shape(f["geometry"]))
+        self.assertEqual(sorted(by_value), [1, 2, 3])
+        self.assertEqual(len(by_value[1]), 1)
+        self.assertEqual(len(by_value[2]), 2)
+        self.assertEqual(len(by_value[1][0].interiors), 1)
+        for value, polygons in by_value.items():
+            self.assertEqual(sum(p.area for p in polygons), (self.data[0] == value).sum() * 4.0)
+        self.assertEqual(by_value[1][0].bounds, (1040.0, 320.0, 1140.0, 480.0))
+
+    def test_polygonize_values(self):
+        features = list(self.img.polygonize(values=[2], simplify=1.0))
+        self.assertEqual(len(features), 2)
+        self.assertTrue(all(f["properties"]["value"] == 2 for f in features))
+
+    def test_seam_stitcher(self):
+        from shapely.geometry import box
+        from gbdxtools.images.util.polygonize import SeamStitcher
+        stitcher = SeamStitcher([0, 10, 20], [0, 10, 20])
+        # held until the chunk across the seam is done
+        self.assertEqual(stitcher.add((0, 0), {1: [box(5, 2, 10, 4)]}), [])
+        final = stitcher.add((0, 1), {1: [box(10, 2, 15, 4)], 2: [box(12, 8, 14, 10)]})
+        self.assertEqual([(p.bounds, value) for p, value in final], [((5, 2, 15, 4), 1)])
+        self.assertEqual(stitcher.add((1, 0), {}), [])
+        final = stitcher.add((1, 1), {})
+        self.assertEqual([(p.bounds, value) for p, value in final], [((12, 8, 14, 10), 2)])
+        self.assertEqual(stitcher.flush(), [])
+
+    def test_polygonize_block(self):
+        from gbdxtools.images.util.polygonize import polygonize_block
+        block = np.array([[1, 1, 0],
+                          [1, 1, 0],
+                          [0, 0, 1]])
+        shapes = polygonize_block(block, row0=10, col0=20)
+        self.assertEqual(sorted(p.bounds for p in shapes[1]), [(20, 10, 22, 12), (22, 12, 23, 13)])
@@ -0,0 +1,91 @@
+'''
+Unit tests for mosaics of several images
+'''
+import unittest
+
+import numpy as np
+import dask.array as da
+from affine import Affine
+from shapely.geometry import box, mapping
+from shapely.strtree import STRtree
+
+from gbdxtools.images.meta import GeoDaskImage
+from gbdxtools.images.mosaic import mosaic, _tree_query
+from gbdxtools.rda.util import AffineTransform
+
+
+def geo_image(data, x, y):
+    gt = AffineTransform(Affine(1.0, 0.0, x, 0.0, -1.0, y), "EPSG:32616")
+    bounds = (x, y - data.shape[1], x + data.shape[2], y)
+    return GeoDaskImage(da.from_array(data, chunks=(data.shape[0], 32, 32)),
+                        __geo_interface__=mapping(box(*bounds)), __geo_transform__=gt)
+
+
+class MosaicTest(unittest.TestCase):
+
+    def setUp(self):
+        self.a = np.random.randint(1, 100, (2, 100, 100)).astype(np.uint16)
+        self.a[:, :20, :20] = 0
+        self.b = np.random.randint(100, 200, (2, 100, 100)).astype(np.uint16)
+        self.images = [geo_image(self.a, 0.0, 100.0), geo_image(self.b, 50.0, 120.0)]
+
+    def expected(self, a_first=True, fill_gaps=True):
+        out = np.zeros((2, 120, 150), dtype=np.uint16)
+        if a_first:
+            out[:, 0:100, 50:150] = self.b
+            window = out[:, 20:120, 0:100]
+            valid = np.any(self.a != 0, axis=0) if fill_gaps else np.ones((100, 100), dtype=bool)
+            window[:, valid] = self.a[:, valid]
+        else:
+            out[:, 20:120, 0:100] = self.a
+            out[:, 0:100, 50:150] = self.b
+        return out
+
+    def test_first_valid(self):
+        img = mosaic(self.images, chunk_size=32)
+        self.assertEqual(img.shape, (2, 120, 150))
+        self.assertEqual(img.affine, Affine(1.0, 0.0, 0.0, 0.0, -1.0, 120.0))
+        self.assertEqual(img.bounds, (0.0, 0.0, 150.0, 120.0))
+        np.testing.assert_array_equal(img.compute(), self.expected())
+
+    def test_priority_method(self):
+        img = mosaic(self.images, method="priority", chunk_size=32)
+        np.testing.assert_array_equal(img.compute(), self.expected(fill_gaps=False))
+
+    def test_priority_order(self):
+        img = mosaic(self.images, priority=[1, 2], chunk_size=64)
+        np.testing.assert_array_equal(img.compute(), self.expected(a_first=False))
+
+    def test_tiles_fetched_once(self):
+        fetched = []
+        def fetch(block):
+            if block.size:
+                fetched.append(block.shape)
+            return block
+        images = []
+        for img, data in zip(self.images, (self.a, self.b)):
+            darr = da.from_array(data, chunks=(2, 32, 32)).map_blocks(fetch, dtype=data.dtype)
+            images.append(GeoDaskImage(darr, __geo_interface__=img.__geo_interface__,
+                                       __geo_transform__=img.__geo_transform__))
+        img = mosaic(images, chunk_size=32)
+        np.testing.assert_array_equal(img.compute(), self.expected())
+        # the chunks of the mosaic straddle the image tiles, each tile is still fetched once
+        self.assertEqual(len(fetched), 2 * 16)
+
+    def test_bounds(self):
+        img = mosaic(self.images, bounds=[40.5, 30, 60, 50])
+        self.assertEqual(img.shape, (2, 20, 20))
+        np.testing.assert_array_equal(img.compute(), self.expected()[:, 70:90, 40:60])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            mosaic(self.images, method="mean")
+        with self.assertRaises(ValueError):
+            mosaic([self.images[0], self.images[1][:1, :, :]])
+
+    def test_tree_query(self):
+        footprints = [box(0, 0, 100, 100), box(50, 20, 150, 120)]
+        tree = STRtree(footprints)
+        self.assertEqual(_tree_query(tree, footprints, box(120, 0, 140, 10)), [])
+        self.assertEqual(_tree_query(tree, footprints, box(120, 30, 140, 40)), [1])
+        self.assertEqual(_tree_query(tree, footprints, box(60, 30, 70, 40)), [0, 1])
@@ -0,0 +1,61 @@
+'''
+Unit tests for the overview pyramid of fetched tiles
+'''
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from gbdxtools.rda.overviews import OverviewPyramid, decimate, overviews
+
+
+class OverviewPyramidTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.pyramid = OverviewPyramid(path=self.path, levels=4, enabled=True)
+        self.tile = np.arange(2 * 8 * 8, dtype=np.uint16).reshape(2, 8, 8)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_decimate(self):
+        out = decimate(self.tile, 2)
+        self.assertEqual(out.shape, (2, 4, 4))
+        self.assertEqual(out.dtype, np.uint16)
+        self.assertEqual(out[0, 0, 0], int(np.mean(self.tile[0, :2, :2])))
+
+    def test_record_builds_levels(self):
+        self.assertIs(self.pyramid.record("tile/{x}/{y}", 3, 5, self.tile), self.tile)
+        level1 = self.pyramid.load("tile/{x}/{y}", 1, 3, 5)
+        np.testing.assert_array_equal(level1, decimate(self.tile, 2))
+        np.testing.assert_array_equal(self.pyramid.load("tile/{x}/{y}", 2, 3, 5), decimate(level1, 2))
+        self.assertEqual(self.pyramid.load("tile/{x}/{y}", 3, 3, 5).shape, (2, 1, 1))
+        self.assertFalse(self.pyramid.covers("tile/{x}/{y}", 4, [(3, 5)]))
+
+    def test_covers_counts_hits(self):
+        self.pyramid.record("tile/{x}/{y}", 0, 0, self.tile)
+        self.assertTrue(self.pyramid.covers("tile/{x}/{y}", 1, [(0, 0)]))
+        self.assertFalse(self.pyramid.covers("tile/{x}/{y}", 1, [(0, 0), (1, 0)]))
+        self.assertFalse(self.pyramid.covers("other/{x}/{y}", 1, [(0, 0)]))
+        self.assertEqual(self.pyramid.report()[1], {"hits": 2, "misses": 2, "ratio": 0.5})
+
+    def test_level_selection(self):
+        self.assertEqual([self.pyramid.level(f) for f in (1, 2, 3, 4, 6, 7, 8, 12, 64)], [0, 1, 0, 2, 1, 0, 3, 2, 4])
+
+    def test_disabled(self):
+        pyramid = OverviewPyramid(path=self.path, enabled=False)
+        pyramid.record("tile/{x}/{y}", 0, 0, self.tile)
+        self.assertFalse(pyramid.covers("tile/{x}/{y}", 1, [(0, 0)]))
+
+    def test_tile_fetcher_records_overviews(self):
+        from gbdxtools.rda.fetch import TileFetcher
+        enabled, path = overviews.enabled, overviews.path
+        overviews.enabled, overviews.path = True, self.path
+        try:
+            fetcher = TileFetcher("tile/{x}/{y}", "token", (2, 8, 8), fetch=lambda url, token, chunks: self.tile)
+            self.assertIs(fetcher(1, 2), self.tile)
+            self.assertTrue(overviews.covers("tile/{x}/{y}", 2, [(1, 2)]))
+        finally:
+            overviews.enabled, overviews.path = enabled, path
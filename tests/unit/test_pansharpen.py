@@ -0,0 +1,95 @@
+'''
+Unit tests for local pansharpening
+'''
+import unittest
+
+import numpy as np
+import dask.array as da
+from mock import patch
+from shapely.geometry import box
+
+from auth_mock import gbdx
+from gbdxtools import LandsatImage, IkonosImage
+from gbdxtools.images.worldview import WorldViewImage
+from gbdxtools.rda.interface import Op
+from gbdxtools.images.util.pansharpen import brovey, pansharpen, upsample, transfer_savings
+
+MS_GSD, PAN_GSD = 0.002, 0.0005
+
+def fake_metadata(nbands):
+    """ Op metadata of a 0.064 degree square image, pan at a quarter of the MS GSD """
+    def metadata(op):
+        values = [v for node in op._nodes for v in [node["operator"]] + list(node["parameters"].values())]
+        sharp = any(v in ("LocallyProjectivePanSharpen", "PANSHARP") for v in values)
+        pan = not sharp and any("panchromatic" in v or v == "PAN" for v in values)
+        gsd = PAN_GSD if pan or sharp else MS_GSD
+        size = int(round(0.064 / gsd))
+        return {"image": {"numBands": 1 if pan else nbands, "dataType": "UNSIGNED_SHORT",
+                          "tileXSize": size // 2, "tileYSize": size // 2,
+                          "minTileX": 0, "minTileY": 0, "maxTileX": 1, "maxTileY": 1,
+                          "minX": 0, "minY": 0, "maxX": size, "maxY": size,
+                          "imageBoundsWGS84": box(10, 20, 10.064, 20.064).wkt},
+                "georef": {"spatialReferenceSystemCode": "EPSG:4326", "translateX": 10, "scaleX": gsd,
+                           "shearX": 0, "translateY": 20.064, "shearY": 0, "scaleY": -gsd}}
+    return property(metadata)
+
+
+class PansharpenTest(unittest.TestCase):
+
+    def test_brovey_preserves_band_ratios(self):
+        ms = np.random.randint(1, 100, (4, 8, 8)).astype(np.uint16)
+        pan = np.random.randint(1, 100, (1, 8, 8)).astype(np.uint16)
+        out = brovey(ms, pan)
+        self.assertEqual(out.dtype, np.float32)
+        np.testing.assert_allclose(out.mean(axis=0), pan[0], rtol=1e-5)
+        np.testing.assert_allclose(out[0] / out[1], ms[0] / ms[1].astype(np.float32), rtol=1e-5)
+
+    def test_upsample(self):
+        ms = da.from_array(np.arange(2 * 3 * 5).reshape(2, 3, 5), chunks=(2, 2, 2))
+        up = upsample(ms, (12, 20), ((8, 4), (16, 4)))
+        self.assertEqual(up.shape, (2, 12, 20))
+        self.assertEqual(up.chunks[1:], ((8, 4), (16, 4)))
+        np.testing.assert_array_equal(up.compute(), ms.compute().repeat(4, axis=1).repeat(4, axis=2))
+
+    def test_pansharpen_graph(self):
+        ms = da.ones((8, 64, 64), chunks=(8, 32, 32), dtype=np.float32)
+        pan = da.ones((1, 256, 256), chunks=(1, 128, 128), dtype=np.float32) * 2
+        out = pansharpen(ms, pan, weights=[0, 1, 1, 1, 1, 1, 1, 0])
+        self.assertEqual(out.shape, (8, 256, 256))
+        self.assertEqual(out.chunks[1:], pan.chunks[1:])
+        np.testing.assert_allclose(out.compute(), 2)
+        savings = transfer_savings(ms, pan)
+        self.assertEqual(savings["server_bytes"], 8 * 256 * 256 * 4)
+        self.assertAlmostEqual(savings["ratio"], 8 * 256 * 256 / float(8 * 64 * 64 + 256 * 256))
+
+
+class LocalPansharpenImageTest(unittest.TestCase):
+    """ pansharpen="local" on the image classes, with the RDA metadata of every graph mocked """
+
+    def check(self, img, cls, nbands):
+        self.assertIsInstance(img, cls)
+        self.assertEqual(img.shape, (nbands, 128, 128))
+        self.assertAlmostEqual(img.affine.a, PAN_GSD)
+        np.testing.assert_allclose(img.bounds, (10, 20, 10.064, 20.064))
+        self.assertGreater(img.pansharpen_savings["ratio"], 1)
+        return img.rda
+
+    def test_worldview(self):
+        with patch.object(Op, "metadata", fake_metadata(8)):
+            img = WorldViewImage("1030010045539700", pansharpen="local")
+            graph = self.check(img, WorldViewImage, 8)
+        self.assertEqual(graph._operator, "Format")
+        self.assertEqual(graph._args[0]._node["parameters"]["bands"], "PANSHARP")
+
+    def test_landsat(self):
+        with patch.object(Op, "metadata", fake_metadata(8)):
+            img = gbdx.landsat_image("LC80370302014268LGN00", pansharpen="local")
+            graph = self.check(img, LandsatImage, 8)
+        self.assertEqual(graph._operator, "LocallyProjectivePanSharpen")
+
+    def test_ikonos(self):
+        record = {"properties": {"attributes": {"bucketPrefix": "po_123", "bucketName": "ikonos-product"}}}
+        with patch.object(Op, "metadata", fake_metadata(4)):
+            img = IkonosImage(record, pansharpen="local", bbox=[10, 20, 10.064, 20.064])
+            graph = self.check(img, IkonosImage, 4)
+        self.assertEqual(graph._operator, "LocallyProjectivePanSharpen")
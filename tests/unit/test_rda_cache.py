@@ -0,0 +1,65 @@
+'''
+Unit tests for the RDA graph registration and metadata cache
+'''
+import shutil
+import tempfile
+import unittest
+
+from gbdxtools.rda import graph
+from gbdxtools.rda.cache import RDACache
+
+
+class MockResponse(object):
+    status_code = 200
+    text = "graph-id-1234"
+
+
+class MockConn(object):
+    def __init__(self):
+        self.posts = 0
+
+    def post(self, url, data, headers=None):
+        self.posts += 1
+        return MockResponse()
+
+
+class RDACacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_path)
+
+    def test_get_set_across_instances(self):
+        c1 = RDACache(path=self._temp_path)
+        self.assertIsNone(c1.get("metadata", "graph", "node"))
+        c1.set("metadata", {"image": {"numBands": 8}}, "graph", "node")
+        # a new cache instance, as in a restarted process, reads the entry from disk
+        c2 = RDACache(path=self._temp_path)
+        self.assertEqual(c2.get("metadata", "graph", "node"), {"image": {"numBands": 8}})
+        self.assertEqual(c2.report(), {"metadata": {"avoided": 1, "requested": 0}})
+        self.assertEqual(c1.report(), {"metadata": {"avoided": 0, "requested": 1}})
+
+    def test_ttl(self):
+        c = RDACache(path=None, ttl=-1)
+        c.set("graph", "abc", "payload")
+        self.assertIsNone(c.get("graph", "payload"))
+
+    def test_disabled(self):
+        c = RDACache(path=self._temp_path, enabled=False)
+        c.set("graph", "abc", "payload")
+        self.assertIsNone(c.get("graph", "payload"))
+
+    def test_register_graph_once(self):
+        _cache = graph.rda_cache
+        graph.rda_cache = RDACache(path=self._temp_path)
+        try:
+            conn = MockConn()
+            g = {"nodes": [{"id": "a", "operator": "Format"}], "edges": []}
+            self.assertEqual(graph.register_rda_graph(conn, g), "graph-id-1234")
+            self.assertEqual(graph.register_rda_graph(conn, dict(g)), "graph-id-1234")
+            self.assertEqual(conn.posts, 1)
+            self.assertEqual(graph.rda_cache.report()["graph"], {"avoided": 1, "requested": 1})
+        finally:
+            graph.rda_cache = _cache
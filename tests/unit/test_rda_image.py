@@ -5,16 +5,19 @@ Contact: dmarino@digitalglobe.com
 Unit tests for the gbdxtools.Idaho class
 """
 import os
+import json
 from gbdxtools import Interface
 from gbdxtools import IdahoImage, CatalogImage
 from gbdxtools.rda.graph import get_rda_graph
 from gbdxtools.images.meta import DaskImage
+from gbdxtools.images import rda_image
 from auth_mock import get_mock_gbdx_session
 import vcr
 import tempfile
 import unittest
 import dask.array as da
 import numpy as np
+from mock import patch
 
 def force(r1, r2):
     return True
@@ -169,3 +172,124 @@ class RdaImageTest(unittest.TestCase):
         
 
 
+
+
+class PushdownPlanTest(unittest.TestCase):
+
+    def test_window_offset_affine(self):
+        from affine import Affine
+        from gbdxtools.rda.util import AffineTransform
+        from gbdxtools.images.rda_image import _window_offset
+        base = AffineTransform(Affine(0.5, 0.0, -105.0, 0.0, -0.5, 40.0), proj="EPSG:4326")
+        self.assertEqual(_window_offset(base + (120, 37), base), (120, 37))
+        self.assertEqual(_window_offset(base + (256, 512) + (3, 4), base + (256, 0)), (3, 516))
+
+    @classmethod
+    def setUpClass(cls):
+        mock_gbdx_session = get_mock_gbdx_session(token='dummytoken')
+        cls.gbdx = Interface(gbdx_connection=mock_gbdx_session)
+
+    def _image(self):
+        return self.gbdx.idaho_image('09d5acaf-12d4-4c67-adbb-cda26cbd2187', bucket='idaho-images',
+                                     bbox=[-85.79713384556237, 10.859474119490333, -85.79366000529654, 10.86341028280643])
+
+    @my_vcr.use_cassette('tests/unit/cassettes/test_ipe_image_init_with_aoi2.yaml', filter_headers=['authorization'])
+    def test_pushdown_bands(self):
+        img = self._image()
+        rebuilt = []
+        def rebuild(op):
+            # stands in for registering the rewritten graph, the window is the same
+            rebuilt.append(op)
+            return img
+        with patch.object(rda_image, "PUSHDOWN", True), patch.object(rda_image, "RDAImage", side_effect=rebuild):
+            rgb = img[[4, 2, 1], ...]
+            # indexing stays local
+            self.assertEqual(rebuilt, [])
+            self.assertEqual(rgb.shape, (3, 292, 258))
+            pushed = img._select_bands([4, 2, 1])
+        self.assertEqual(len(rebuilt), 1)
+        op = rebuilt[0]
+        self.assertEqual(op._operator, "BandSelect")
+        self.assertIs(op._args[0], img.rda)
+        self.assertEqual(json.loads(op._node["parameters"]["bandIndices"]), [4, 2, 1])
+        self.assertEqual(pushed.shape, img.shape)
+
+    @my_vcr.use_cassette('tests/unit/cassettes/test_pushdown_read.yaml', filter_headers=['authorization'])
+    def test_pushdown_read(self):
+        img = self._image()
+        read = []
+        def fake_read(arr, bands=None, **kwargs):
+            read.append((arr, bands))
+            return np.zeros(arr.shape, dtype=arr.dtype)
+        # the rewritten graph is registered and described by the last two responses of the cassette
+        with patch.object(DaskImage, "read", autospec=True, side_effect=fake_read):
+            arr = img.read(bands=[4, 2, 1], dtype="uint16")
+        self.assertEqual(arr.shape, (3, 292, 258))
+        self.assertEqual(arr.dtype, np.uint16)
+        pushed, bands = read[0]
+        # nothing is left to select or convert locally
+        self.assertIsNone(bands)
+        self.assertEqual(pushed.dtype, np.uint16)
+        op = pushed.rda
+        self.assertEqual(op._operator, "Format")
+        self.assertEqual(json.loads(op._node["parameters"]["dataType"]), 1)
+        self.assertEqual(op._args[0]._operator, "BandSelect")
+        self.assertEqual(json.loads(op._args[0]._node["parameters"]["bandIndices"]), [4, 2, 1])
+        self.assertIs(op._args[0]._args[0], img.rda)
+        # the same window of the rewritten image
+        self.assertEqual(pushed.affine, img.affine)
+        self.assertEqual(pushed.bounds, img.bounds)
+
+    @my_vcr.use_cassette('tests/unit/cassettes/test_ipe_image_init_with_aoi2.yaml', filter_headers=['authorization'])
+    def test_pushdown_fallback(self):
+        # the bands of the image no longer match its graph
+        img = self._image()[:4, ...]
+        with patch.object(rda_image, "PUSHDOWN", True), self.assertLogs('gbdxtools', level='INFO') as logs:
+            rgb = img._select_bands([2, 1, 0])
+        self.assertIn("Reading locally", logs.output[0])
+        self.assertEqual(rgb.shape, (3, 292, 258))
+
+
+class OverviewReadTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        mock_gbdx_session = get_mock_gbdx_session(token='dummytoken')
+        cls.gbdx = Interface(gbdx_connection=mock_gbdx_session)
+
+    def setUp(self):
+        from gbdxtools.rda.overviews import overviews
+        self.overviews = overviews
+        self.saved = overviews.enabled, overviews.path
+        overviews.enabled, overviews.path = True, tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.overviews.clear()
+        self.overviews.enabled, self.overviews.path = self.saved
+
+    @my_vcr.use_cassette('tests/unit/cassettes/test_ipe_image_init_with_aoi2.yaml', filter_headers=['authorization'])
+    def test_read_from_overviews(self):
+        img = self.gbdx.idaho_image('09d5acaf-12d4-4c67-adbb-cda26cbd2187', bucket='idaho-images',
+                                    bbox=[-85.79713384556237, 10.859474119490333, -85.79366000529654, 10.86341028280643])
+        img_md = img.rda.metadata["image"]
+        tx_size, ty_size = img_md["tileXSize"], img_md["tileYSize"]
+        xmin, ymin = rda_image._window_offset(img.__geo_transform__, img.__geo__.geo_transform)
+        source = img.rda._tile_url_template()
+        # every tile under the window was fetched before
+        for x in range(xmin // tx_size, (xmin + img.shape[2] - 1) // tx_size + 1):
+            for y in range(ymin // ty_size, (ymin + img.shape[1] - 1) // ty_size + 1):
+                tile = np.full((img.shape[0], ty_size, tx_size), 7, dtype=img.dtype)
+                self.overviews.record(source, x + img_md["minTileX"], y + img_md["minTileY"], tile)
+        coarse = img.at_resolution(target_shape=(73, 64))
+        self.assertEqual(coarse.shape, (8, 73, 64))
+        self.assertAlmostEqual(coarse.affine.a, 4 * img.affine.a)
+        # the overview pixel holding the first pixel of the window
+        self.assertLess(abs(coarse.affine.c - img.affine.c), abs(coarse.affine.a))
+        self.assertLess(abs(coarse.affine.f - img.affine.f), abs(coarse.affine.e))
+        arr = img.read(target_shape=(73, 64))
+        self.assertEqual(arr.shape, (8, 73, 64))
+        self.assertTrue((arr == 7).all())
+        # a factor of 6 is read from level 1 and decimated by 3
+        arr = img.read(target_shape=(48, 43))
+        self.assertEqual(arr.shape, (8, 49, 43))
+        self.assertTrue((arr == 7).all())
@@ -0,0 +1,105 @@
+'''
+Unit tests for the local evaluation of RDA operators
+'''
+import unittest
+
+import numpy as np
+from mock import patch
+from shapely.geometry import box
+
+from gbdxtools.rda.interface import Op
+from gbdxtools.rda.fetch import TileFetcher
+from gbdxtools.rda.local import split_graph, apply_local, local_image
+from gbdxtools.images.rda_image import RDAImage
+
+
+class LocalOperatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.arr = np.arange(4 * 2 * 3, dtype=np.float32).reshape(4, 2, 3)
+
+    def test_split_graph(self):
+        base = Op("DigitalGlobeStrip")(catId="1030010045539700")
+        op = Op("BandSelect")(base, bandIndices=[2, 1])
+        op = Op("Format")(op, dataType="1")
+        root, steps = split_graph(op)
+        self.assertIs(root, base)
+        self.assertEqual([name for name, params in steps], ["BandSelect", "Format"])
+
+    def test_band_select_and_format(self):
+        base = Op("DigitalGlobeStrip")(catId="1030010045539700")
+        op = Op("Format")(Op("BandSelect")(base, bandIndices=[3, 0]), dataType="1")
+        out = apply_local(self.arr - 10, split_graph(op)[1])
+        self.assertEqual(out.dtype, np.uint16)
+        np.testing.assert_array_equal(out, np.clip(self.arr[[3, 0]] - 10, 0, None))
+
+    def test_band_math(self):
+        base = Op("DigitalGlobeStrip")(catId="1030010045539700")
+        op = Op("BandMath")(base, expressions=["($3 - $2) / ($3 + $2)", "sqrt($0) * 2"])
+        out = apply_local(self.arr, split_graph(op)[1])
+        a = self.arr
+        np.testing.assert_allclose(out[0], (a[3] - a[2]) / (a[3] + a[2]))
+        np.testing.assert_allclose(out[1], np.sqrt(a[0]) * 2)
+
+    def test_band_math_rejects_code(self):
+        base = Op("DigitalGlobeStrip")(catId="1030010045539700")
+        op = Op("BandMath")(base, expressions=["__import__('os')"])
+        with self.assertRaises(ValueError):
+            apply_local(self.arr, split_graph(op)[1])
+
+
+class LocalImageTest(unittest.TestCase):
+    """ Local images of RDA ops, with the op metadata and the tile fetches mocked """
+
+    def setUp(self):
+        self.data = np.random.randint(0, 3000, (4, 64, 64)).astype(np.uint16)
+        self.base = Op("DigitalGlobeStrip")(catId="1030010045539700", correctionType="DN")
+        self.described, self.fetched = [], []
+        described, fetched, data = self.described, self.fetched, self.data
+
+        def metadata(op):
+            described.append(op._operator)
+            # the bands and data type of the op output
+            sample = apply_local(np.zeros((4, 1, 1), dtype=np.uint16), split_graph(op)[1])
+            data_type = {"uint16": "UNSIGNED_SHORT", "float32": "FLOAT"}[sample.dtype.name]
+            return {"image": {"numBands": sample.shape[0], "dataType": data_type, "tileXSize": 32, "tileYSize": 32,
+                              "minTileX": 0, "minTileY": 0, "maxTileX": 1, "maxTileY": 1,
+                              "minX": 0, "minY": 0, "maxX": 64, "maxY": 64,
+                              "imageBoundsWGS84": box(10, 20, 10.064, 20.064).wkt},
+                    "georef": {"spatialReferenceSystemCode": "EPSG:4326", "translateX": 10, "scaleX": 0.001,
+                               "shearX": 0, "translateY": 20.064, "shearY": 0, "scaleY": -0.001}}
+
+        def fetch(fetcher, x, y):
+            fetched.append(fetcher.url_template)
+            return data[:, 32 * y:32 * (y + 1), 32 * x:32 * (x + 1)]
+
+        patches = [patch.object(Op, "metadata", property(metadata)),
+                   patch.object(TileFetcher, "__call__", fetch)]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_local_image(self):
+        op = Op("Format")(Op("BandSelect")(self.base, bandIndices=[3, 0]), dataType="1")
+        ndvi = Op("BandMath")(self.base, expressions=["($3 - $2) / ($3 + $2)"])
+        rgb = local_image(op)
+        self.assertEqual(rgb.shape, (2, 64, 64))
+        np.testing.assert_array_equal(rgb.compute(), self.data[[3, 0]])
+        a = self.data.astype(np.float32)
+        np.testing.assert_allclose(ndvi.local().compute()[0], (a[3] - a[2]) / (a[3] + a[2]), rtol=1e-6)
+        self.assertAlmostEqual(rgb.affine.a, 0.001)
+        # only the base graph is described and fetched
+        self.assertEqual(set(self.described), {"DigitalGlobeStrip"})
+        self.assertEqual(set(self.fetched), {self.base._tile_url_template()})
+        self.assertEqual(len(self.fetched), 8)
+
+    def test_image_local_window(self):
+        op = Op("Format")(Op("BandSelect")(self.base, bandIndices=[2, 1]), dataType="1")
+        img = RDAImage(op)[:, 10:40, 5:30]
+        local = img.local()
+        self.assertEqual(local.shape, (2, 30, 25))
+        self.assertEqual(local.affine, img.affine)
+        np.testing.assert_array_equal(local.compute(), self.data[[2, 1], 10:40, 5:30])
+        self.assertEqual(set(self.fetched), {self.base._tile_url_template()})
+        with self.assertRaises(ValueError):
+            img[:1, ...].local()
@@ -0,0 +1,67 @@
+'''
+Unit tests for stacks of co-registered images
+'''
+import unittest
+
+import numpy as np
+import dask.array as da
+from affine import Affine
+from shapely.geometry import box, mapping
+
+from gbdxtools.images.meta import GeoDaskImage
+from gbdxtools.images.stack import stack, ImageStack
+from gbdxtools.rda.util import AffineTransform
+
+
+def geo_image(data, x, y):
+    gt = AffineTransform(Affine(2.0, 0.0, x, 0.0, -2.0, y), "EPSG:32616")
+    bounds = (x, y - 2 * data.shape[1], x + 2 * data.shape[2], y)
+    return GeoDaskImage(da.from_array(data, chunks=(data.shape[0], 32, 32)),
+                        __geo_interface__=mapping(box(*bounds)), __geo_transform__=gt)
+
+
+class StackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = [np.random.randint(1, 100, (2, 60, 80)).astype(np.uint16) for _ in range(3)]
+        # the second image is shifted by 10 pixels right and 5 down
+        self.images = [geo_image(self.data[0], 0.0, 120.0), geo_image(self.data[1], 20.0, 110.0),
+                       geo_image(self.data[2], 0.0, 120.0)]
+
+    def test_stack_grid(self):
+        st = stack(self.images, times=["2018-03", "2017-01", "2019-07"], chunk_size=32)
+        self.assertIsInstance(st, ImageStack)
+        self.assertEqual(st.shape, (3, 2, 65, 90))
+        self.assertEqual(st.chunks[0], (1, 1, 1))
+        self.assertEqual(st.times, ["2017-01", "2018-03", "2019-07"])
+        self.assertEqual(st.affine, Affine(2.0, 0.0, 0.0, 0.0, -2.0, 120.0))
+        self.assertEqual(st.bounds, (0.0, -10.0, 180.0, 120.0))
+        arr = st.compute()
+        np.testing.assert_array_equal(arr[0, :, 5:, 10:], self.data[1])
+        np.testing.assert_array_equal(arr[0, :, :5, :], 0)
+        np.testing.assert_array_equal(arr[1, :, :60, :80], self.data[0])
+        np.testing.assert_array_equal(arr[1, :, 60:, :], 0)
+        img = st.image(2)
+        self.assertEqual(img.affine, st.affine)
+        np.testing.assert_array_equal(img.compute()[:, :60, :80], self.data[2])
+
+    def test_stack_bounds(self):
+        st = stack(self.images, bounds=[20, 10, 160, 110], time_chunks=2)
+        self.assertEqual(st.shape, (3, 2, 50, 70))
+        self.assertEqual(st.chunks[0], (2, 1))
+        np.testing.assert_array_equal(st[1].compute(), self.data[1][:, :50, :70])
+
+    def test_reduce(self):
+        st = stack(self.images, chunk_size=32)
+        arr = st.compute().astype(np.float32)
+        arr[arr == 0] = np.nan
+        mean = st.reduce("mean")
+        self.assertEqual(mean.shape, (2, 65, 90))
+        self.assertEqual(mean.affine, st.affine)
+        np.testing.assert_allclose(mean.compute(), np.nan_to_num(np.nanmean(arr, axis=0)), rtol=1e-5)
+        np.testing.assert_allclose(st.reduce("median").compute(), np.nan_to_num(np.nanmedian(arr, axis=0)))
+        np.testing.assert_allclose(st.reduce(np.nanmax).compute(), np.nan_to_num(np.nanmax(arr, axis=0)))
+        # no image covers the bottom right corner
+        self.assertEqual(st.reduce("median").compute()[0, 64, 0], 0)
+        with self.assertRaises(ValueError):
+            st.reduce("mode")
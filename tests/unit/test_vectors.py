@@ -97,6 +97,84 @@ class TestVectors(unittest.TestCase):
 
         assert isinstance(g, types.GeneratorType)
         assert count == 310
+        assert v.query_stats["items"] == 310
+        assert v.query_stats["items_per_second"] > 0
+
+    def test_vectors_query_iteratively_prefetch(self):
+        v = Vectors()
+        v._query_pages = lambda *args: (page for page in [[1, 2], [3, 4], [5, 6]])
+        self.assertEqual(list(v.query_iteratively("POLYGON ((0 0, 1 0, 1 1, 0 0))", "q", count=5)), [1, 2, 3, 4, 5])
+        self.assertEqual(v.query_stats["items"], 5)
+        self.assertEqual(v.query_stats["pages"], 3)
+        self.assertEqual(list(v.query_iteratively("POLYGON ((0 0, 1 0, 1 1, 0 0))", "q", count=10, prefetch=0)),
+                         [1, 2, 3, 4, 5, 6])
+
+    def test_geohash_bounds(self):
+        from gbdxtools.vectors import geohash_bounds
+        self.assertEqual(geohash_bounds('s'), (0.0, 0.0, 45.0, 45.0))
+        self.assertEqual(geohash_bounds('s0'), (0.0, 0.0, 11.25, 5.625))
+
+    def test_partition_area(self):
+        from gbdxtools.vectors import partition_area
+        from shapely.geometry import box
+        buckets = [(box(0, 0, 10, 10), 20000), (box(90, 90, 100, 100), 10)]
+        cells = partition_area((0, 0, 100, 100), buckets, max_items=10000)
+        self.assertEqual(sorted(c.bounds for c in cells),
+                         [(0, 0, 6.25, 6.25), (0, 6.25, 6.25, 12.5), (6.25, 0, 12.5, 6.25),
+                          (6.25, 6.25, 12.5, 12.5), (50, 50, 100, 100)])
+        self.assertEqual(len(partition_area((0, 0, 100, 100), buckets, complete=False)), 13)
+
+    def test_vectors_query_partitioned(self):
+        from shapely.wkt import loads
+        v = Vectors()
+        v.aggregate_query = lambda *args, **kwargs: [{'name': 'geohash', 'terms': [
+            {'term': 's', 'count': 15000}, {'term': 'u', 'count': 50}]}]
+
+        def pages(wkt, *args, **kwargs):
+            left, lower, right, upper = loads(wkt).bounds
+            # every box finds a shared feature and one of its own
+            own = {'properties': {'id': '{},{}'.format(left, lower)}}
+            return (page for page in [[{'properties': {'id': 'shared'}}], [own]])
+
+        v._query_pages = pages
+        results = list(v.query_partitioned("POLYGON ((0 0, 90 0, 90 90, 0 90, 0 0))", "q", max_items=10000))
+        self.assertEqual(v.query_stats["partitions"], 5)
+        self.assertEqual(len(results), 6)
+        self.assertEqual(v.query_stats["duplicates"], 4)
+        self.assertEqual(len(set(r['properties']['id'] for r in results)), 6)
+        self.assertEqual(len(list(v.query_partitioned("POLYGON ((0 0, 90 0, 90 90, 0 90, 0 0))", "q", count=3))), 3)
+
+    def test_query_pages_remaining(self):
+        from mock import MagicMock
+        v = Vectors()
+        v.gbdx_connection = MagicMock()
+        v.gbdx_connection.get.return_value.json.return_value = {'next_paging_id': 'p', 'item_count': 2, 'data': [1, 2]}
+        v.gbdx_connection.post.return_value.json.return_value = {'next_paging_id': 'p', 'item_count': 2, 'data': [3, 4]}
+        # results the consumer still wants each time a box checks the shared budget
+        budget = iter([5, 3, 1, 0])
+        pages = list(v._query_pages("POLYGON ((0 0, 1 0, 1 1, 0 0))", "q", 100, '5m', None, page_size=2,
+                                    remaining=lambda: next(budget)))
+        self.assertEqual(len(pages), 3)
+        self.assertEqual(v.gbdx_connection.get.call_args[1]['params']['count'], 2)
+        v.gbdx_connection.reset_mock()
+        self.assertEqual(list(v._query_pages("POLYGON ((0 0, 1 0, 1 1, 0 0))", "q", 100, '5m', None,
+                                             remaining=lambda: 0)), [])
+        self.assertFalse(v.gbdx_connection.get.called)
+
+    def test_prefetch_iter(self):
+        from gbdxtools.vectors import prefetch_iter
+
+        def pages():
+            yield 1
+            yield 2
+            raise ValueError("page failed")
+
+        g = prefetch_iter(pages(), size=1)
+        self.assertEqual(next(g), 1)
+        self.assertEqual(next(g), 2)
+        with self.assertRaises(ValueError):
+            next(g)
+        self.assertEqual(list(prefetch_iter(iter(range(50)), size=3)), list(range(50)))
 
     @vcr.use_cassette('tests/unit/cassettes/test_vectors_create_single.yaml', filter_headers=['authorization'])
     def test_vectors_create_single(self):
@@ -165,6 +243,19 @@ class TestVectors(unittest.TestCase):
 
         assert len(results) == 2
 
+    def test_vectors_create_iteratively(self):
+        v = Vectors()
+        batches = []
+        v.create = lambda batch: batches.append(batch) or ['id'] * len(batch)
+        features = ({"type": "Feature",
+                     "geometry": {"type": "Point", "coordinates": [1.0, 1.0]},
+                     "properties": {"value": i}} for i in range(5))
+        ids = v.create_iteratively(features, item_type="type", ingest_source="source", batch_size=2)
+        self.assertEqual(len(ids), 5)
+        self.assertEqual([len(b) for b in batches], [2, 2, 1])
+        self.assertEqual(batches[2][0]["properties"],
+                         {"item_type": "type", "ingest_source": "source", "attributes": {"value": 4}})
+
     @vcr.use_cassette('tests/unit/cassettes/test_vectors_create_from_wkt.yaml', filter_headers=['authorization'])
     def test_vectors_create_from_wkt(self):
         v = Vectors()
@@ -8,11 +8,14 @@ Unit tests for the gbdxtools.Idaho class
 from gbdxtools import Interface
 from gbdxtools import CatalogImage, WV02, WV03_VNIR, WV03_SWIR, WV04
 from gbdxtools.rda.error import AcompUnavailable
+from gbdxtools.rda.util import calc_correction_coefficients, rda_calibration
 from auth_mock import gbdx
 import vcr
 from os.path import join, isfile, dirname, realpath
 import tempfile
 import unittest
+import pytest
+import numpy as np
 
 try:
     from urlparse import urlparse
@@ -44,6 +47,7 @@ class CatalogImageTest(unittest.TestCase):
         cls._temp_path = tempfile.mkdtemp()
         print("Created: {}".format(cls._temp_path))
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_wv_image_default.yaml', filter_headers=['authorization'])
     def test_basic_catalog_image(self):
         _id = '104001002838EC00'
@@ -53,6 +57,7 @@ class CatalogImageTest(unittest.TestCase):
         assert img.shape == (8, 79386, 10889)
         assert img.proj == 'EPSG:4326'
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_wv_image_acomp.yaml', filter_headers=['authorization'])
     def test_basic_catalog_acomp(self):
         _id = '1030010079016D00'
@@ -62,6 +67,7 @@ class CatalogImageTest(unittest.TestCase):
         assert img.shape == (8, 26331, 8741)
         assert img.proj == 'EPSG:4326'
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_wv_image_no_acomp.yaml', filter_headers=['authorization'])
     def test_basic_catalog_no_acomp(self):
         try:
@@ -70,6 +76,7 @@ class CatalogImageTest(unittest.TestCase):
         except AcompUnavailable:
             pass
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_wv_image_default_aoi.yaml', filter_headers=['authorization'])
     def test_cat_image_with_aoi(self):
         _id = '104001002838EC00'
@@ -78,6 +85,29 @@ class CatalogImageTest(unittest.TestCase):
         assert img.shape == (8, 3037, 3190)
         assert img.proj == 'EPSG:4326'
 
+    @pytest.mark.usefixtures("no_speculation")
+    @my_vcr.use_cassette('tests/unit/cassettes/test_wv_image_default_aoi.yaml', filter_headers=['authorization'])
+    def test_cat_image_local_correction(self):
+        _id = '104001002838EC00'
+        # the calibration is read from the RDA metadata of the image
+        img = self.gbdx.catalog_image(_id, bbox=[-85.81455230712892,10.416235163695223,-85.77163696289064,10.457089934231618],
+                                      local_correction=True)
+        self.assertEqual(img.options["correctionType"], "DN")
+        self.assertEqual(img._correction, "TOAREFLECTANCE")
+        self.assertEqual(img.dtype, np.float32)
+        calibration = rda_calibration(img.metadata)
+        for correction in ("DN", "RADIANCE", "TOAREFLECTANCE"):
+            for expected, actual in zip(calc_correction_coefficients(calibration, correction),
+                                        img._correction_coefficients(correction)):
+                np.testing.assert_allclose(actual, expected)
+        dn = img.correct("DN")
+        self.assertEqual(dn.dtype, np.uint16)
+        self.assertEqual(dn.shape, img.shape)
+        radiance = dn.correct("RADIANCE")
+        self.assertEqual(radiance._correction, "RADIANCE")
+        self.assertEqual(radiance.dtype, np.float32)
+
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_wv_image_proj.yaml', filter_headers=['authorization'])
     def test_cat_image_with_proj(self):
         _id = '104001002838EC00'
@@ -86,6 +116,7 @@ class CatalogImageTest(unittest.TestCase):
         assert img.shape == (8, 3059, 3160)
         assert img.proj == 'EPSG:3857' 
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_wv_image_aoi.yaml', filter_headers=['authorization'])
     def test_cat_image_aoi(self):
         _id = '104001002838EC00'
@@ -94,6 +125,7 @@ class CatalogImageTest(unittest.TestCase):
         aoi = img.aoi(bbox=[-85.81455230712892,10.416235163695223,-85.77163696289064,10.457089934231618])
         assert aoi.shape == (8, 3037, 3190)
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_wv_image_pan_band.yaml', filter_headers=['authorization'])
     def test_catalog_image_panchromatic(self):
         _id = '104001002838EC00'
@@ -103,6 +135,7 @@ class CatalogImageTest(unittest.TestCase):
         assert img.shape == (1, 317959, 43511)
         assert img.proj == 'EPSG:4326'
 
+    @pytest.mark.usefixtures("no_speculation")
     @my_vcr.use_cassette('tests/unit/cassettes/test_wv_image_pansharpen.yaml', filter_headers=['authorization'])
     def test_catalog_image_pansharpen(self):
         _id = '1040010039545B00'